@@ -0,0 +1,115 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+ARTIFACT_STORE_PATH = os.path.join(os.getcwd(), "chapter_artifacts.sqlite3")
+ARTIFACT_STORE_ENABLED = True  # Set to False to recompute every chapter artifact
+ARTIFACT_TYPES = ("summary", "positive_prompt", "negative_prompt", "trim")
+
+ARTIFACT_STORE = None
+
+def chapter_hash(chapter):
+    """Return the SHA-256 of a chapter's text, the key shared by every script."""
+    return hashlib.sha256(chapter.encode("utf-8")).hexdigest()
+
+class ArtifactStore:
+    """On-disk store of per-chapter derived artifacts keyed by chapter hash, artifact type and model."""
+
+    def __init__(self, path=ARTIFACT_STORE_PATH):
+        self.path = path
+        self.reused = 0
+        self.computed = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "chapter_hash TEXT, artifact_type TEXT, model TEXT, value TEXT, created_at REAL, "
+            "PRIMARY KEY (chapter_hash, artifact_type, model))"
+        )
+
+    def lookup(self, chapters, artifact_type, model_name):
+        """Return the stored artifact of each chapter, or None where it has not been computed yet."""
+        if artifact_type not in ARTIFACT_TYPES:
+            raise ValueError(f"Unknown artifact type '{artifact_type}', expected one of {ARTIFACT_TYPES}")
+        hashes = [chapter_hash(chapter) for chapter in chapters]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):  # Stay under SQLite's bound-parameter limit
+                batch = unique[start:start + 500]
+                found.update(self._conn.execute(
+                    f"SELECT chapter_hash, value FROM artifacts WHERE artifact_type = ? AND model = ? "
+                    f"AND chapter_hash IN ({', '.join('?' * len(batch))})",
+                    (artifact_type, model_name, *batch)
+                ).fetchall())
+            self.reused += sum(1 for key in hashes if key in found)
+        return [found.get(key) for key in hashes]
+
+    def store(self, chapter, artifact_type, model_name, value):
+        """Save one chapter artifact, replacing any earlier value."""
+        if artifact_type not in ARTIFACT_TYPES:
+            raise ValueError(f"Unknown artifact type '{artifact_type}', expected one of {ARTIFACT_TYPES}")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                (chapter_hash(chapter), artifact_type, model_name, value, time.time())
+            )
+            self.computed += 1
+
+    def print_stats(self):
+        """Print how many artifacts were reused and computed in this process."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+        print(f"Chapter artifacts: {self.reused} reused, {self.computed} computed, {entries} stored in {self.path}")
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+def get_artifact_store():
+    """Return the process-wide artifact store, or None when it is disabled."""
+    global ARTIFACT_STORE
+    if not ARTIFACT_STORE_ENABLED:
+        return None
+    if ARTIFACT_STORE is None:
+        ARTIFACT_STORE = ArtifactStore()
+    return ARTIFACT_STORE
+
+def load_chapter_artifacts(chapters, artifact_type, model_name):
+    """Return the stored artifact (or None) of each chapter, all None when the store is disabled."""
+    store = get_artifact_store()
+    if store is None:
+        return [None] * len(chapters)
+    return store.lookup(chapters, artifact_type, model_name)
+
+def save_chapter_artifact(chapter, artifact_type, model_name, value):
+    """Save a freshly computed artifact; empty values are not stored so they are retried next time."""
+    store = get_artifact_store()
+    if store is not None and value:
+        store.store(chapter, artifact_type, model_name, value)
+
+def fill_chapter_artifacts(chapters, artifact_type, model_name, compute):
+    """Return one artifact per chapter, calling compute(index, chapter) only for those not stored yet.
+
+    Each computed artifact is saved as soon as it is produced, so an interrupted run
+    resumes where it stopped and repeated chapters are only computed once.
+    """
+    artifacts = load_chapter_artifacts(chapters, artifact_type, model_name)
+    computed = {}
+    for index, chapter in enumerate(chapters):
+        if artifacts[index] is not None:
+            continue
+        if chapter not in computed:
+            computed[chapter] = compute(index, chapter)
+            save_chapter_artifact(chapter, artifact_type, model_name, computed[chapter])
+        artifacts[index] = computed[chapter]
+    return artifacts
+
+def print_artifact_store_stats():
+    """Print artifact reuse if the store was used in this process."""
+    if ARTIFACT_STORE is not None:
+        ARTIFACT_STORE.print_stats()
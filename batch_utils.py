@@ -0,0 +1,69 @@
+import os
+import hashlib
+from glob import glob
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from story_storage import write_json_atomic, read_json_file, chapter_log_path
+
+BATCH_MANIFEST_FILE = "batch_manifest.json"  # Records which storylines each batch task has already processed
+
+def file_sha256(path):
+    """Return the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(manifest_path=BATCH_MANIFEST_FILE):
+    """Load the batch manifest, or an empty one if it does not exist yet."""
+    if not os.path.exists(manifest_path):
+        return {}
+    return read_json_file(manifest_path)
+
+def find_pending_storylines(directory, task_name, output_path_for, manifest):
+    """List finished storylines whose derived output for a task is missing or older than the storyline."""
+    done = manifest.get(task_name, {})
+    pending = []
+    for source in sorted(glob(os.path.join(directory, "*_story.json"))):
+        if os.path.exists(chapter_log_path(source)):
+            continue  # Still being written by make_story
+        entry = done.get(os.path.abspath(source))
+        if entry and entry["source_sha256"] == file_sha256(source) and os.path.exists(output_path_for(source)):
+            continue
+        pending.append(source)
+    return pending
+
+def run_batch(task_name, process_file, directory, output_path_for, workers, manifest_path=BATCH_MANIFEST_FILE):
+    """Process every pending storyline in a worker pool and record finished ones in the manifest.
+
+    process_file must be a picklable callable taking a storyline path and returning its output path.
+    """
+    manifest = load_manifest(manifest_path)
+    pending = find_pending_storylines(directory, task_name, output_path_for, manifest)
+    if not pending:
+        print(f"No pending storylines for '{task_name}' in {directory}.")
+        return []
+
+    print(f"Processing {len(pending)} storylines for '{task_name}' with {workers} workers.")
+    fingerprints = {source: file_sha256(source) for source in pending}
+    completed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, source): source for source in pending}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                output_path = future.result()
+            except Exception as e:
+                print(f"Failed to process {source}: {e}")
+                continue
+            # Only the parent process writes the manifest, so no locking is needed
+            manifest.setdefault(task_name, {})[os.path.abspath(source)] = {
+                "source_sha256": fingerprints[source],
+                "output": output_path,
+                "completed_at": datetime.now().isoformat(timespec="seconds")
+            }
+            write_json_atomic(manifest_path, manifest)
+            completed.append(output_path)
+            print(f"Finished {source} -> {output_path} ({len(completed)}/{len(pending)})")
+    return completed
@@ -0,0 +1,327 @@
+import os
+import io
+import math
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import inspect
+import subprocess
+import sys
+import functools
+import contextlib
+from glob import glob
+from datetime import datetime
+import ollama_utils
+import artifact_store
+import call_metrics
+from mock_ollama_server import MockOllamaServer
+
+RESULTS_DIR = "benchmark_results"  # Each run is saved here as benchmark_<timestamp>.json
+STARTUP_COMMANDS = {  # Measured with `python -X importtime`; none of them should need the heavy modules below
+    "cli_help": ["storyline.py", "--help"],
+    "import_make_story": ["-c", "import make_story"],
+    "import_ollama_utils": ["-c", "import ollama_utils"]
+}
+HEAVY_MODULES = ("sklearn", "scipy", "numpy", "psutil", "requests", "httpx")
+
+class CallRecorder:
+    """Time wrapped functions by bucket while a pipeline runs, then restore the originals."""
+
+    def __init__(self):
+        self.timings = {}
+        self._patches = []
+
+    def _record(self, bucket, seconds):
+        self.timings.setdefault(bucket, []).append(seconds)
+
+    def wrap(self, owner, name, bucket):
+        """Replace owner.name with a wrapper that records its duration under bucket."""
+        original = getattr(owner, name)
+        recorder = self
+
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    recorder._record(bucket, time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    recorder._record(bucket, time.perf_counter() - start)
+
+        setattr(owner, name, wrapper)
+        self._patches.append((owner, name, original))
+
+    def restore(self):
+        """Put every wrapped function back."""
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize_timings(values):
+    """Count, total and p50/p95/p99 of a list of durations in seconds."""
+    return {
+        "count": len(values),
+        "total_seconds": sum(values),
+        "p50_seconds": percentile(values, 0.50),
+        "p95_seconds": percentile(values, 0.95),
+        "p99_seconds": percentile(values, 0.99)
+    }
+
+def run_pipeline(name, run, verbose):
+    """Run one pipeline with stdout silenced unless verbose, returning its wall time and output."""
+    call_metrics.CALL_METRICS = call_metrics.CallMetrics()  # Server counters of this pipeline only
+    start = time.perf_counter()
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with sink:
+        output = run()
+    wall_seconds = time.perf_counter() - start
+    print(f"{name}: {wall_seconds:.2f}s")
+    return wall_seconds, output
+
+def pipeline_report(wall_seconds, recorder, model_bucket, overhead_buckets, concurrent=False):
+    """Build the per-pipeline report from recorded timings."""
+    calls = recorder.timings.get(model_bucket, [])
+    report = {
+        "wall_seconds": wall_seconds,
+        "model_calls": len(calls),
+        "call_latency": summarize_timings(calls),
+        "client_overhead_seconds": {bucket: sum(recorder.timings.get(bucket, [])) for bucket in overhead_buckets},
+        "server_metrics": call_metrics.get_call_metrics().report()["callers"]
+    }
+    if not concurrent:
+        # Everything that is not waiting on the model is client-side work
+        report["client_overhead_seconds"]["total"] = max(0.0, wall_seconds - sum(calls))
+    return report
+
+def benchmark_story(workdir, args, recorder):
+    """Benchmark make_story.write_story_segment."""
+    import make_story
+    import story_storage
+    import near_duplicate_index
+
+    # Check mock chapters against a scratch corpus index instead of the real one
+    near_duplicate_index.NEAR_DUPLICATE_INDEX = near_duplicate_index.NearDuplicateIndex(
+        os.path.join(workdir, "near_duplicate_index.sqlite3"))
+
+    recorder.wrap(make_story, "get_story_response_from_model", "model_call")
+    recorder.wrap(make_story, "is_duplicate_line", "similarity")
+    recorder.wrap(make_story, "calculate_cosine_similarity", "similarity")
+    make_story.STORAGE_MODE = args.storage_mode or make_story.STORAGE_MODE
+    for storage_class in (story_storage.JsonStoryStorage, story_storage.JsonlStoryStorage,
+                          story_storage.IndexedStoryStorage):
+        recorder.wrap(storage_class, "record", "json_io")
+        recorder.wrap(storage_class, "finalize", "json_io")
+
+    json_file = os.path.join(workdir, "benchmark_story.json")
+    try:
+        wall_seconds, chapters = run_pipeline(
+            "story", lambda: make_story.write_story_segment(args.model, make_story.INITIAL_PROMPT, args.loops, json_file),
+            args.verbose
+        )
+    finally:
+        recorder.restore()
+        near_duplicate_index.NEAR_DUPLICATE_INDEX.close()
+        near_duplicate_index.NEAR_DUPLICATE_INDEX = None
+
+    report = pipeline_report(wall_seconds, recorder, "model_call", ("similarity", "json_io"))
+    accepted = len(chapters) - 1  # The first chapter is the initial prompt
+    report["loops"] = args.loops
+    report["loops_per_second"] = args.loops / wall_seconds if wall_seconds else None
+    report["accepted_chapters"] = accepted
+    report["calls_per_accepted_chapter"] = report["model_calls"] / accepted if accepted else None
+    return report, json_file
+
+def benchmark_summarize(story_file, args, recorder):
+    """Benchmark summarize_chapters.summarize_story_chapters."""
+    import summarize_chapters
+
+    recorder.wrap(summarize_chapters, "get_story_response_from_model", "model_call")
+    try:
+        wall_seconds, _ = run_pipeline(
+            "summarize", lambda: summarize_chapters.summarize_story_chapters(story_file, args.model),
+            args.verbose
+        )
+    finally:
+        recorder.restore()
+    return pipeline_report(wall_seconds, recorder, "model_call", ())
+
+def benchmark_prompts(story_file, args, recorder):
+    """Benchmark summarize_chapters_add_ai_prompts.summarize_story_chapters."""
+    import summarize_chapters_add_ai_prompts as prompts
+
+    recorder.wrap(prompts, "get_story_response_from_model", "model_call")
+    recorder.wrap(prompts, "get_story_response_from_model_async", "model_call")
+    try:
+        wall_seconds, _ = run_pipeline(
+            "prompts", lambda: prompts.summarize_story_chapters(story_file, args.model),
+            args.verbose
+        )
+    finally:
+        recorder.restore()
+    return pipeline_report(wall_seconds, recorder, "model_call", (), concurrent=prompts.ASYNC_MODE)
+
+def benchmark_trim(story_file, workdir, args, recorder):
+    """Benchmark trim_json.trim_story_file."""
+    import trim_json
+
+    recorder.wrap(trim_json, "get_story_response_from_model", "model_call")
+    pose_file = os.path.join(workdir, "benchmark_pose.json")
+    try:
+        wall_seconds, _ = run_pipeline(
+            "trim", lambda: trim_json.trim_story_file(story_file, pose_file),
+            args.verbose
+        )
+    finally:
+        recorder.restore()
+    return pipeline_report(wall_seconds, recorder, "model_call", ())
+
+def parse_importtime(stderr):
+    """Return (top-level module, cumulative microseconds) pairs and every module name from -X importtime output."""
+    top_level, modules = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # The header line
+        modules.append(name.strip())
+        if not name[1:].startswith(" "):
+            top_level.append((name.strip(), int(cumulative)))
+    return top_level, modules
+
+def benchmark_startup(args):
+    """Time the CLI's --help and the script imports in fresh interpreters, and list what they import."""
+    report = {}
+    for name, command in STARTUP_COMMANDS.items():
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", *command], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        wall_seconds = time.perf_counter() - start
+        top_level, modules = parse_importtime(result.stderr)
+        slowest = sorted(top_level, key=lambda pair: pair[1], reverse=True)[:10]
+        report[name] = {
+            "wall_seconds": wall_seconds,
+            "exit_code": result.returncode,
+            "import_seconds": sum(microseconds for _, microseconds in top_level) / 1e6,
+            "heavy_modules": [module for module in HEAVY_MODULES if module in modules],
+            "slowest_imports": [{"module": module, "seconds": microseconds / 1e6} for module, microseconds in slowest]
+        }
+        print(f"startup {name}: {wall_seconds:.2f}s, heavy modules: {', '.join(report[name]['heavy_modules']) or 'none'}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storyline pipelines against a local mock Ollama server.")
+    parser.add_argument("--pipelines", default="story,summarize,prompts,trim",
+                        help="Comma-separated pipelines to run: story, summarize, prompts, trim, startup")
+    parser.add_argument("--loops", type=int, default=20, help="Story loops to generate")
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--story-file", default=None,
+                        help="Existing *_story.json for the post-processing pipelines (default: the generated story)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=400.0, help="Mock generated tokens per second")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1, help="Mock probability of repeating a response")
+    parser.add_argument("--response-words", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--endpoints", type=int, default=1, help="Mock servers to balance calls across")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock probability of answering a call with 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Mock probability of a straggler response")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Mock extra seconds before a straggler's first token")
+    parser.add_argument("--storage-mode", choices=("jsonl", "json", "indexed"), default=None,
+                        help="make_story storage backend (default: its STORAGE_MODE)")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Leave the on-disk response cache and chapter artifact store enabled")
+    parser.add_argument("--output", default=None, help="Where to save the JSON results")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipelines' own output")
+    args = parser.parse_args()
+
+    pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    servers = [MockOllamaServer(latency=args.latency, token_rate=args.token_rate, duplicate_rate=args.duplicate_rate,
+                                response_words=args.response_words, seed=args.seed + index, error_rate=args.error_rate,
+                               slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+               for index in range(max(1, args.endpoints))]
+    urls = [server.start() for server in servers]
+    ollama_utils.OLLAMA_HOST = urls[0]
+    ollama_utils.OLLAMA_HOSTS = urls if len(urls) > 1 else []
+    ollama_utils.close_ollama_client()
+    ollama_utils.RESPONSE_CACHE_ENABLED = args.use_cache
+    artifact_store.ARTIFACT_STORE_ENABLED = args.use_cache
+    print(f"Mock Ollama server running on {', '.join(urls)}")
+
+    workdir = tempfile.mkdtemp(prefix="storyline_benchmark_")
+    story_file = args.story_file
+    results = {}
+    try:
+        if "startup" in pipelines:
+            results["startup"] = benchmark_startup(args)
+        if "story" in pipelines:
+            results["story"], generated_story = benchmark_story(workdir, args, CallRecorder())
+            story_file = story_file or generated_story
+        if story_file is None and any(name in pipelines for name in ("summarize", "prompts", "trim")):
+            # Post-processing on its own runs against the newest checked-in storyline
+            story_file = max(glob(os.path.join("storylines", "*_story.json")))
+        if story_file is not None:
+            # Work on a copy so derived outputs land in the scratch directory
+            story_copy = os.path.join(workdir, "input_story.json")
+            if os.path.abspath(story_file) != os.path.abspath(story_copy):
+                shutil.copy(story_file, story_copy)
+            story_file = story_copy
+        if "summarize" in pipelines:
+            results["summarize"] = benchmark_summarize(story_file, args, CallRecorder())
+        if "prompts" in pipelines:
+            results["prompts"] = benchmark_prompts(story_file, args, CallRecorder())
+        if "trim" in pipelines:
+            results["trim"] = benchmark_trim(story_file, workdir, args, CallRecorder())
+    finally:
+        ollama_utils.close_ollama_client()
+        for server in servers:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mock_server": {
+            "latency_seconds": args.latency,
+            "token_rate": args.token_rate,
+            "duplicate_rate": args.duplicate_rate,
+            "response_words": args.response_words,
+            "seed": args.seed,
+            "error_rate": args.error_rate,
+            "slow_rate": args.slow_rate,
+            "slow_latency_seconds": args.slow_latency,
+            "requests": sum(server.requests for server in servers),
+            "cancelled_requests": sum(server.cancellations for server in servers),
+            "endpoints": [{"url": url, "requests": server.requests, "errors": server.errors}
+                          for url, server in zip(urls, servers)]
+        },
+        "pipelines": results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["pipelines"], indent=2))
+    print(f"Benchmark results saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+METRICS_DIR = "metrics"  # Each run's report is written here as <timestamp>_<run>_metrics.json and .prom
+METRICS_RELOAD_SECONDS = 1.0  # A call whose load_duration exceeds this is counted as a model (re)load
+METRIC_PREFIX = "storyline_ollama"
+
+CALL_METRICS = None
+
+# Totals kept per (caller, model): name -> (Prometheus type, help text)
+COUNTERS = {
+    "calls": ("counter", "Model calls"),
+    "cached_calls": ("counter", "Calls served from the response cache"),
+    "failed_calls": ("counter", "Calls that returned no response because of an error"),
+    "cancelled_calls": ("counter", "Calls cancelled before they finished"),
+    "stopped_early_calls": ("counter", "Calls stopped at a word or character limit"),
+    "retries": ("counter", "Attempts repeated after a transport error, timeout or 5xx"),
+    "hedged_calls": ("counter", "Calls that sent a hedged duplicate request after passing their p95 latency"),
+    "model_reloads": ("counter", f"Calls that had to load the model (load_duration over {METRICS_RELOAD_SECONDS}s)"),
+    "prompt_tokens": ("counter", "Prompt tokens evaluated by the server"),
+    "generated_tokens": ("counter", "Tokens generated by the server"),
+    "prompt_eval_seconds": ("counter", "Server time spent evaluating prompts"),
+    "eval_seconds": ("counter", "Server time spent generating tokens"),
+    "load_seconds": ("counter", "Server time spent loading the model"),
+    "server_seconds": ("counter", "Total server time reported for the calls"),
+    "wall_seconds": ("counter", "Client wall time of the calls")
+}
+
+def _seconds(nanoseconds):
+    return (nanoseconds or 0) / 1e9
+
+class CallMetrics:
+    """Aggregate the per-call counters Ollama reports by caller and model."""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, caller, model_name, stats):
+        """Add one call's stats dict (as filled by get_story_response_from_model) to the totals."""
+        with self._lock:
+            totals = self.totals.setdefault((caller, model_name), dict.fromkeys(COUNTERS, 0))
+            totals["calls"] += 1
+            totals["cached_calls"] += bool(stats.get("cached"))
+            totals["failed_calls"] += bool(stats.get("failed"))
+            totals["cancelled_calls"] += bool(stats.get("cancelled"))
+            totals["stopped_early_calls"] += bool(stats.get("stopped_early"))
+            totals["retries"] += stats.get("retries") or 0
+            totals["hedged_calls"] += bool(stats.get("hedged"))
+            totals["model_reloads"] += _seconds(stats.get("load_duration")) > METRICS_RELOAD_SECONDS
+            totals["prompt_tokens"] += stats.get("prompt_eval_count") or 0
+            totals["generated_tokens"] += stats.get("eval_count") or 0
+            totals["prompt_eval_seconds"] += _seconds(stats.get("prompt_eval_duration"))
+            totals["eval_seconds"] += _seconds(stats.get("eval_duration"))
+            totals["load_seconds"] += _seconds(stats.get("load_duration"))
+            totals["server_seconds"] += _seconds(stats.get("total_duration"))
+            totals["wall_seconds"] += stats.get("total_time") or 0.0
+
+    @staticmethod
+    def derived(totals):
+        """Throughput and the prompt-vs-generation split of a set of totals."""
+        server_work = totals["prompt_eval_seconds"] + totals["eval_seconds"]
+        return {
+            "generation_tokens_per_second":
+                totals["generated_tokens"] / totals["eval_seconds"] if totals["eval_seconds"] else None,
+            "prompt_tokens_per_second":
+                totals["prompt_tokens"] / totals["prompt_eval_seconds"] if totals["prompt_eval_seconds"] else None,
+            "prompt_time_share": totals["prompt_eval_seconds"] / server_work if server_work else None
+        }
+
+    def report(self):
+        """Return the run's metrics per caller and model plus overall totals."""
+        with self._lock:
+            rows = [(caller, model, dict(totals)) for (caller, model), totals in sorted(self.totals.items())]
+        overall = dict.fromkeys(COUNTERS, 0)
+        for _, _, totals in rows:
+            for name in COUNTERS:
+                overall[name] += totals[name]
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "callers": [{"caller": caller, "model": model, **totals, **self.derived(totals)}
+                        for caller, model, totals in rows],
+            "total": {**overall, **self.derived(overall)}
+        }
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+        for name, (metric_type, help_text) in COUNTERS.items():
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for row in report["callers"]:
+                lines.append(f'{metric}{{caller="{row["caller"]}",model="{row["model"]}"}} {row[name]}')
+        for name in ("generation_tokens_per_second", "prompt_tokens_per_second", "prompt_time_share"):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for row in report["callers"]:
+                if row[name] is not None:
+                    lines.append(f'{metric}{{caller="{row["caller"]}",model="{row["model"]}"}} {row[name]:.6g}')
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, json_path):
+        """Write the JSON report and a Prometheus .prom file next to it."""
+        os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        prom_path = f"{os.path.splitext(json_path)[0]}.prom"
+        with open(prom_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        return json_path, prom_path
+
+    def print_summary(self):
+        """Print calls, tokens/sec and the prompt share of server time per caller."""
+        for row in self.report()["callers"]:
+            rate = row["generation_tokens_per_second"]
+            share = row["prompt_time_share"]
+            print(f"  {row['caller']:<18} {row['calls']:>5} calls ({row['cached_calls']} cached, "
+                  f"{row['failed_calls']} failed, {row['retries']} retries, {row['hedged_calls']} hedged), "
+                  f"{row['generated_tokens']} tokens at "
+                  f"{f'{rate:.1f}' if rate is not None else 'n/a'} tok/s, "
+                  f"{f'{share * 100:.0f}%' if share is not None else 'n/a'} of server time on prompts, "
+                  f"{row['model_reloads']} reloads")
+
+def get_call_metrics():
+    """Return the process-wide call metrics, creating them on first use."""
+    global CALL_METRICS
+    if CALL_METRICS is None:
+        CALL_METRICS = CallMetrics()
+    return CALL_METRICS
+
+def record_call(caller, model_name, stats):
+    """Record one model call under a caller tag."""
+    get_call_metrics().record(caller or "other", model_name, stats)
+
+def write_call_metrics_report(run_name, directory=METRICS_DIR):
+    """Print the per-caller summary and write this run's JSON and Prometheus reports, if any call was made."""
+    if CALL_METRICS is None or not CALL_METRICS.totals:
+        return None
+    print("Model call metrics:")
+    CALL_METRICS.print_summary()
+    timestamp = CALL_METRICS.started_at.strftime("%Y-%m-%d_%H-%M-%S")
+    json_path, prom_path = CALL_METRICS.write_report(os.path.join(directory, f"{timestamp}_{run_name}_metrics.json"))
+    print(f"Call metrics saved to {json_path} and {prom_path}")
+    return json_path
@@ -0,0 +1,314 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Applied to every model call by get_story_response_from_model, keyed by the call's caller tag
+DEFAULT_CALL_POLICY = {
+    "timeout": None,  # Read timeout in seconds between streamed chunks; None uses OLLAMA_REQUEST_TIMEOUT
+    "retries": 3,  # Extra attempts after a transport error, timeout or 5xx
+    "backoff_base": 0.5,  # Seconds before the first retry, doubled for each further one (with full jitter)
+    "backoff_max": 15.0,
+    "hedge": False  # Send a duplicate request once an attempt runs past the caller's p95 latency
+}
+CALL_POLICIES = {  # caller tag -> overrides of DEFAULT_CALL_POLICY
+    "continuation": {"hedge": True},
+    "chapter_summary": {"timeout": 120, "hedge": True},
+    "ai_prompt": {"timeout": 120, "hedge": True},
+    "chapter_fields": {"timeout": 120, "hedge": True},
+    "trim": {"timeout": 120, "hedge": True}
+}
+HEDGE_MIN_SAMPLES = 20  # Successful calls of a caller needed before its p95 latency is used to hedge
+HEDGE_PERCENTILE = 0.95
+HEDGE_WORKERS = 32  # Threads that run hedged attempts
+LATENCY_WINDOW = 200  # Most recent latencies kept per caller
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failed attempts that open the circuit
+CIRCUIT_COOLDOWN = 5.0  # Seconds the circuit stays open before one trial call; doubled after each failed trial
+CIRCUIT_MAX_COOLDOWN = 60.0
+CIRCUIT_MAX_WAIT = 600.0  # A caller gives up after waiting this long for the circuit to close
+
+LATENCY_TRACKER = None
+CIRCUIT_BREAKER = None
+HEDGE_EXECUTOR = None
+_SINGLETON_LOCK = threading.Lock()
+
+class CircuitOpenError(Exception):
+    """Raised when a caller has waited CIRCUIT_MAX_WAIT seconds without the circuit closing."""
+
+def get_call_policy(caller):
+    """Return the call policy of a caller tag."""
+    return {**DEFAULT_CALL_POLICY, **CALL_POLICIES.get(caller, {})}
+
+def backoff_delay(retry, policy):
+    """Seconds to sleep before a retry: exponential backoff with full jitter."""
+    return random.uniform(0, min(policy["backoff_max"], policy["backoff_base"] * 2 ** retry))
+
+class LatencyTracker:
+    """Recent successful call latencies per caller, for the hedging threshold."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, caller, seconds):
+        with self._lock:
+            self._latencies.setdefault(caller, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, caller, fraction=HEDGE_PERCENTILE, min_samples=HEDGE_MIN_SAMPLES):
+        """Nearest-rank percentile of a caller's recent latencies, or None with too few samples."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(caller, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+class CircuitBreaker:
+    """Pause every caller while the model service is down instead of letting each one fail on its own.
+
+    After CIRCUIT_FAILURE_THRESHOLD consecutive failed attempts the circuit opens and
+    callers wait out the cooldown. Then a single trial call is let through: success
+    closes the circuit, failure reopens it with a doubled cooldown. Callers pass a token
+    of their own, so only the call holding the trial can fail or release it.
+    """
+
+    def __init__(self, failure_threshold=None, cooldown=None, max_cooldown=None):
+        self.failure_threshold = failure_threshold or CIRCUIT_FAILURE_THRESHOLD
+        self.base_cooldown = cooldown or CIRCUIT_COOLDOWN
+        self.max_cooldown = max_cooldown or CIRCUIT_MAX_COOLDOWN
+        self.cooldown = self.base_cooldown
+        self.failures = 0
+        self.open_until = None
+        self.trial = None  # Token of the call let through as the trial
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def wait_time(self, token=None):
+        """Return 0 if a call may go ahead now, otherwise the seconds to wait before asking again.
+
+        Once the cooldown is over the first caller is given the trial, recorded under its token.
+        """
+        with self._lock:
+            if self.open_until is None:
+                return 0.0
+            remaining = self.open_until - time.time()
+            if remaining > 0:
+                return remaining
+            if self.trial is not None:
+                return min(1.0, self.cooldown)
+            self.trial = token if token is not None else object()
+            return 0.0
+
+    def record_success(self, token=None):
+        with self._lock:
+            if self.open_until is not None:
+                print("Model service answered again; closing the circuit.")
+            self.failures = 0
+            self.open_until = None
+            self.trial = None
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self, token=None):
+        with self._lock:
+            self.failures += 1
+            if self.trial is not None and self.trial is token:
+                self.trial = None
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.open_until is not None:
+                return  # Already open; a late failure of a call that started before it opened
+            elif self.failures < self.failure_threshold:
+                return
+            self.open_until = time.time() + self.cooldown
+            self.times_opened += 1
+        print(f"Model service failed {self.failures} times in a row; pausing calls for {self.cooldown:.0f} seconds.")
+
+    def release_trial(self, token):
+        """Give up the trial without a verdict (e.g. the call was cancelled) so another caller can take it."""
+        with self._lock:
+            if self.trial is not None and self.trial is token:
+                self.trial = None
+
+def _singleton(name, factory):
+    with _SINGLETON_LOCK:
+        if globals()[name] is None:
+            globals()[name] = factory()
+        return globals()[name]
+
+def get_latency_tracker():
+    """Return the process-wide latency tracker."""
+    return _singleton("LATENCY_TRACKER", LatencyTracker)
+
+def get_circuit_breaker():
+    """Return the process-wide circuit breaker."""
+    return _singleton("CIRCUIT_BREAKER", CircuitBreaker)
+
+def _get_hedge_executor():
+    return _singleton("HEDGE_EXECUTOR", lambda: ThreadPoolExecutor(max_workers=HEDGE_WORKERS,
+                                                                    thread_name_prefix="hedged-call"))
+
+class AnyEvent:
+    """Read-only view that is set as soon as any of several threading.Events (or None) is set."""
+
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+def _hedged(run_attempt, delay, cancel_event):
+    """Run an attempt, starting a duplicate if it is still going after delay seconds.
+
+    Returns (result, attempt_stats, hedged) of the first attempt to succeed and stops the
+    other one; raises the first error if both fail.
+    """
+    attempts = {}
+
+    def start():
+        attempt_stats, own_cancel = {}, threading.Event()
+        future = _get_hedge_executor().submit(run_attempt, attempt_stats, AnyEvent(own_cancel, cancel_event))
+        attempts[future] = (attempt_stats, own_cancel)
+
+    start()
+    if not wait(attempts, timeout=delay).done:
+        print(f"Call is slower than its p95 latency of {delay:.2f}s; sending a hedged duplicate request.")
+        start()
+    pending, first_error = set(attempts), None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                first_error = first_error or future.exception()
+                continue
+            for other in pending:
+                attempts[other][1].set()  # Drop the slower request's stream
+            return future.result(), attempts[future][0], len(attempts) > 1
+    raise first_error
+
+async def _hedged_async(run_attempt, delay):
+    """Async counterpart of _hedged; the slower task is cancelled."""
+    attempts = {}
+
+    def start():
+        attempt_stats = {}
+        attempts[asyncio.ensure_future(run_attempt(attempt_stats))] = attempt_stats
+
+    start()
+    done, _ = await asyncio.wait(attempts, timeout=delay)
+    if not done:
+        print(f"Call is slower than its p95 latency of {delay:.2f}s; sending a hedged duplicate request.")
+        start()
+    pending, first_error = set(attempts), None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                first_error = first_error or task.exception()
+                continue
+            for other in pending:
+                other.cancel()
+            return task.result(), attempts[task], len(attempts) > 1
+    raise first_error
+
+def _wait_for_circuit(breaker, cancel_event, token):
+    waited = 0.0
+    while (delay := breaker.wait_time(token)) > 0:
+        if waited >= CIRCUIT_MAX_WAIT:
+            raise CircuitOpenError(f"Model service still unavailable after waiting {waited:.0f} seconds")
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        time.sleep(min(delay, 1.0))
+        waited += min(delay, 1.0)
+
+async def _wait_for_circuit_async(breaker, token):
+    waited = 0.0
+    while (delay := breaker.wait_time(token)) > 0:
+        if waited >= CIRCUIT_MAX_WAIT:
+            raise CircuitOpenError(f"Model service still unavailable after waiting {waited:.0f} seconds")
+        await asyncio.sleep(min(delay, 1.0))
+        waited += min(delay, 1.0)
+
+def _finish_attempt(caller, stats, result, attempt_stats, hedged, retries):
+    stats.update(attempt_stats)
+    stats.update(retries=retries, hedged=hedged)
+    if not stats.get("cancelled") and stats.get("total_time") is not None:
+        get_latency_tracker().record(caller, stats["total_time"])
+    return result
+
+def call_with_policy(caller, run_attempt, stats, is_retryable, cancel_event=None):
+    """Run run_attempt(attempt_stats, cancel_event) under the caller's call policy.
+
+    Every attempt first waits for the circuit breaker. A retryable error (per
+    is_retryable) is retried after an exponential backoff with jitter; once the caller
+    has enough history, an attempt that passes its p95 latency is hedged with a
+    duplicate. The winning attempt's stats are copied into stats along with the retry
+    count and whether it was hedged. The last error is raised when every attempt fails.
+    """
+    policy = get_call_policy(caller)
+    breaker = get_circuit_breaker()
+    token = object()  # Identifies this call to the breaker if it is given the trial
+    for attempt in range(policy["retries"] + 1):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1, policy))
+        try:
+            _wait_for_circuit(breaker, cancel_event, token)
+            if cancel_event is not None and cancel_event.is_set():
+                stats.update(cancelled=True, retries=attempt)
+                return None
+            delay = get_latency_tracker().percentile(caller) if policy["hedge"] else None
+            try:
+                if delay is None:
+                    attempt_stats = {}
+                    result, hedged = run_attempt(attempt_stats, cancel_event), False
+                else:
+                    result, attempt_stats, hedged = _hedged(run_attempt, delay, cancel_event)
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success(token)  # The service answered; the request itself was bad
+                    stats["retries"] = attempt
+                    raise
+                breaker.record_failure(token)
+                stats["retries"] = attempt
+                if attempt == policy["retries"]:
+                    raise
+                print(f"Model call failed ({e}); retrying ({attempt + 1}/{policy['retries']})...")
+                continue
+            if not attempt_stats.get("cancelled"):
+                breaker.record_success(token)
+            return _finish_attempt(caller, stats, result, attempt_stats, hedged, attempt)
+        finally:
+            breaker.release_trial(token)  # Only still held if the call was cancelled or interrupted
+
+async def call_with_policy_async(caller, run_attempt, stats, is_retryable):
+    """Async counterpart of call_with_policy; run_attempt(attempt_stats) is a coroutine function."""
+    policy = get_call_policy(caller)
+    breaker = get_circuit_breaker()
+    token = object()
+    for attempt in range(policy["retries"] + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt - 1, policy))
+        try:
+            await _wait_for_circuit_async(breaker, token)
+            delay = get_latency_tracker().percentile(caller) if policy["hedge"] else None
+            try:
+                if delay is None:
+                    attempt_stats = {}
+                    result, hedged = await run_attempt(attempt_stats), False
+                else:
+                    result, attempt_stats, hedged = await _hedged_async(run_attempt, delay)
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success(token)
+                    stats["retries"] = attempt
+                    raise
+                breaker.record_failure(token)
+                stats["retries"] = attempt
+                if attempt == policy["retries"]:
+                    raise
+                print(f"Model call failed ({e}); retrying ({attempt + 1}/{policy['retries']})...")
+                continue
+            breaker.record_success(token)
+            return _finish_attempt(caller, stats, result, attempt_stats, hedged, attempt)
+        finally:
+            breaker.release_trial(token)  # Only still held if the task was cancelled
@@ -1,19 +1,23 @@
 import os
 import time
 import json
+import re
 import random
 import atexit
+import threading
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from similarity_index import SimilarityIndex, text_similarity
+from story_storage import open_story_storage, load_story_checkpoint, story_json_path
+from call_metrics import write_call_metrics_report
 from ollama_utils import (
     install_and_setup_ollama,
     kill_existing_ollama_service,
     clear_gpu_memory,
-    start_ollama_service_windows,
+    start_ollama_service,
     stop_ollama_service,
-    is_windows,
-    get_story_response_from_model
+    get_story_response_from_model,
+    OllamaUnavailableError
 )
 
 MODEL_NAME = 'llama3'
@@ -22,8 +26,22 @@ LOOPS = 333
 MAX_RETRIES = 5
 PERSONA_TO_USE = 'Stephen King'
 COSINE_SIMILARITY_THRESHOLD = 0.8  # Set the similarity threshold to retry
-SUMMARY_COSINE_SIMILARITY_THRESHOLD = 0.6  # Similar threshold for summary updates
-
+SUMMARY_COSINE_SIMILARITY_THRESHOLD = 0.6  # A rewritten summary scoring above this adds too little, so the previous one is kept
+STORAGE_MODE = 'jsonl'  # 'jsonl' appends each chapter to a log and writes the JSON once at the end; 'json' rewrites it every loop; 'indexed' keeps the chapters in a memory-mapped store (for very long stories)
+CHAPTER_LOG_FSYNC = 'always'  # fsync policy for the chapter log: 'always', 'interval' or 'never'
+SPECULATIVE_CANDIDATES = 0  # Fire this many continuation requests at once per loop instead of retrying one at a time (0 or 1 disables)
+SPECULATIVE_ACCEPT = 'first'  # 'first' keeps the first non-duplicate candidate, 'best' waits for all and keeps the least similar one
+OUTPUT_DIR = 'storylines'  # Where new stories are written as <timestamp>_story.json
+JSON_FILE = None  # Output path of a new story; None picks a new timestamped file in OUTPUT_DIR
+RESUME_FROM = None  # Path to an interrupted *_story.json (or its .log.jsonl) to continue instead of starting a new story
+SUMMARY_STRATEGY = 'batched'  # 'every' rewrites the summary after each chapter, 'batched' every SUMMARY_UPDATE_INTERVAL chapters, 'hierarchical' summarizes chunks of chapters and merges them into the top-level summary
+SUMMARY_UPDATE_INTERVAL = 4  # Chapters buffered per summary update (or chunk summary) for the 'batched' and 'hierarchical' strategies
+HIERARCHICAL_MERGE_INTERVAL = 3  # Chunk summaries collected before they are merged into the top-level summary
+PROMPT_MODE = 'stable_prefix'  # 'stable_prefix' sends the invariant instructions as a byte-stable system message so the server's prompt cache is reused; 'single' sends one combined user message
+SIMILARITY_WINDOW = 3  # Number of most recent chapters a new line is checked against; None checks the whole story
+CORPUS_DUPLICATE_CHECK = True  # Also reject lines that nearly repeat a chapter of any storyline in the output directory (see near_duplicate_index.py)
+
+MAX_RESPONSE_WORDS = 100  # Generation is stopped once a continuation goes past this many words (matches CONSTRAINT_REMINDER)
 CONSTRAINT_REMINDER = "Remember, the response should be only 2 or 3 sentences with a maximum of 100 words in total."
 
 PHASE_INSTRUCTIONS = {
@@ -44,6 +62,24 @@ USER_MESSAGE_TEMPLATE = (
     + CONSTRAINT_REMINDER
 )
 
+# Stable-prefix variant of USER_MESSAGE_TEMPLATE: the system message only depends on the persona, so it is
+# identical for every loop, and the user message goes from the least to the most frequently changing parts.
+SYSTEM_MESSAGE_TEMPLATE = (
+    "We are writing a story together in the style of {persona}. "
+    "Continue the story creatively, making bold assumptions about what could happen next. "
+    "Address core issues of the storyline and transition smoothly to the next scene. "
+    "Maintain an imaginative style fitting {persona}'s narrative while keeping responses to "
+    "2 or 3 sentences and a maximum of 100 words. "
+    + CONSTRAINT_REMINDER
+)
+
+LOOP_MESSAGE_TEMPLATE = (
+    "{phase_instructions} Each response should imply {ending}. "
+    "Here is a summary of the story so far: {summary}. "
+    "The current story is: {current_story}. "
+    + CONSTRAINT_REMINDER
+)
+
 SUMMARY_UPDATE_TEMPLATE = (
     "Here is the current summary of the story: \"{current_summary}\". "
     "The latest addition to the story is: \"{latest_addition}\". "
@@ -58,15 +94,26 @@ COMPLETE_SYNOPSIS_TEMPLATE = (
     "Keep the synopsis limited to 6-7 sentences and less than 900 characters. Return only the synopsis, nothing else."
 )
 
-CHARACTER_DESCRIPTION_TEMPLATE = "Create and describe in detail the main character 250 characters or less, reply with ONLY the description. Here is a complete synopsis: {complete_synopsis}."
+CHUNK_SUMMARY_TEMPLATE = (
+    "Summarize the following consecutive part of a story in 2-3 sentences and less than 400 characters, "
+    "keeping the names, places and events that matter: \"{lines}\". Only return the summary, nothing else."
+)
+
+MERGE_SUMMARY_TEMPLATE = (
+    "Here is the current summary of the story: \"{current_summary}\". "
+    "Here are summaries of the most recent parts of the story, in order: \"{chunk_summaries}\". "
+    "Merge them into one overall summary of 4-5 sentences and 750 characters that encourages someone to read more. "
+    "Only return the revised summary in your response, nothing else."
+)
 
-# Ensure the directory for saving JSON files exists
-output_dir = "storylines"
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+CHARACTER_DESCRIPTION_TEMPLATE = "Create and describe in detail the main character 250 characters or less, reply with ONLY the description. Here is a complete synopsis: {complete_synopsis}."
 
-timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-JSON_FILE = os.path.join(output_dir, f"{timestamp}_story.json")
+def new_story_json_path(output_dir=None):
+    """Return a new timestamped *_story.json path, creating the output directory if needed."""
+    output_dir = output_dir or OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    return os.path.join(output_dir, f"{timestamp}_story.json")
 
 def get_story_context(current_story, initial_prompt, retry_count):
     """Generate context for the story based on retry count."""
@@ -90,6 +137,15 @@ def generate_summary(current_story):
     summary = summary if len(summary) <= 750 else summary[:747] + "..."
     return ensure_proper_ending(summary)
 
+def limit_to_words(text, max_words):
+    """Cut text down to max_words, ending at the last complete sentence when there is one."""
+    words = text.split()
+    if len(words) <= max_words:
+        return text
+    clipped = " ".join(words[:max_words])
+    last_sentence = re.match(r'.*[.!?]["\']?', clipped, re.S)
+    return last_sentence.group(0) if last_sentence else clipped + "..."
+
 def ensure_proper_ending(summary):
     """Ensure the summary ends correctly with common abbreviations and exactly three ellipses."""
     abbreviations = ["Dr.", "Mr.", "Ms.", "Mrs.", "Jr.", "Sr.", "St.", "etc."]
@@ -110,34 +166,28 @@ def get_phase(loop_index, total_loops):
 
 def calculate_cosine_similarity(text1, text2):
     """Calculate the cosine similarity between two texts."""
-    vectorizer = TfidfVectorizer().fit_transform([text1, text2])
-    vectors = vectorizer.toarray()
-    return cosine_similarity(vectors)[0, 1]
+    return text_similarity(text1, text2)
 
 def enhance_summary(current_summary, latest_addition):
     """Enhance the overall summary with the latest story addition."""
     summary_prompt = SUMMARY_UPDATE_TEMPLATE.format(current_summary=current_summary, latest_addition=latest_addition)
-    enhanced_summary = get_story_response_from_model(MODEL_NAME, summary_prompt).strip()
-    return enhanced_summary
+    enhanced_summary = get_story_response_from_model(MODEL_NAME, summary_prompt, caller="summary_update") or ""
+    return enhanced_summary.strip()
 
 def generate_complete_synopsis(current_story, final_summary):
     """Generate a complete synopsis from selected lines in the story."""
     if len(current_story) < 8:
-        selected_lines = current_story
+        selected_lines = list(current_story)  # May be a ChapterStore
     else:
         selected_lines = []
         selected_lines.extend(current_story[:3])  # First 3 lines
         selected_lines.extend(current_story[-3:])  # Last 3 lines
-        remaining_indexes = list(range(3, len(current_story) - 3))
-        random.shuffle(remaining_indexes)
-        selected_lines.extend([
-            current_story[remaining_indexes[0]],
-            current_story[remaining_indexes[1]]
-        ])  # 2 random lines in the middle
+        middle_indexes = random.sample(range(3, len(current_story) - 3), 2)
+        selected_lines.extend(current_story[index] for index in middle_indexes)  # 2 random lines in the middle
 
     selected_lines_text = " ".join(selected_lines)
     synopsis_prompt = COMPLETE_SYNOPSIS_TEMPLATE.format(selected_lines=selected_lines_text, summary=final_summary)
-    complete_synopsis = get_story_response_from_model(MODEL_NAME, synopsis_prompt).strip()
+    complete_synopsis = (get_story_response_from_model(MODEL_NAME, synopsis_prompt, caller="synopsis") or "").strip()
     
     print("\nSelected lines for final synopsis:\n", json.dumps(selected_lines, indent=2))
     print("\nFinal story summary included in the synopsis:\n", final_summary)
@@ -145,27 +195,242 @@ def generate_complete_synopsis(current_story, final_summary):
     
     return complete_synopsis
 
-def write_story_segment(model_name, prompt, loops, json_file):
-    """Generate story segments and save them to a file."""
-    current_story = [prompt]
-    overall_summary = generate_summary(current_story)
-    
-    initial_data = {
-        "story_chapters": current_story,
-        "story_summary": overall_summary
-    }
-
-    # Initialize the JSON file with the initial data
-    with open(json_file, 'w') as f:
-        json.dump(initial_data, f, indent=2)
-
-    for loop_index in range(loops):
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-            current_story = data["story_chapters"]
-            overall_summary = data["story_summary"]
-
-        retry_count = 0
+def build_continuation_prompt(story_context, summary, ending, phase_instructions, persona=None):
+    """Return the (system_message, user_message) pair for a continuation request in the configured PROMPT_MODE."""
+    persona = persona or PERSONA_TO_USE
+    if PROMPT_MODE == 'stable_prefix':
+        return (
+            SYSTEM_MESSAGE_TEMPLATE.format(persona=persona),
+            LOOP_MESSAGE_TEMPLATE.format(
+                current_story=story_context, summary=summary, ending=ending,
+                phase_instructions=phase_instructions
+            )
+        )
+    return None, USER_MESSAGE_TEMPLATE.format(
+        current_story=story_context, persona=persona,
+        summary=summary, ending=ending,
+        phase_instructions=phase_instructions
+    )
+
+def print_call_stats(stats):
+    """Print the streaming and prompt-evaluation figures of a model call."""
+    print(f"Time to first token: {stats['time_to_first_token'] or 0:.2f}s, total: {stats['total_time'] or 0:.2f}s"
+          f"{' (stopped at the word limit)' if stats['stopped_early'] else ''}, "
+          f"prompt tokens evaluated: {stats['prompt_eval_count'] if stats['prompt_eval_count'] is not None else 'n/a'}")
+
+def print_candidate_line(next_line):
+    """Print a candidate line returned by the model."""
+    print("\n" + "*" * 40)
+    print("*" * 40)
+    print(f"****\n\n{next_line}\n\n****")
+    print("*" * 40)
+    print("*" * 40 + "\n")
+
+def is_duplicate_line(next_line, current_story, similarity_index, corpus_index=None):
+    """Check for duplicates using cosine similarity with the chapters in the similarity window,
+    then against every indexed storyline when a corpus index is given."""
+    for idx, similarity_score in similarity_index.scores(next_line):
+        print(f"Checking similarity between current line and previous line {idx + 1}: {similarity_score}")
+        if similarity_score > COSINE_SIMILARITY_THRESHOLD:
+            print(f"Current line: {next_line}")
+            print(f"Previous line {idx + 1}: {current_story[idx]}")
+            return True
+    if corpus_index is not None:
+        duplicate = corpus_index.find_duplicate(next_line)
+        if duplicate is not None:
+            similarity_score, source = duplicate
+            print(f"Current line nearly repeats a chapter of {source} (estimated Jaccard similarity {similarity_score:.2f})")
+            return True
+    return False
+
+class SummaryMaintainer:
+    """Keep the running story summary up to date using one of the SUMMARY_STRATEGY strategies."""
+
+    def __init__(self, summary, strategy=None, interval=None, state=None, chapters=(), merge_interval=None):
+        self.summary = summary
+        self.strategy = strategy or SUMMARY_STRATEGY
+        self.interval = 1 if self.strategy == 'every' else (interval or SUMMARY_UPDATE_INTERVAL)
+        self.merge_interval = merge_interval or HIERARCHICAL_MERGE_INTERVAL
+        if self.strategy not in ('every', 'batched', 'hierarchical'):
+            raise ValueError(f"Unknown summary strategy '{self.strategy}'")
+        self.pending_lines = []
+        self.chunk_summaries = []
+        if state:  # Restored from a checkpoint: the pending lines are the story's last chapters
+            self.pending_lines = [chapters[index] for index in range(len(chapters) - state["pending_lines"], len(chapters))]
+            self.chunk_summaries = list(state["chunk_summaries"])
+
+    def state(self):
+        """Return the buffered work to checkpoint along with the summary."""
+        return {"pending_lines": len(self.pending_lines), "chunk_summaries": list(self.chunk_summaries)}
+
+    def add_line(self, line):
+        """Buffer an accepted line and update the summary once the buffer is full.
+
+        The 'hierarchical' strategy turns a full buffer into a chunk summary and only
+        merges the chunk summaries into the summary once merge_interval have piled up.
+        """
+        self.pending_lines.append(line)
+        if len(self.pending_lines) < self.interval:
+            return self.summary
+        if self.strategy != 'hierarchical':
+            return self.flush()
+        self._summarize_chunk()
+        if len(self.chunk_summaries) >= self.merge_interval:
+            self._merge_chunks()
+        return self.summary
+
+    def flush(self):
+        """Fold any buffered lines (and chunk summaries) into the summary and return it."""
+        if self.strategy == 'hierarchical':
+            self._summarize_chunk()
+            self._merge_chunks()
+        elif self.pending_lines:
+            lines = " ".join(self.pending_lines)
+            self.pending_lines = []
+            self.summary = choose_summary(self.summary, enhance_summary(self.summary, lines))
+        return self.summary
+
+    def _summarize_chunk(self):
+        """Summarize the buffered lines as one chunk."""
+        if not self.pending_lines:
+            return
+        chunk_prompt = CHUNK_SUMMARY_TEMPLATE.format(lines=" ".join(self.pending_lines))
+        self.pending_lines = []
+        chunk_summary = get_story_response_from_model(MODEL_NAME, chunk_prompt, caller="summary_update",
+                                                      profile="chunk_summary")
+        if chunk_summary:
+            self.chunk_summaries.append(chunk_summary.strip())
+
+    def _merge_chunks(self):
+        """Merge the collected chunk summaries into the top-level summary."""
+        if not self.chunk_summaries:
+            return
+        merge_prompt = MERGE_SUMMARY_TEMPLATE.format(current_summary=self.summary,
+                                                     chunk_summaries=" ".join(self.chunk_summaries))
+        self.chunk_summaries = []
+        candidate = (get_story_response_from_model(MODEL_NAME, merge_prompt, caller="summary_update") or "").strip()
+        self.summary = choose_summary(self.summary, candidate)
+
+def choose_summary(previous_summary, candidate_summary):
+    """Keep the rewritten summary only if it differs enough from the previous one."""
+    if not candidate_summary:
+        print("The summary update failed, so the previous summary is kept.")
+        return previous_summary
+    # Calculate similarity score for summaries
+    similarity_score = calculate_cosine_similarity(previous_summary, candidate_summary)
+    print(f"++++++++++++++++++++++++++++++++++++++++")
+    print(f"++++++++++++++++++++++++++++++++++++++++")
+    print(f"++++\n")
+
+    print(f"The new update to the storyline has a cosine similarity score of {similarity_score:.4f}.\n")
+    print(f"Cosine similarity measures how similar two sequences of text are by representing them as vectors in a high-dimensional space and calculating the cosine of the angle between these vectors.\n")
+    print(f"We have a threshold set of: {SUMMARY_COSINE_SIMILARITY_THRESHOLD}.\n")
+
+    if similarity_score > SUMMARY_COSINE_SIMILARITY_THRESHOLD:
+        print("That means that it was NOT to be changed based on the score, so the previous summary is kept.")
+        summary = previous_summary
+    else:
+        print(f"That means that it was TO be changed based on the score.")
+        summary = candidate_summary
+
+    print(f"\nHere is the summary:\n")
+    print(f"{summary}")
+    print(f"++++")
+    print(f"++++++++++++++++++++++++++++++++++++++++")
+    print(f"++++++++++++++++++++++++++++++++++++++++")
+    return summary
+
+def add_line_to_story(current_story, similarity_index, summary_maintainer, next_line, corpus_index=None, source=None):
+    """Append an accepted line to the story and return the (possibly updated) summary."""
+    current_story.append(next_line)
+    similarity_index.add(next_line)
+    if corpus_index is not None:
+        corpus_index.add(next_line, source)
+    return summary_maintainer.add_line(next_line)
+
+def generate_speculative_line(model_name, candidate_prompts, current_story, similarity_index, corpus_index=None):
+    """Send every (system_message, user_message) candidate at once and return the accepted non-duplicate line, or None."""
+    print(f"\n**** SENDING {len(candidate_prompts)} SPECULATIVE CANDIDATES TO ADD TO THE STORYLINE ****\n")
+    cancel_event = threading.Event()
+    best_line, best_score = None, None
+    answered = 0
+    with ThreadPoolExecutor(max_workers=len(candidate_prompts)) as pool:
+        futures = {}
+        for system_message, user_message in candidate_prompts:
+            call_stats = {}
+            future = pool.submit(get_story_response_from_model, model_name, user_message,
+                                 options={"seed": random.randrange(2 ** 31)}, cancel_event=cancel_event,
+                                 max_words=MAX_RESPONSE_WORDS, stats=call_stats, system_message=system_message,
+                                 caller="continuation")
+            futures[future] = call_stats
+        for future in as_completed(futures):
+            response = future.result()
+            if not response:
+                continue
+            answered += 1
+            next_line = limit_to_words(response.strip(), MAX_RESPONSE_WORDS)
+            print_candidate_line(next_line)
+            print_call_stats(futures[future])
+            if is_duplicate_line(next_line, current_story, similarity_index, corpus_index):
+                print("====== Duplicate speculative candidate discarded ======")
+                continue
+            if SPECULATIVE_ACCEPT == 'first':
+                cancel_event.set()  # Stop the remaining candidates from generating
+                return next_line
+            most_similar = similarity_index.most_similar(next_line)
+            score = most_similar[1] if most_similar else 0.0
+            if best_score is None or score < best_score:
+                best_line, best_score = next_line, score
+    if not answered:
+        raise OllamaUnavailableError("Every speculative candidate failed after its retries")
+    return best_line
+
+def write_story_segment(model_name, prompt, loops, json_file, resume=False, persona=None):
+    """Generate story segments and save them to a file, optionally resuming from its last checkpoint."""
+    steps = iter_story_segment(model_name, prompt, loops, json_file, resume, persona)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as finished:
+            return finished.value
+
+def iter_story_segment(model_name, prompt, loops, json_file, resume=False, persona=None):
+    """Generator form of write_story_segment that yields the loop index after each checkpointed loop.
+
+    The finished story is the generator's return value. Advancing several of these in
+    turn lets one process write many stories against the same service (see story_jobs.py).
+    """
+    if resume:
+        checkpoint = load_story_checkpoint(json_file)
+        if checkpoint["finished"]:
+            print(f"{json_file} is already complete. Nothing to resume.")
+            return checkpoint["chapters"]
+        current_story = checkpoint["chapters"]
+        overall_summary = checkpoint["summary"]
+        summary_state = checkpoint["summary_state"]
+        start_loop = min(checkpoint["next_loop"], loops)
+        prompt = current_story[0]
+        print(f"Resuming {json_file} at loop {start_loop + 1}/{loops} with {len(current_story)} chapters.")
+    else:
+        current_story = [prompt]
+        overall_summary = generate_summary(current_story)
+        summary_state = None
+        start_loop = 0
+
+    # Initialize the story storage with the initial (or restored) data
+    storage = open_story_storage(json_file, STORAGE_MODE, CHAPTER_LOG_FSYNC)
+    current_story = storage.start(current_story, overall_summary, start_loop, summary_state)
+
+    similarity_index = SimilarityIndex(current_story, window=SIMILARITY_WINDOW)
+    corpus_index = None
+    if CORPUS_DUPLICATE_CHECK:
+        from near_duplicate_index import get_near_duplicate_index
+        corpus_index = get_near_duplicate_index()
+        added = corpus_index.index_directory(os.path.dirname(json_file) or ".")
+        print(f"Near-duplicate index: {added} new chapters indexed, {len(corpus_index)} in total.")
+    summary_maintainer = SummaryMaintainer(overall_summary, state=summary_state, chapters=current_story)
+
+    for loop_index in range(start_loop, loops):
         phase = get_phase(loop_index, loops)
         
         if phase == "beginning":
@@ -179,107 +444,98 @@ def write_story_segment(model_name, prompt, loops, json_file):
         
         print(f"\n{'!' * 10} Currently in the {phase} phase of the story, loop: {loop_index + 1}/{loops} ({((loop_index + 1) / loops) * 100:.2f}%) {'!' * 10}\n")
 
-        while retry_count <= MAX_RETRIES:
-            current_story_text = get_story_context(current_story, prompt, retry_count)
-            if current_story_text is None:
+        if SPECULATIVE_CANDIDATES > 1:
+            # Every round of duplicates shifts the candidates to other story contexts, up to MAX_RETRIES more rounds
+            for round_index in range(MAX_RETRIES + 1):
+                candidate_prompts = [
+                    build_continuation_prompt(get_story_context(current_story, prompt, (candidate + round_index) % 4),
+                                              overall_summary, ending, phase_instructions, persona)
+                    for candidate in range(SPECULATIVE_CANDIDATES)
+                ]
+                next_line = generate_speculative_line(model_name, candidate_prompts, current_story, similarity_index,
+                                                      corpus_index)
+                if next_line is not None:
+                    overall_summary = add_line_to_story(current_story, similarity_index, summary_maintainer,
+                                                        next_line, corpus_index, json_file)
+                    break
+                print(f"All speculative candidates were duplicates (round {round_index + 1}/{MAX_RETRIES + 1}).")
+            else:
                 print("Exhausted all retry mechanisms. Stopping...")
+                storage.finalize({"story_chapters": current_story, "story_summary": overall_summary,
+                                  "summary_state": summary_maintainer.state(), "next_loop": loop_index})
                 return current_story
-
-            user_message = USER_MESSAGE_TEMPLATE.format(
-                current_story=current_story_text, persona=PERSONA_TO_USE,
-                summary=overall_summary, ending=ending,
-                phase_instructions=phase_instructions
-            )
-
-            print(f"\n" + "*" * 40)
-            print("**** SENDING IN TO ADD TO THE STORYLINE ****")
-            print("*" * 40)
-            print(f"{user_message}")
-            print("*" * 40 + "\n")
-
-            response = get_story_response_from_model(model_name, user_message)
-
-            if response:
-                next_line = response.strip()
-                print("\n" + "*" * 40)
-                print("*" * 40)
-                print(f"****\n\n{next_line}\n\n****")
+        else:
+            # One candidate at a time, widening or narrowing the story context after each duplicate
+            retry_count = 0
+            while retry_count <= MAX_RETRIES:
+                current_story_text = get_story_context(current_story, prompt, retry_count)
+                if current_story_text is None:
+                    print("Exhausted all retry mechanisms. Stopping...")
+                    storage.finalize({"story_chapters": current_story, "story_summary": overall_summary,
+                                      "summary_state": summary_maintainer.state(), "next_loop": loop_index})
+                    return current_story
+
+                system_message, user_message = build_continuation_prompt(
+                    current_story_text, overall_summary, ending, phase_instructions, persona
+                )
+
+                print(f"\n" + "*" * 40)
+                print("**** SENDING IN TO ADD TO THE STORYLINE ****")
                 print("*" * 40)
+                print(f"{user_message}")
                 print("*" * 40 + "\n")
 
-                # Check for duplicates using cosine similarity with the last 3 entries
-                is_duplicate = False
-                for idx, previous_line in enumerate(current_story[-3:], len(current_story) - 3):
-                    similarity_score = calculate_cosine_similarity(next_line, previous_line)
-                    print(f"Checking similarity between current line and previous line {idx + 1}: {similarity_score}")
-                    print(f"Current line: {next_line}")
-                    print(f"Previous line {idx + 1}: {previous_line}")
-                    if similarity_score > COSINE_SIMILARITY_THRESHOLD:
-                        is_duplicate = True
-                        break
+                call_stats = {}
+                response = get_story_response_from_model(model_name, user_message, max_words=MAX_RESPONSE_WORDS,
+                                                         stats=call_stats, system_message=system_message,
+                                                         caller="continuation")
+
+                if response:
+                    print_call_stats(call_stats)
+                    next_line = limit_to_words(response.strip(), MAX_RESPONSE_WORDS)
+                    print_candidate_line(next_line)
 
-                if not is_duplicate:
-                    current_story.append(next_line)
-                    previous_summary = overall_summary
-                    overall_summary = enhance_summary(overall_summary, next_line)
-                    
-                    # Calculate similarity score for summaries
-                    similarity_score = calculate_cosine_similarity(previous_summary, overall_summary)
-                    print(f"++++++++++++++++++++++++++++++++++++++++")
-                    print(f"++++++++++++++++++++++++++++++++++++++++")
-                    print(f"++++\n")
-
-                    print(f"The new update to the storyline has a cosine similarity score of {similarity_score:.4f}.\n")
-                    print(f"Cosine similarity measures how similar two sequences of text are by representing them as vectors in a high-dimensional space and calculating the cosine of the angle between these vectors.\n")
-                    print(f"We have a threshold set of: {SUMMARY_COSINE_SIMILARITY_THRESHOLD}.\n")
-                    
-                    if similarity_score > SUMMARY_COSINE_SIMILARITY_THRESHOLD:
-                        print(f"That means that it was NOT to be changed based on the score.")
+                    if not is_duplicate_line(next_line, current_story, similarity_index, corpus_index):
+                        overall_summary = add_line_to_story(current_story, similarity_index, summary_maintainer,
+                                                            next_line, corpus_index, json_file)
+                        break
                     else:
-                        print(f"That means that it was TO be changed based on the score.")
-                    
-                    print(f"\nHere is the new summary, regardless:\n")
-                    print(f"{overall_summary}")
-                    print(f"++++")
-                    print(f"++++++++++++++++++++++++++++++++++++++++")
-                    print(f"++++++++++++++++++++++++++++++++++++++++")
-
-                    # Write the updated story and summary back to the JSON file
-                    with open(json_file, 'w') as f:
-                        json.dump({"story_chapters": current_story, "story_summary": overall_summary}, f, indent=2, ensure_ascii=False)
-                    
-                    break
+                        print(f"\n" + "=" * 40)
+                        print("=" * 40)
+                        print(f"====== Duplicate response detected, retrying... ======")
+                        print("=" * 40)
+                        print("=" * 40 + "\n")
+                        retry_count += 1
+                        time.sleep(1)
                 else:
-                    print(f"\n" + "=" * 40)
-                    print("=" * 40)
-                    print(f"====== Duplicate response detected, retrying... ======")
-                    print("=" * 40)
-                    print("=" * 40 + "\n")
-                    retry_count += 1
-                    time.sleep(1)
-            else:
-                print(f"Failed to get a response from the model.")
-                break
+                    # The call policy has already retried and waited out the circuit breaker; stop with the
+                    # checkpoint intact instead of dropping this loop
+                    raise OllamaUnavailableError(f"No response from the model in loop {loop_index + 1}; "
+                                                 f"resume {json_file} to continue the story")
 
+        # Checkpoint the new chapter, summary revision and loop index
+        storage.record(current_story, overall_summary, loop_index + 1, summary_maintainer.state())
+        yield loop_index
+
+    overall_summary = summary_maintainer.flush()
+    storage.record(current_story, overall_summary, loops)
     complete_synopsis = generate_complete_synopsis(current_story, overall_summary)
 
     # Generate the main character description based on the complete synopsis
     main_character_prompt = CHARACTER_DESCRIPTION_TEMPLATE.format(complete_synopsis=complete_synopsis)
-    character_description = get_story_response_from_model(model_name, main_character_prompt).strip()
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-    data["complete_synopsis"] = complete_synopsis
-    data["main_character"] = character_description
-
-    with open(json_file, 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    character_description = (get_story_response_from_model(model_name, main_character_prompt,
+                                                            caller="character") or "").strip()
+    storage.finalize({
+        "story_chapters": current_story,
+        "story_summary": overall_summary,
+        "complete_synopsis": complete_synopsis,
+        "main_character": character_description
+    })
 
     print(f"\nOverall synopsis (complete synopsis and final story summary) saved to {json_file}.")
     return current_story
 
 def main():
-    global MODEL_NAME, INITIAL_PROMPT, LOOPS, JSON_FILE
-
     start_time = time.time()
 
     kill_existing_ollama_service()
@@ -287,11 +543,13 @@ def main():
 
     install_and_setup_ollama(MODEL_NAME)
 
-    if is_windows():
-        start_ollama_service_windows()
-        time.sleep(10)
+    start_ollama_service()
 
-    write_story_segment(MODEL_NAME, INITIAL_PROMPT, LOOPS, JSON_FILE)
+    if RESUME_FROM:
+        write_story_segment(MODEL_NAME, INITIAL_PROMPT, LOOPS, story_json_path(RESUME_FROM), resume=True)
+    else:
+        write_story_segment(MODEL_NAME, INITIAL_PROMPT, LOOPS, JSON_FILE or new_story_json_path())
+    write_call_metrics_report("make_story")
 
     stop_ollama_service()
     clear_gpu_memory()
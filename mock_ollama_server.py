@@ -0,0 +1,203 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MOCK_MODEL_NAME = 'llama3'
+SYLLABLES = "ka lo ri en mar tho vel sun dra ise pen wor bel cas tin".split()  # Made-up words keep random responses dissimilar
+
+def structured_response(response_format, words):
+    """Build a JSON response for a format request: one short string per schema property, or a single "response" key."""
+    properties = response_format.get("properties", {}) if isinstance(response_format, dict) else {}
+    keys = list(properties) or ["response"]
+    values = {key: " ".join(words[index * 8:(index + 1) * 8] or words[:8]) for index, key in enumerate(keys)}
+    return json.dumps(values)
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Serve the parts of the Ollama HTTP API the scripts use, with simulated timing."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": f"{MOCK_MODEL_NAME}:latest", "model": f"{MOCK_MODEL_NAME}:latest"}]})
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/api/chat":
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+            return
+        if self.server.record_request():
+            self._send_json({"error": "mock server overloaded"}, status=503)
+            return
+        self._stream_chat(request)
+
+    def _stream_chat(self, request):
+        server = self.server
+        prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+        words = server.next_response_words()
+        if request.get("format"):
+            words = structured_response(request["format"], words).split(" ")
+        num_predict = (request.get("options") or {}).get("num_predict")
+        truncated = num_predict is not None and 0 <= num_predict < len(words)  # One mock word counts as one token
+        if truncated:
+            words = words[:num_predict]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        start = time.perf_counter()
+        time.sleep(server.next_latency())
+        prompt_done = time.perf_counter()
+        try:
+            for index, word in enumerate(words):
+                time.sleep(1.0 / server.token_rate)
+                content = word if index == 0 else " " + word
+                self._write_chunk({"model": request.get("model"), "message": {"role": "assistant", "content": content},
+                                   "done": False})
+            end = time.perf_counter()
+            self._write_chunk({
+                "model": request.get("model"),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "done_reason": "length" if truncated else "stop",
+                "total_duration": int((end - start) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": max(1, len(prompt) // 4),
+                "prompt_eval_duration": int((prompt_done - start) * 1e9),
+                "eval_count": len(words),
+                "eval_duration": int((end - prompt_done) * 1e9)
+            })
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            server.record_cancellation()  # The client stopped reading, as a real server would see
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+class MockOllamaServer(ThreadingHTTPServer):
+    """Local stand-in for the Ollama HTTP API with configurable latency, token rate and duplicate rate."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, token_rate=200.0, duplicate_rate=0.0,
+                 response_words=60, seed=None, error_rate=0.0, slow_rate=0.0, slow_latency=2.0):
+        super().__init__((host, port), MockOllamaHandler)
+        self.latency = latency  # Seconds before the first token (prompt evaluation)
+        self.token_rate = token_rate  # Generated tokens per second
+        self.duplicate_rate = duplicate_rate  # Probability of repeating the previous response verbatim
+        self.response_words = response_words
+        self.error_rate = error_rate  # Probability of answering a chat request with 503
+        self.slow_rate = slow_rate  # Probability of a straggler whose first token takes slow_latency extra seconds
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self.cancellations = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._last_words = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_response_words(self):
+        """Pick the words of the next response, repeating the previous one at the duplicate rate."""
+        with self._lock:
+            if self._last_words is not None and self._random.random() < self.duplicate_rate:
+                return list(self._last_words)
+            words = ["".join(self._random.choice(SYLLABLES) for _ in range(self._random.randint(1, 3)))
+                     for _ in range(self.response_words)]
+            words[0] = words[0].capitalize()
+            words[-1] += "."
+            self._last_words = words
+            return words
+
+    def next_latency(self):
+        """Seconds before the next response's first token, adding slow_latency for stragglers."""
+        with self._lock:
+            slow = self.slow_rate and self._random.random() < self.slow_rate
+        return self.latency + (self.slow_latency if slow else 0.0)
+
+    def record_request(self):
+        """Count a chat request and return True when it should fail at the error rate."""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def record_cancellation(self):
+        with self._lock:
+            self.cancellations += 1
+
+    def start(self):
+        """Serve requests on a background thread and return the base URL."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Ollama HTTP API for benchmarks and local testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Generated tokens per second")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Probability of repeating the last response")
+    parser.add_argument("--response-words", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of answering a chat request with 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Probability of a straggler response")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="Extra seconds before a straggler's first token")
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.host, args.port, args.latency, args.token_rate, args.duplicate_rate,
+                              args.response_words, args.seed, args.error_rate, args.slow_rate, args.slow_latency)
+    print(f"Mock Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from glob import glob
+import numpy as np
+from story_storage import ChapterStore, read_chapter_log, story_json_path, has_chapter_store, load_story
+
+NEAR_DUPLICATE_INDEX_PATH = os.path.join(os.getcwd(), "near_duplicate_index.sqlite3")
+NEAR_DUPLICATE_THRESHOLD = 0.5  # Estimated Jaccard similarity of word shingles above which a chapter is a near-duplicate
+NUM_PERMUTATIONS = 128  # MinHash signature length
+LSH_BANDS = 32  # 32 bands of 4 rows: chapters above ~0.42 Jaccard almost always share a bucket
+SHINGLE_SIZE = 3  # Words per shingle
+PERMUTATION_SEED = 20240601  # Fixed so new signatures stay comparable with the stored ones
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+_PERMUTATIONS = np.random.default_rng(PERMUTATION_SEED)
+PERMUTATION_A = _PERMUTATIONS.integers(1, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _PERMUTATIONS.integers(0, MERSENNE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+NEAR_DUPLICATE_INDEX = None
+_NEAR_DUPLICATE_INDEX_LOCK = threading.Lock()  # Story jobs may open the shared index from several threads
+
+def shingles(text):
+    """Return the set of lower-cased word shingles of a text."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[start:start + SHINGLE_SIZE]) for start in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash_signature(text):
+    """Compute the MinHash signature of a text's shingles as a uint64 array."""
+    hashed = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                       for shingle in shingles(text)], dtype=np.uint64)
+    if not hashed.size:
+        return np.full(NUM_PERMUTATIONS, MAX_HASH, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        permuted = np.bitwise_and((np.outer(hashed, PERMUTATION_A) + PERMUTATION_B) % MERSENNE_PRIME, MAX_HASH)
+    return permuted.min(axis=0)
+
+def band_keys(signature):
+    """Hash each LSH band of a signature into a signed 64-bit bucket key."""
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+    return [
+        int.from_bytes(hashlib.blake2b(band.to_bytes(2, "little") + signature[band * rows:(band + 1) * rows].tobytes(),
+                                       digest_size=8).digest(), "little", signed=True)
+        for band in range(LSH_BANDS)
+    ]
+
+def estimated_similarity(signature1, signature2):
+    """Estimate the Jaccard similarity of two texts from their signatures."""
+    return float(np.mean(signature1 == signature2))
+
+class NearDuplicateIndex:
+    """Persistent MinHash-LSH index of accepted chapters across every storyline.
+
+    A lookup hashes the candidate's signature into LSH_BANDS bucket keys and only
+    compares it with the chapters sharing one of them, so its cost does not grow
+    with the number of indexed chapters.
+    """
+
+    def __init__(self, path=NEAR_DUPLICATE_INDEX_PATH, threshold=None):
+        self.path = path
+        self.threshold = threshold if threshold is not None else NEAR_DUPLICATE_THRESHOLD
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chapters ("
+            "id INTEGER PRIMARY KEY, chapter_hash TEXT UNIQUE, source TEXT, signature BLOB)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (key INTEGER, chapter_id INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (key)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chapters").fetchone()[0]
+
+    def _add(self, text, source):
+        chapter_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        signature = minhash_signature(text)
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO chapters (chapter_hash, source, signature) VALUES (?, ?, ?)",
+            (chapter_hash, source, signature.tobytes())
+        )
+        if cursor.rowcount == 0:
+            return False  # Already indexed
+        self._conn.executemany("INSERT INTO buckets VALUES (?, ?)",
+                               [(key, cursor.lastrowid) for key in band_keys(signature)])
+        return True
+
+    def add(self, text, source=None):
+        """Index an accepted chapter; returns False if the same text is already indexed."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                added = self._add(text, source)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def find_duplicate(self, text, threshold=None):
+        """Return (similarity, source) of the closest indexed chapter above the threshold, or None."""
+        threshold = threshold if threshold is not None else self.threshold
+        signature = minhash_signature(text)
+        keys = band_keys(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT chapters.id, chapters.source, chapters.signature FROM buckets "
+                "JOIN chapters ON chapters.id = buckets.chapter_id "
+                f"WHERE buckets.key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchall()
+        best = None
+        for _, source, stored in rows:
+            similarity = estimated_similarity(signature, np.frombuffer(stored, dtype=np.uint64))
+            if similarity >= threshold and (best is None or similarity > best[0]):
+                best = (similarity, source)
+        return best
+
+    def index_directory(self, directory):
+        """Index the chapters of every storyline (and unfinished chapter log) that changed since the last call."""
+        added = 0
+        paths = sorted(glob(os.path.join(directory, "*_story.json")) + glob(os.path.join(directory, "*.log.jsonl")))
+        for path in paths:
+            stat = os.stat(path)
+            with self._lock:
+                known = self._conn.execute("SELECT mtime, size FROM sources WHERE path = ?", (path,)).fetchone()
+            if known == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                chapters = _read_chapters(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping {path} for the near-duplicate index: {e}")
+                continue
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    added += sum(self._add(chapter, path) for chapter in chapters)
+                    self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                                       (path, stat.st_mtime, stat.st_size))
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        return added
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+def _read_chapters(path):
+    """Read the chapter texts of a story JSON or chapter log."""
+    if path.endswith(".log.jsonl"):
+        chapters = read_chapter_log(path)["chapters"]
+        if chapters or not has_chapter_store(story_json_path(path)):
+            return chapters
+        with ChapterStore(story_json_path(path)) as store:  # An unfinished story written in "indexed" mode
+            return list(store)
+    chapters = load_story(path).get("story_chapters", [])
+    return [chapter for chapter in chapters if isinstance(chapter, str)]
+
+def get_near_duplicate_index():
+    """Return the process-wide near-duplicate index, creating it on first use."""
+    global NEAR_DUPLICATE_INDEX
+    with _NEAR_DUPLICATE_INDEX_LOCK:
+        if NEAR_DUPLICATE_INDEX is None:
+            NEAR_DUPLICATE_INDEX = NearDuplicateIndex()
+    return NEAR_DUPLICATE_INDEX
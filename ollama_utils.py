@@ -2,10 +2,14 @@ import os
 import subprocess
 import shutil
 import platform
-import psutil
-import requests
 import time
+import json
 import socket
+import asyncio
+import threading
+from contextlib import closing, aclosing
+from call_metrics import record_call
+from call_policy import call_with_policy, call_with_policy_async, get_call_policy
 
 OLLAMA_EXE_PATH = os.path.join(os.getcwd(), "ollama.exe")
 OLLAMA_RUNNERS_DIR = os.path.join(os.getcwd(), "ollama", "ollama_runners")
@@ -13,6 +17,45 @@ OLLAMA_TEMP_DIR = os.path.join(os.getcwd(), "ollama_temp")
 OLLAMA_ZIP_PATH = os.path.join(os.getcwd(), "ollama-windows.zip")
 OLLAMA_PROCESS = None
 OLLAMA_PORT = 11434  # Define the port used by Ollama
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", f"http://127.0.0.1:{OLLAMA_PORT}")  # Ollama HTTP API, in any form Ollama accepts ("0.0.0.0", "127.0.0.1:11434", a URL)
+OLLAMA_HOSTS = [host.strip() for host in os.environ.get("OLLAMA_HOSTS", "").split(",") if host.strip()]  # Several hosts to balance calls across; empty uses OLLAMA_HOST alone
+OLLAMA_PROBE_INTERVAL = 15  # Seconds before an endpoint taken out of rotation is probed again
+OLLAMA_REQUEST_TIMEOUT = 300  # Seconds to wait for a single model call (read timeout between streamed chunks); per-task values are in call_policy.py
+OLLAMA_CONNECT_TIMEOUT = 10  # Seconds to wait for the TCP connection to the service
+OLLAMA_KEEP_ALIVE = "30m"  # How long the server keeps the model loaded after a call
+OLLAMA_POOL_SIZE = 8  # Keep-alive connections held open to the service
+OLLAMA_CLIENT = None
+OLLAMA_CLIENT_LOCK = threading.Lock()  # Stage and worker threads may ask for the shared client at the same time
+OLLAMA_READY_TIMEOUT = 60  # Seconds to wait for a freshly started service to answer HTTP requests
+OLLAMA_PID_FILE = os.path.join(os.getcwd(), "ollama_serve.pid")  # PID of the `ollama serve` child started by these scripts
+RESPONSE_CACHE_ENABLED = True  # Allow callers to serve repeated prompts from the on-disk response cache
+RESPONSE_CACHE = None
+CALL_METRICS_ENABLED = True  # Record Ollama's per-call counters by caller for the run's metrics report (call_metrics.py)
+OLLAMA_NUM_CTX = 4096  # Context window of every profile; Ollama reloads the model whenever num_ctx changes between calls
+COMMENTARY_STOPS = ["\n\nNote:", "\n\nI hope", "\n\nLet me know"]  # Where the model starts commenting on its answer
+
+# Generation options per call type, sized to what the caller keeps of the response.
+# Callers select one with profile= (by default their caller tag); explicit options win.
+GENERATION_PROFILES = {
+    "continuation": {"num_predict": 200, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                     "temperature": 0.8, "top_p": 0.9},  # 100 words
+    "summary_update": {"num_predict": 256, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                       "temperature": 0.5},  # 750 characters
+    "chunk_summary": {"num_predict": 160, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                      "temperature": 0.5},  # 400 characters
+    "synopsis": {"num_predict": 320, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                 "temperature": 0.7},  # 900 characters
+    "character": {"num_predict": 128, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                  "temperature": 0.7},  # 250 characters
+    "chapter_summary": {"num_predict": 40, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                        "temperature": 0.3},  # 10 words
+    "ai_prompt": {"num_predict": 128, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+                  "temperature": 0.5},  # 300 characters of comma-separated tags
+    "chapter_fields": {"num_predict": 384, "num_ctx": OLLAMA_NUM_CTX,
+                       "temperature": 0.3},  # JSON with a 10-word summary and two 300-character prompts
+    "trim": {"num_predict": 96, "stop": COMMENTARY_STOPS, "num_ctx": OLLAMA_NUM_CTX,
+             "temperature": 0.3}  # 200 characters
+}
 
 DEFAULT_MODELS_DIR = os.path.join(os.path.expanduser("~"), ".ollama", "models")
 
@@ -24,6 +67,12 @@ def is_ollama_installed(ollama_path):
     """Check if the Ollama executable is available."""
     return os.path.isfile(ollama_path)
 
+def get_ollama_executable():
+    """Return the Ollama executable for this platform, or None if it cannot be found."""
+    if is_windows():
+        return OLLAMA_EXE_PATH if is_ollama_installed(OLLAMA_EXE_PATH) else None
+    return shutil.which("ollama") or (OLLAMA_EXE_PATH if is_ollama_installed(OLLAMA_EXE_PATH) else None)
+
 def is_model_downloaded(model_name, model_dir=DEFAULT_MODELS_DIR):
     """Check if the specified model is already downloaded."""
     model_path = os.path.join(model_dir, model_name)
@@ -35,6 +84,7 @@ def is_model_downloaded(model_name, model_dir=DEFAULT_MODELS_DIR):
 
 def download_file(url, local_path):
     """Download a file from a URL to a local path."""
+    import requests
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
         with open(local_path, 'wb') as f:
@@ -68,21 +118,27 @@ def pull_model(model_name):
     os.environ['OLLAMA_RUNNERS_DIR'] = OLLAMA_RUNNERS_DIR
     
     try:
-        subprocess.run([OLLAMA_EXE_PATH, 'pull', model_name], check=True)
+        subprocess.run([get_ollama_executable(), 'pull', model_name], check=True)
         print(f"Model '{model_name}' pulled successfully.")
     except subprocess.CalledProcessError as e:
         print(f"Failed to pull model '{model_name}': {e}")
         raise
 
-def install_ollama_pkg():
-    """Install the ollama Python package."""
+def install_httpx_pkg():
+    """Install the httpx package the Ollama client is built on."""
     try:
-        import ollama
+        import httpx
     except ImportError:
-        subprocess.check_call(['pip', "install", "ollama"])
+        subprocess.check_call(['pip', "install", "httpx"])
 
 def kill_existing_ollama_service():
     """Kill any existing Ollama service instances to free up the port."""
+    if not is_windows():
+        # Only stop the service these scripts started earlier; a system-wide service is left alone
+        kill_previous_ollama_child()
+        return
+
+    import psutil
     for process in psutil.process_iter(['pid', 'name', 'username']):
         try:
             if process.info['name'] == 'ollama.exe' and process.info['username'] == os.getlogin():
@@ -103,6 +159,7 @@ def kill_existing_ollama_service():
 def clear_gpu_memory():
     """Clear the GPU memory by killing processes using GPU."""
     try:
+        import psutil
         result = subprocess.run(["nvidia-smi", "--query-compute-apps=pid", "--format=csv,noheader"], capture_output=True, text=True, check=True)
         pids = result.stdout.strip().split("\n")
         for pid in pids:
@@ -133,58 +190,129 @@ def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('127.0.0.1', port)) == 0
 
-def start_ollama_service_windows():
-    """Start Ollama service on Windows."""
+def ollama_base_url(host=None):
+    """Turn an OLLAMA_HOST value into a base URL the way Ollama does.
+
+    The scheme defaults to http and the port to 11434 (443 for https); the bind-all
+    address 0.0.0.0 the server listens on is reached through 127.0.0.1.
+    """
+    from urllib.parse import urlsplit
+    host = (host or OLLAMA_HOST).strip().rstrip("/")
+    if "://" not in host:
+        host = f"http://{host}"
+    parts = urlsplit(host)
+    hostname = parts.hostname or "127.0.0.1"
+    if hostname in ("0.0.0.0", "::"):
+        hostname = "127.0.0.1"
+    elif ":" in hostname:
+        hostname = f"[{hostname}]"  # IPv6
+    port = parts.port or (443 if parts.scheme == "https" else OLLAMA_PORT)
+    return f"{parts.scheme}://{hostname}:{port}{parts.path}"
+
+def is_ollama_ready(host=None, timeout=1.0):
+    """Check whether the Ollama HTTP API answers requests."""
+    from urllib.request import urlopen
+    try:
+        with urlopen(f"{ollama_base_url(host)}/api/version", timeout=timeout) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+def wait_for_ollama_ready(timeout=OLLAMA_READY_TIMEOUT, process=None):
+    """Poll the HTTP API with exponential backoff until it answers, the process exits or the timeout passes."""
+    deadline = time.time() + timeout
+    delay = 0.05
+    while time.time() < deadline:
+        if is_ollama_ready():
+            return True
+        if process is not None and process.poll() is not None:
+            print(f"Ollama service exited with code {process.returncode} during startup.")
+            return False
+        time.sleep(min(delay, max(0.0, deadline - time.time())))
+        delay = min(delay * 2, 1.0)
+    return is_ollama_ready()
+
+def kill_previous_ollama_child():
+    """Stop an `ollama serve` child left behind by an earlier run, identified by its PID file."""
+    if not os.path.exists(OLLAMA_PID_FILE):
+        return
+    with open(OLLAMA_PID_FILE, 'r') as f:
+        pid = int(f.read().strip() or 0)
+    import psutil
+    try:
+        process = psutil.Process(pid)
+        if "ollama" in process.name().lower():
+            process.terminate()
+            process.wait(timeout=5)
+            print(f"Stopped leftover Ollama service (PID: {pid}).")
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.TimeoutExpired) as e:
+        print(f"Skipping leftover Ollama PID {pid}: {e}")
+    os.remove(OLLAMA_PID_FILE)
+
+def start_ollama_service(retries=3):
+    """Start `ollama serve` if the API is not already up and return as soon as it answers."""
     global OLLAMA_PROCESS
-    print("Starting Ollama service...")
+    if is_ollama_ready():
+        print(f"Ollama service is already running at {OLLAMA_HOST}.")
+        return True
 
-    retries = 3
-    while retries > 0:
-        if is_port_in_use(OLLAMA_PORT):
-            print(f"Port {OLLAMA_PORT} is already in use. Assuming Ollama service is running.")
-            return True  # Treat it as success if the port is already in use
+    executable = get_ollama_executable()
+    if executable is None:
+        print("Ollama executable not found. Install it from https://ollama.com/download.")
+        return False
 
-        os.environ['OLLAMA_RUNNERS_DIR'] = OLLAMA_RUNNERS_DIR
-        OLLAMA_PROCESS = subprocess.Popen([OLLAMA_EXE_PATH, "serve"], env=os.environ)
+    print("Starting Ollama service...")
+    while retries > 0:
+        start_time = time.time()
+        if is_windows():
+            os.environ['OLLAMA_RUNNERS_DIR'] = OLLAMA_RUNNERS_DIR
+        OLLAMA_PROCESS = subprocess.Popen([executable, "serve"], env=os.environ)
+        with open(OLLAMA_PID_FILE, 'w') as f:
+            f.write(str(OLLAMA_PROCESS.pid))
 
-        # Wait and check if the service starts properly
-        time.sleep(10)
-        if is_port_in_use(OLLAMA_PORT):
-            print("Ollama service started successfully.")
+        if wait_for_ollama_ready(process=OLLAMA_PROCESS):
+            print(f"Ollama service started successfully in {time.time() - start_time:.2f} seconds.")
             return True
-        
+
+        stop_ollama_service()
         retries -= 1
         print("Retrying Ollama service start...")
 
     print("Failed to start Ollama service. Please check and try again.")
     return False
 
+def start_ollama_service_windows():
+    """Start Ollama service on Windows."""
+    return start_ollama_service()
+
 def stop_ollama_service():
     """Stop Ollama service if it was started by this script."""
     global OLLAMA_PROCESS
+    close_ollama_client()
     if OLLAMA_PROCESS is not None:
         OLLAMA_PROCESS.terminate()
         OLLAMA_PROCESS.wait()
         OLLAMA_PROCESS = None
+        if os.path.exists(OLLAMA_PID_FILE):
+            os.remove(OLLAMA_PID_FILE)
         print("Ollama service has been stopped.")
 
 def install_and_setup_ollama(model_name):
     """Install and set up Ollama, including pulling the required model."""
-    if not is_ollama_installed(OLLAMA_EXE_PATH):
+    if get_ollama_executable() is None and not is_ollama_ready():
         if is_windows():
             install_ollama_windows()
         else:
-            raise NotImplementedError("Install logic for non-Windows platforms is not implemented.")
+            raise FileNotFoundError("Ollama not found. Install it with the script from https://ollama.com/download.")
     
-    install_ollama_pkg()
+    install_httpx_pkg()
 
     # Start the Ollama service before pulling the model
-    if is_windows():
-        kill_existing_ollama_service()  # Ensure no leftover processes are running
+    kill_existing_ollama_service()  # Ensure no leftover processes are running
 
-        if not start_ollama_service_windows():
-            print("Error: Failed to start Ollama service. Exiting.")
-            return
+    if not start_ollama_service():
+        print("Error: Failed to start Ollama service. Exiting.")
+        return
 
     # Check if model is already downloaded, if not then pull the model
     if is_model_downloaded(model_name, DEFAULT_MODELS_DIR):
@@ -200,13 +328,543 @@ def install_and_setup_ollama(model_name):
             print(f"Unexpected error occurred: {e}")
             raise
 
-def get_story_response_from_model(model_name, user_message):
-    """Get response content from the model specifically for story writing."""
-    user_messages = [{'role': 'user', 'content': user_message}]
-    import ollama
+class OllamaResponseError(Exception):
+    """Raised when the Ollama service reports an error inside a response."""
+
+class OllamaUnavailableError(Exception):
+    """Raised when no endpoint in an endpoint pool can take a request."""
+
+def is_endpoint_failure(error):
+    """Check whether an error means the endpoint itself is unreachable or failing, rather than the request."""
+    import httpx
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, OllamaUnavailableError))
+
+class OllamaClient:
+    """Long-lived client for the Ollama HTTP API backed by a keep-alive connection pool."""
+
+    HTTP_CLIENT_CLASS = "Client"  # httpx client class used for the connection pool
+
+    def __init__(self, host=None, timeout=None, connect_timeout=None, keep_alive=None, pool_size=None):
+        import httpx  # Installed alongside the ollama package
+
+        # Unset arguments fall back to the module settings at construction time
+        self.host = ollama_base_url(host)
+        self.timeout = timeout if timeout is not None else OLLAMA_REQUEST_TIMEOUT
+        self.connect_timeout = connect_timeout if connect_timeout is not None else OLLAMA_CONNECT_TIMEOUT
+        self.keep_alive = keep_alive if keep_alive is not None else OLLAMA_KEEP_ALIVE
+        self.pool_size = pool_size or OLLAMA_POOL_SIZE
+        self._http = getattr(httpx, self.HTTP_CLIENT_CLASS)(
+            base_url=self.host,
+            timeout=self._make_timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    def _make_timeout(self, timeout):
+        """Build an httpx timeout from a read timeout in seconds."""
+        import httpx
+        return httpx.Timeout(timeout, connect=self.connect_timeout)
+
+    def _chat_payload(self, model_name, messages, **kwargs):
+        """Build the JSON body of a streamed /api/chat request."""
+        payload = {"model": model_name, "messages": messages, "stream": True, "keep_alive": self.keep_alive}
+        payload.update(kwargs)
+        return payload
+
+    def iter_chat(self, model_name, messages, timeout=None, **kwargs):
+        """Yield the raw JSON chunks of a streamed /api/chat response."""
+        payload = self._chat_payload(model_name, messages, **kwargs)
+        request_timeout = self._make_timeout(timeout if timeout is not None else self.timeout)
+        with self._http.stream("POST", "/api/chat", json=payload, timeout=request_timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaResponseError(chunk["error"])
+                yield chunk
+
+    def chat(self, model_name, messages, timeout=None, **kwargs):
+        """Return the full message content of a chat request."""
+        return ''.join(
+            chunk['message']['content']
+            for chunk in self.iter_chat(model_name, messages, timeout=timeout, **kwargs)
+            if 'message' in chunk and 'content' in chunk['message']
+        )
+
+    def load_model(self, model_name, keep_alive=None):
+        """Load a model into memory without generating, so the first real call does not pay for it.
+
+        keep_alive overrides the client's setting for this request; 0 unloads the model.
+        The model is loaded with the profiles' num_ctx, otherwise the first real call would reload it.
+        """
+        response = self._http.post("/api/chat", json={
+            "model": model_name, "messages": [], "stream": False, "options": {"num_ctx": OLLAMA_NUM_CTX},
+            "keep_alive": keep_alive if keep_alive is not None else self.keep_alive
+        })
+        response.raise_for_status()
+
+    def unload_model(self, model_name):
+        """Free the model's memory on the server now instead of when its keep-alive runs out."""
+        self.load_model(model_name, keep_alive=0)
+
+    def close(self):
+        """Close every pooled connection."""
+        self._http.close()
+
+class AsyncOllamaClient(OllamaClient):
+    """Asyncio variant of OllamaClient for fanning out many independent requests."""
+
+    HTTP_CLIENT_CLASS = "AsyncClient"
+
+    async def iter_chat(self, model_name, messages, timeout=None, **kwargs):
+        """Yield the raw JSON chunks of a streamed /api/chat response."""
+        payload = self._chat_payload(model_name, messages, **kwargs)
+        request_timeout = self._make_timeout(timeout if timeout is not None else self.timeout)
+        async with self._http.stream("POST", "/api/chat", json=payload, timeout=request_timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise OllamaResponseError(chunk["error"])
+                yield chunk
+
+    async def chat(self, model_name, messages, timeout=None, **kwargs):
+        """Return the full message content of a chat request."""
+        parts = []
+        async for chunk in self.iter_chat(model_name, messages, timeout=timeout, **kwargs):
+            if 'message' in chunk and 'content' in chunk['message']:
+                parts.append(chunk['message']['content'])
+        return ''.join(parts)
+
+    async def close(self):
+        """Close every pooled connection."""
+        await self._http.aclose()
+
+class OllamaEndpoint:
+    """One host of an endpoint pool with its client, in-flight count and health."""
+
+    def __init__(self, client):
+        self.client = client
+        self.host = client.host
+        self.outstanding = 0
+        self.healthy = True
+        self.probe_at = 0.0
+        self.requests = 0
+        self.failures = 0
+
+class OllamaEndpointPool:
+    """Spread calls over several Ollama hosts, sending each to the healthy one with the fewest in flight.
+
+    A host that fails at the transport level or answers 5xx is taken out of rotation and
+    probed again after probe_interval seconds. A call that fails before its first chunk
+    is retried on another host, which is safe for every call.
+    """
+
+    CLIENT_CLASS = OllamaClient
+
+    def __init__(self, hosts, probe_interval=None, **client_kwargs):
+        if not hosts:
+            raise ValueError("An endpoint pool needs at least one host")
+        self.probe_interval = probe_interval if probe_interval is not None else OLLAMA_PROBE_INTERVAL
+        self.endpoints = [OllamaEndpoint(self.CLIENT_CLASS(host, **client_kwargs)) for host in hosts]
+        self._lock = threading.Lock()
+
+    def _unhealthy(self, exclude, due_only=True):
+        now = time.time()
+        with self._lock:
+            return [endpoint for endpoint in self.endpoints
+                    if not endpoint.healthy and endpoint not in exclude and (not due_only or now >= endpoint.probe_at)]
+
+    def _probe(self, endpoints):
+        """Probe endpoints out of rotation and put the ones that answer back in."""
+        for endpoint in endpoints:
+            healthy = is_ollama_ready(endpoint.host)
+            with self._lock:
+                endpoint.healthy = healthy
+                endpoint.probe_at = time.time() + self.probe_interval
+            if healthy:
+                print(f"Ollama endpoint {endpoint.host} is healthy again.")
+
+    def _select(self, exclude):
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy and endpoint not in exclude]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=lambda candidate: (candidate.outstanding, candidate.requests))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def acquire(self, exclude=()):
+        """Reserve the healthy endpoint with the fewest outstanding requests, re-probing when none is left."""
+        self._probe(self._unhealthy(exclude))
+        endpoint = self._select(exclude)
+        if endpoint is None:
+            self._probe(self._unhealthy(exclude, due_only=False))
+            endpoint = self._select(exclude)
+        if endpoint is None:
+            raise OllamaUnavailableError(f"No healthy Ollama endpoint among {[e.host for e in self.endpoints]}")
+        return endpoint
+
+    def release(self, endpoint, error=None):
+        """Finish a request on an endpoint, taking it out of rotation if it failed."""
+        with self._lock:
+            endpoint.outstanding -= 1
+        if error is not None:
+            self.mark_unhealthy(endpoint, error)
+
+    def mark_unhealthy(self, endpoint, error):
+        """Take an endpoint out of rotation until its next probe."""
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.healthy = False
+            endpoint.probe_at = time.time() + self.probe_interval
+        print(f"Ollama endpoint {endpoint.host} failed ({error}); taking it out of rotation.")
+
+    def _can_fail_over(self, error, started, tried):
+        return is_endpoint_failure(error) and not started and len(tried) < len(self.endpoints)
+
+    def iter_chat(self, model_name, messages, timeout=None, **kwargs):
+        """Yield the raw JSON chunks of a streamed /api/chat response from the least busy endpoint."""
+        tried = set()
+        while True:
+            endpoint = self.acquire(tried)
+            tried.add(endpoint)
+            started, error = False, None
+            try:
+                with closing(endpoint.client.iter_chat(model_name, messages, timeout=timeout, **kwargs)) as chunks:
+                    for chunk in chunks:
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                error = e if is_endpoint_failure(e) else None
+                if not self._can_fail_over(e, started, tried):
+                    raise
+            finally:
+                self.release(endpoint, error)
+            print("Retrying the request on another Ollama endpoint...")
+
+    def chat(self, model_name, messages, timeout=None, **kwargs):
+        """Return the full message content of a chat request."""
+        return ''.join(
+            chunk['message']['content']
+            for chunk in self.iter_chat(model_name, messages, timeout=timeout, **kwargs)
+            if 'message' in chunk and 'content' in chunk['message']
+        )
+
+    def load_model(self, model_name, keep_alive=None):
+        """Load a model on every healthy endpoint."""
+        for endpoint in self.endpoints:
+            if endpoint.healthy:
+                try:
+                    endpoint.client.load_model(model_name, keep_alive)
+                except Exception as e:
+                    if not is_endpoint_failure(e):
+                        raise
+                    self.mark_unhealthy(endpoint, e)
+
+    def unload_model(self, model_name):
+        """Unload a model from every healthy endpoint."""
+        self.load_model(model_name, keep_alive=0)
+
+    def stats(self):
+        """Return the request and failure counts of every endpoint."""
+        with self._lock:
+            return [{"host": endpoint.host, "healthy": endpoint.healthy, "requests": endpoint.requests,
+                     "failures": endpoint.failures} for endpoint in self.endpoints]
+
+    def close(self):
+        """Close every endpoint's connection pool."""
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+class AsyncOllamaEndpointPool(OllamaEndpointPool):
+    """Asyncio variant of OllamaEndpointPool; health probes run in a worker thread."""
+
+    CLIENT_CLASS = AsyncOllamaClient
+
+    async def acquire_async(self, exclude=()):
+        """Async counterpart of acquire that keeps probes off the event loop."""
+        due = self._unhealthy(exclude)
+        if due:
+            await asyncio.to_thread(self._probe, due)
+        endpoint = self._select(exclude)
+        if endpoint is None:
+            await asyncio.to_thread(self._probe, self._unhealthy(exclude, due_only=False))
+            endpoint = self._select(exclude)
+        if endpoint is None:
+            raise OllamaUnavailableError(f"No healthy Ollama endpoint among {[e.host for e in self.endpoints]}")
+        return endpoint
+
+    async def iter_chat(self, model_name, messages, timeout=None, **kwargs):
+        """Yield the raw JSON chunks of a streamed /api/chat response from the least busy endpoint."""
+        tried = set()
+        while True:
+            endpoint = await self.acquire_async(tried)
+            tried.add(endpoint)
+            started, error = False, None
+            try:
+                async with aclosing(endpoint.client.iter_chat(model_name, messages, timeout=timeout,
+                                                              **kwargs)) as chunks:
+                    async for chunk in chunks:
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                error = e if is_endpoint_failure(e) else None
+                if not self._can_fail_over(e, started, tried):
+                    raise
+            finally:
+                self.release(endpoint, error)
+            print("Retrying the request on another Ollama endpoint...")
+
+    async def chat(self, model_name, messages, timeout=None, **kwargs):
+        """Return the full message content of a chat request."""
+        parts = []
+        async for chunk in self.iter_chat(model_name, messages, timeout=timeout, **kwargs):
+            if 'message' in chunk and 'content' in chunk['message']:
+                parts.append(chunk['message']['content'])
+        return ''.join(parts)
+
+    async def close(self):
+        """Close every endpoint's connection pool."""
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+def make_ollama_client(asynchronous=False, **kwargs):
+    """Create a client for OLLAMA_HOSTS (an endpoint pool) or, with fewer than two hosts, for OLLAMA_HOST."""
+    if len(OLLAMA_HOSTS) > 1:
+        pool_class = AsyncOllamaEndpointPool if asynchronous else OllamaEndpointPool
+        return pool_class(OLLAMA_HOSTS, **kwargs)
+    client_class = AsyncOllamaClient if asynchronous else OllamaClient
+    return client_class(OLLAMA_HOSTS[0] if OLLAMA_HOSTS else None, **kwargs)
+
+def get_ollama_client():
+    """Return the process-wide Ollama client (or endpoint pool), creating it on first use."""
+    global OLLAMA_CLIENT
+    with OLLAMA_CLIENT_LOCK:
+        if OLLAMA_CLIENT is None:
+            OLLAMA_CLIENT = make_ollama_client()
+        return OLLAMA_CLIENT
+
+def close_ollama_client():
+    """Close the process-wide Ollama client if one was created."""
+    global OLLAMA_CLIENT
+    with OLLAMA_CLIENT_LOCK:
+        if OLLAMA_CLIENT is not None:
+            OLLAMA_CLIENT.close()
+            OLLAMA_CLIENT = None
+
+def get_response_cache():
+    """Return the process-wide response cache, or None when caching is disabled."""
+    global RESPONSE_CACHE
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if RESPONSE_CACHE is None:
+        from response_cache import ResponseCache
+        RESPONSE_CACHE = ResponseCache()
+    return RESPONSE_CACHE
+
+def print_response_cache_stats():
+    """Print the response cache hit rate if the cache was used in this process."""
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.print_stats()
+
+OLLAMA_TIMING_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration",
+                        "eval_count", "eval_duration")  # Counters Ollama reports in the final chunk of a response
+
+def build_messages(user_message, system_message=None):
+    """Build the chat messages, putting a byte-stable system prefix first so the server can reuse its prompt cache."""
+    messages = [{'role': 'user', 'content': user_message}]
+    if system_message:
+        messages.insert(0, {'role': 'system', 'content': system_message})
+    return messages
+
+def generation_options(profile, options=None):
+    """Return the generation options of a profile in GENERATION_PROFILES, overridden by explicit options."""
+    return {**GENERATION_PROFILES.get(profile, {}), **(options or {})}
+
+def _cache_options(options, max_words, max_chars, response_format=None):
+    """Combine generation options, output limits and the response format into the options part of a cache key."""
+    cache_options = dict(options or {})
+    if response_format is not None:
+        cache_options["format"] = response_format
+    if max_words is not None:
+        cache_options["max_words"] = max_words
+    if max_chars is not None:
+        cache_options["max_chars"] = max_chars
+    return cache_options
+
+def _over_limit(text, max_words, max_chars):
+    """Check whether streamed text has gone past a word or character limit."""
+    return (max_chars is not None and len(text) > max_chars) or \
+        (max_words is not None and len(text.split()) > max_words)
+
+def _reset_stats(stats):
+    """Fill a stats dict with empty values for a new call."""
+    stats.update(time_to_first_token=None, total_time=None, stopped_early=False, cancelled=False, cached=False,
+                 failed=False, retries=0, hedged=False)
+    stats.update(dict.fromkeys(OLLAMA_TIMING_FIELDS))
+    return stats
+
+def stream_story_response_from_model(model_name, user_message, options=None, max_words=None, max_chars=None,
+                                     cancel_event=None, stats=None, system_message=None, response_format=None,
+                                     timeout=None):
+    """Yield response text chunks as they arrive, stopping generation once a limit is exceeded.
+
+    The chunk that crosses max_words or max_chars is still yielded so the caller can
+    see the overflow and truncate. If a stats dict is passed it receives
+    time_to_first_token, total_time, stopped_early, cancelled and, when the response
+    runs to completion, Ollama's timing counters (prompt_eval_count, eval_count, ...).
+    This is a single attempt; get_story_response_from_model adds the call policy.
+    """
+    request_kwargs = {"options": options} if options else {}
+    if response_format is not None:
+        request_kwargs["format"] = response_format
+    stats = _reset_stats(stats if stats is not None else {})
+    start_time = time.time()
+    text = ''
+    # Closing the stream early drops the connection, which makes the server stop generating
+    with closing(get_ollama_client().iter_chat(model_name, build_messages(user_message, system_message),
+                                               timeout=timeout, **request_kwargs)) as chunks:
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                stats["cancelled"] = True
+                break
+            if chunk.get('done'):
+                stats.update({field: chunk.get(field) for field in OLLAMA_TIMING_FIELDS})
+            content = chunk.get('message', {}).get('content')
+            if not content:
+                continue
+            if stats["time_to_first_token"] is None:
+                stats["time_to_first_token"] = time.time() - start_time
+            text += content
+            yield content
+            if _over_limit(text, max_words, max_chars):
+                stats["stopped_early"] = True
+                break
+    stats["total_time"] = time.time() - start_time
+
+def get_story_response_from_model(model_name, user_message, use_cache=False, options=None, cancel_event=None,
+                                  max_words=None, max_chars=None, stats=None, system_message=None,
+                                  response_format=None, caller=None, profile=None):
+    """Get response content from the model specifically for story writing.
+
+    Pass use_cache=True for deterministic tasks (summaries, prompts, trims); story
+    continuation should bypass the cache so every call returns a fresh sample.
+    options are passed to Ollama as generation options (e.g. a seed). Setting
+    cancel_event (a threading.Event) stops the stream and returns None. max_words and
+    max_chars stop generation as soon as the response goes past them. system_message
+    is sent ahead of the user message as the invariant part of the prompt.
+    response_format is sent as Ollama's format ("json" or a JSON schema) to get
+    structured output; the caller still has to validate it. caller tags the call in
+    the run's metrics (e.g. "continuation", "trim") and selects its timeout, retry
+    and hedging policy in call_policy.py. profile names the GENERATION_PROFILES entry
+    (token cap, stop sequences, context size, sampling) and defaults to caller; options
+    override single values of it. Returns None once the policy gives up.
+    """
+    stats = _reset_stats(stats if stats is not None else {})
+    options = generation_options(profile or caller, options)
+    try:
+        return _fetch_story_response(model_name, user_message, use_cache, options, cancel_event, max_words,
+                                     max_chars, stats, system_message, response_format, caller)
+    finally:
+        if CALL_METRICS_ENABLED:
+            record_call(caller, model_name, stats)
+
+def _fetch_story_response(model_name, user_message, use_cache, options, cancel_event, max_words, max_chars, stats,
+                          system_message, response_format, caller):
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.make_key(model_name, build_messages(user_message, system_message),
+                                   _cache_options(options, max_words, max_chars, response_format))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            stats["cached"] = True
+            return cached
+    timeout = get_call_policy(caller)["timeout"]
+
+    def run_attempt(attempt_stats, attempt_cancel_event):
+        return ''.join(stream_story_response_from_model(
+            model_name, user_message, options=options, max_words=max_words, max_chars=max_chars,
+            cancel_event=attempt_cancel_event, stats=attempt_stats, system_message=system_message,
+            response_format=response_format, timeout=timeout
+        ))
+
+    try:
+        response = call_with_policy(caller, run_attempt, stats, is_endpoint_failure, cancel_event)
+    except Exception as e:
+        print(f"An error occurred while retrieving the model's response: {e}")
+        stats["failed"] = True
+        return None
+    if stats["cancelled"]:
+        return None
+    if cache is not None and response:
+        cache.put(cache_key, model_name, response, stats["total_time"])
+    return response
+
+async def get_story_response_from_model_async(client, model_name, user_message, use_cache=False,
+                                              max_words=None, max_chars=None, stats=None, system_message=None,
+                                              response_format=None, caller=None, profile=None, options=None):
+    """Async counterpart of get_story_response_from_model using an AsyncOllamaClient."""
+    stats = _reset_stats(stats if stats is not None else {})
+    options = generation_options(profile or caller, options)
+    try:
+        return await _fetch_story_response_async(client, model_name, user_message, use_cache, options, max_words,
+                                                 max_chars, stats, system_message, response_format, caller)
+    finally:
+        if CALL_METRICS_ENABLED:
+            record_call(caller, model_name, stats)
+
+async def _fetch_story_response_async(client, model_name, user_message, use_cache, options, max_words, max_chars,
+                                      stats, system_message, response_format, caller):
+    user_messages = build_messages(user_message, system_message)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.make_key(model_name, user_messages,
+                                   _cache_options(options, max_words, max_chars, response_format))
+        # The cache is SQLite; its reads and writes run in a thread so they do not block the event loop
+        cached = await asyncio.to_thread(cache.get, cache_key)
+        if cached is not None:
+            stats["cached"] = True
+            return cached
+    request_kwargs = {"options": options} if options else {}
+    if response_format is not None:
+        request_kwargs["format"] = response_format
+    timeout = get_call_policy(caller)["timeout"]
+
+    async def run_attempt(attempt_stats):
+        _reset_stats(attempt_stats)
+        start_time = time.time()
+        response = ''
+        async with aclosing(client.iter_chat(model_name, user_messages, timeout=timeout, **request_kwargs)) as chunks:
+            async for chunk in chunks:
+                if chunk.get('done'):
+                    attempt_stats.update({field: chunk.get(field) for field in OLLAMA_TIMING_FIELDS})
+                content = chunk.get('message', {}).get('content')
+                if not content:
+                    continue
+                if attempt_stats["time_to_first_token"] is None:
+                    attempt_stats["time_to_first_token"] = time.time() - start_time
+                response += content
+                if _over_limit(response, max_words, max_chars):
+                    attempt_stats["stopped_early"] = True
+                    break
+        attempt_stats["total_time"] = time.time() - start_time
+        return response
+
     try:
-        responses = ollama.chat(model=model_name, messages=user_messages, stream=True)
-        return ''.join(chunk['message']['content'] for chunk in responses if 'message' in chunk and 'content' in chunk['message'])
+        response = await call_with_policy_async(caller, run_attempt, stats, is_endpoint_failure)
     except Exception as e:
         print(f"An error occurred while retrieving the model's response: {e}")
-        return None
\ No newline at end of file
+        stats["failed"] = True
+        return None
+    if cache is not None and response:
+        await asyncio.to_thread(cache.put, cache_key, model_name, response, stats["total_time"])
+    return response
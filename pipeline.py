@@ -0,0 +1,132 @@
+import time
+import atexit
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import ollama_utils
+from ollama_utils import (
+    install_and_setup_ollama,
+    kill_existing_ollama_service,
+    clear_gpu_memory,
+    start_ollama_service,
+    stop_ollama_service,
+    get_ollama_client,
+    print_response_cache_stats
+)
+from call_metrics import write_call_metrics_report
+from artifact_store import print_artifact_store_stats
+
+MODEL_NAME = 'llama3'
+KEEP_ALIVE = -1  # Keep the model resident for the whole pipeline instead of letting it unload between stages
+DEFAULT_STAGES = ("story", "prompts", "trim")
+
+def run_story_stage(model_name, inputs):
+    """Generate a new story with make_story and return its JSON path."""
+    import make_story
+    json_file = make_story.JSON_FILE or make_story.new_story_json_path()
+    make_story.write_story_segment(model_name, make_story.INITIAL_PROMPT, make_story.LOOPS, json_file)
+    return json_file
+
+def run_summarize_stage(model_name, inputs):
+    """Write the 10-word chapter summaries for the story."""
+    import summarize_chapters
+    return summarize_chapters.summarize_story_chapters(inputs["story"], model_name)
+
+def run_prompts_stage(model_name, inputs):
+    """Write chapter summaries with positive and negative AI prompts for the story."""
+    import summarize_chapters_add_ai_prompts
+    return summarize_chapters_add_ai_prompts.summarize_story_chapters(inputs["story"], model_name)
+
+def run_trim_stage(model_name, inputs):
+    """Write the shortened scene descriptions for the story."""
+    import trim_json
+    return trim_json.trim_story_file(inputs["story"])
+
+# Stage name -> (stages whose output it needs, function(model_name, inputs) -> output path).
+# summarize and prompts write the same *_10_word_chapter_summaries.json, so only run one of them.
+STAGES = {
+    "story": ((), run_story_stage),
+    "summarize": (("story",), run_summarize_stage),
+    "prompts": (("story",), run_prompts_stage),
+    "trim": (("story",), run_trim_stage),
+}
+
+def run_stages(model_name, stage_names, outputs):
+    """Run the selected stages as a DAG, starting each one as soon as its inputs are ready.
+
+    outputs holds already available results (e.g. an existing story) and receives each
+    stage's output path. Returns per-stage timings in seconds.
+    """
+    timings = {}
+    pending = [name for name in stage_names if name not in outputs]
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+        while pending or running:
+            for name in list(pending):
+                dependencies, run = STAGES[name]
+                if all(dependency in outputs for dependency in dependencies):
+                    pending.remove(name)
+                    print(f"\n==== Starting stage '{name}' ====\n")
+                    started = time.time()
+                    running[pool.submit(run, model_name, dict(outputs))] = (name, started)
+            if not running:
+                missing = {name: STAGES[name][0] for name in pending}
+                raise ValueError(f"Stages are missing their inputs: {missing}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, started = running.pop(future)
+                outputs[name] = future.result()
+                timings[name] = time.time() - started
+                print(f"\n==== Stage '{name}' finished in {timings[name]:.2f} seconds: {outputs[name]} ====\n")
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the storyline stages in one process against one warm Ollama service.")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"Comma-separated stages to run, from: {', '.join(STAGES)}")
+    parser.add_argument("--story-file", default=None, help="Use an existing *_story.json instead of running the story stage")
+    parser.add_argument("--model", default=MODEL_NAME)
+    args = parser.parse_args()
+
+    stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+    outputs = {"story": args.story_file} if args.story_file else {}
+
+    start_time = time.time()
+
+    kill_existing_ollama_service()
+    clear_gpu_memory()
+    install_and_setup_ollama(args.model)
+    start_ollama_service()
+
+    ollama_utils.OLLAMA_KEEP_ALIVE = KEEP_ALIVE
+    ollama_utils.close_ollama_client()  # Recreate the shared client with the pipeline keep-alive
+    load_start = time.time()
+    get_ollama_client().load_model(args.model)
+    print(f"Model '{args.model}' loaded in {time.time() - load_start:.2f} seconds and kept resident.")
+
+    try:
+        timings = run_stages(args.model, stage_names, outputs)
+    finally:
+        # KEEP_ALIVE pins the model; unload it so it does not stay resident in a service this run did not start
+        try:
+            get_ollama_client().unload_model(args.model)
+        except Exception as e:
+            print(f"Could not unload model '{args.model}': {e}")
+    print_response_cache_stats()
+    print_artifact_store_stats()
+    write_call_metrics_report("pipeline")
+
+    stop_ollama_service()
+    clear_gpu_memory()
+
+    print("\nStage timings:")
+    for name, seconds in timings.items():
+        print(f"  {name:<10} {seconds:10.2f} seconds")
+    print(f"Total time taken: {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    atexit.register(stop_ollama_service)
+    atexit.register(clear_gpu_memory)
+    main()
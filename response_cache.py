@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_PATH = os.path.join(os.getcwd(), "ollama_response_cache.sqlite3")
+CACHE_MAX_ENTRIES = 50000  # Evict least recently used responses beyond this many entries
+CACHE_MAX_BYTES = 256 * 1024 * 1024  # Evict least recently used responses beyond this much stored text
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60  # Responses older than this are treated as misses and dropped
+CACHE_EVICT_EVERY = 100  # Run eviction after this many writes
+
+class ResponseCache:
+    """On-disk, content-addressed cache of model responses with LRU and age-based eviction."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._writes_since_eviction = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+            "created_at REAL, last_used REAL, generation_seconds REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    @staticmethod
+    def make_key(model_name, messages, options=None):
+        """Hash the model, the full message list and the generation options into a cache key."""
+        material = json.dumps({"model": model_name, "messages": messages, "options": options or {}},
+                              sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for a key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at, generation_seconds FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_seconds += row[2] or 0.0
+            return row[0]
+
+    def put(self, key, model_name, response, generation_seconds=0.0):
+        """Store a response and evict old entries every CACHE_EVICT_EVERY writes."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model_name, response, len(response.encode("utf-8")), now, now, generation_seconds)
+            )
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= CACHE_EVICT_EVERY:
+                self._evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until within the size limits."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        self._writes_since_eviction = 0
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+        entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self):
+        """Return hit-rate statistics for this process together with the cache size."""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "entries": entries,
+            "bytes": total_bytes
+        }
+
+    def print_stats(self):
+        """Print a one-line summary of the cache statistics."""
+        stats = self.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate'] * 100:.1f}% hit rate), ~{stats['saved_seconds']:.1f}s of generation saved, "
+              f"{stats['entries']} entries ({stats['bytes'] / 1024:.0f} KiB) in {self.path}")
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,111 @@
+from collections.abc import Sequence
+
+HASHING_FEATURES = 2 ** 20  # Width of the hashed term space; large enough that collisions are negligible
+INITIAL_ROWS = 256  # Rows and nonzero terms reserved up front in a SimilarityIndex; both double when full
+INITIAL_NONZEROS = 16384
+
+VECTORIZER = None
+
+def get_vectorizer():
+    """Return the shared hashing vectorizer, importing scikit-learn on first use."""
+    global VECTORIZER
+    if VECTORIZER is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+        # A stateless hashing vectorizer never needs fitting, so every text maps to the same
+        # L2-normalised sparse row no matter what else is in the index and cosine similarity
+        # reduces to a sparse dot product.
+        VECTORIZER = HashingVectorizer(
+            n_features=HASHING_FEATURES,
+            alternate_sign=False,
+            norm="l2",
+            stop_words="english"
+        )
+    return VECTORIZER
+
+def vectorize(texts):
+    """Turn a list of texts into L2-normalised sparse term rows."""
+    return get_vectorizer().transform(texts)
+
+def text_similarity(text1, text2):
+    """Calculate the cosine similarity between two texts without fitting a vectorizer."""
+    vectors = vectorize([text1, text2])
+    return float(vectors[0].multiply(vectors[1]).sum())
+
+def _reserve(buffer, size):
+    """Return buffer, or a copy with at least double its capacity when it is smaller than size."""
+    if len(buffer) >= size:
+        return buffer
+    import numpy as np
+    grown = np.empty(max(size, 2 * len(buffer)), dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+class SimilarityIndex:
+    """Sparse index of accepted chapters that scores a candidate against them in one mat-vec.
+
+    The rows are kept as CSR arrays that grow by doubling, so adding a chapter copies
+    only its own terms and scoring never re-stacks the whole story.
+    """
+
+    def __init__(self, texts=(), window=None):
+        self.window = window  # Only the last `window` chapters are compared; None compares the whole story
+        self._first_index = 0  # Story index of the first row kept
+        self._start = self._end = 0  # Rows [_start, _end) of the buffers are in the window
+        self._data = self._indices = self._indptr = None
+        if window is not None and isinstance(texts, Sequence):
+            # Only the chapters inside the window are vectorized, e.g. when resuming a long story
+            self._first_index = max(0, len(texts) - window)
+            texts = texts[self._first_index:]
+        for text in texts:
+            self.add(text)
+
+    def __len__(self):
+        return self._first_index + self._end - self._start
+
+    def add(self, text):
+        """Add an accepted chapter to the index."""
+        row = vectorize([text])
+        if self._indptr is None:
+            import numpy as np
+            self._data = np.empty(INITIAL_NONZEROS, dtype=row.data.dtype)
+            self._indices = np.empty(INITIAL_NONZEROS, dtype=row.indices.dtype)
+            self._indptr = np.zeros(INITIAL_ROWS + 1, dtype=row.indices.dtype)
+        nnz = self._indptr[self._end]
+        self._data = _reserve(self._data, nnz + row.nnz)
+        self._indices = _reserve(self._indices, nnz + row.nnz)
+        self._indptr = _reserve(self._indptr, self._end + 2)
+        self._data[nnz:nnz + row.nnz] = row.data
+        self._indices[nnz:nnz + row.nnz] = row.indices
+        self._end += 1
+        self._indptr[self._end] = nnz + row.nnz
+        if self.window is not None and self._end - self._start > self.window:
+            dropped = self._end - self._start - self.window
+            self._start += dropped
+            self._first_index += dropped
+            if self._start > self.window:
+                self._compact()
+
+    def _compact(self):
+        """Move the rows in the window to the front of the buffers once the dropped ones outnumber them."""
+        first, last = self._indptr[self._start], self._indptr[self._end]
+        self._data[:last - first] = self._data[first:last].copy()
+        self._indices[:last - first] = self._indices[first:last].copy()
+        self._indptr[:self._end - self._start + 1] = self._indptr[self._start:self._end + 1] - first
+        self._end -= self._start
+        self._start = 0
+
+    def scores(self, text):
+        """Return (chapter_index, similarity) pairs for every chapter in the window."""
+        if self._end == self._start:
+            return []
+        from scipy.sparse import csr_matrix
+        first, last = self._indptr[self._start], self._indptr[self._end]
+        matrix = csr_matrix((self._data[first:last], self._indices[first:last],
+                             self._indptr[self._start:self._end + 1] - first),
+                            shape=(self._end - self._start, HASHING_FEATURES), copy=False)
+        similarities = (matrix @ vectorize([text]).T).toarray().ravel()
+        return [(self._first_index + offset, float(score)) for offset, score in enumerate(similarities)]
+
+    def most_similar(self, text):
+        """Return the (chapter_index, similarity) pair with the highest score, or None if empty."""
+        return max(self.scores(text), key=lambda pair: pair[1], default=None)
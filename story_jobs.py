@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import atexit
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+import make_story
+from call_metrics import write_call_metrics_report
+from ollama_utils import (
+    install_and_setup_ollama,
+    kill_existing_ollama_service,
+    clear_gpu_memory,
+    start_ollama_service,
+    stop_ollama_service,
+    get_ollama_client
+)
+
+MODEL_NAME = 'llama3'
+JOB_WORKERS = 4  # Story loops in flight at once; match OLLAMA_NUM_PARALLEL on the server
+OUTPUT_DIR = 'storylines'  # Where jobs without an explicit output file write their *_story.json
+
+class StoryJob:
+    """One story to write: its prompt, persona, loop count and output file, advanced one loop at a time."""
+
+    def __init__(self, prompt, persona=None, loops=None, json_file=None, resume=False, name=None):
+        self.prompt = prompt
+        self.persona = persona or make_story.PERSONA_TO_USE
+        self.loops = make_story.LOOPS if loops is None else loops
+        self.json_file = json_file
+        self.resume = resume
+        self.name = name or os.path.basename(json_file or "story")
+        self.status = "pending"
+        self.loops_done = 0
+        self.chapters = None
+        self.error = None
+        self.elapsed_seconds = 0.0
+        self._steps = None
+
+    def step(self, model_name):
+        """Run the job's next loop and return True once it has finished or failed."""
+        if self._steps is None:
+            self._steps = make_story.iter_story_segment(model_name, self.prompt, self.loops, self.json_file,
+                                                        self.resume, self.persona)
+            self.status = "running"
+        start = time.time()
+        try:
+            self.loops_done = next(self._steps) + 1
+            return False
+        except StopIteration as finished:
+            self.chapters = finished.value
+            self.status = "done"
+            return True
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+            print(f"Story job {self.name} failed: {e}")
+            return True
+        finally:
+            self.elapsed_seconds += time.time() - start
+
+def load_job_specs(path):
+    """Read job specs from a JSON list or a JSONL file of {"prompt", "persona", "loops", "output", "resume"} objects."""
+    with open(path, 'r') as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def build_jobs(specs, output_dir=OUTPUT_DIR):
+    """Create a StoryJob per spec, giving jobs without an output file their own timestamped *_story.json."""
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    jobs = []
+    for index, spec in enumerate(specs):
+        if "prompt" not in spec and not spec.get("resume"):
+            raise ValueError(f"Job {index + 1} has no prompt")
+        if spec.get("resume") and not spec.get("output"):
+            raise ValueError(f"Job {index + 1} resumes a story but has no output file to resume")
+        json_file = spec.get("output") or os.path.join(output_dir, f"{timestamp}_job{index + 1:03d}_story.json")
+        jobs.append(StoryJob(spec.get("prompt"), spec.get("persona"), spec.get("loops"), json_file,
+                             spec.get("resume", False), name=spec.get("name")))
+    return jobs
+
+def run_story_jobs(jobs, model_name, workers=None):
+    """Advance every job one loop at a time in round-robin order on a pool of worker threads.
+
+    A job is only ever held by one worker, and goes to the back of the queue after each
+    loop, so every story gets its turn while the others do their client-side work.
+    """
+    workers = min(workers or JOB_WORKERS, len(jobs)) or 1
+    ready = deque(jobs)
+    condition = threading.Condition()
+    remaining = len(jobs)
+
+    def worker():
+        nonlocal remaining
+        while True:
+            with condition:
+                while not ready and remaining > 0:
+                    condition.wait()
+                if remaining == 0:
+                    return
+                job = ready.popleft()
+            finished = job.step(model_name)
+            with condition:
+                if finished:
+                    remaining -= 1
+                    print(f"Story job {job.name} {job.status} after {job.loops_done}/{job.loops} loops "
+                          f"({remaining} jobs left)")
+                else:
+                    ready.append(job)
+                condition.notify_all()
+
+    threads = [threading.Thread(target=worker, name=f"story-job-worker-{index + 1}") for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return jobs
+
+def print_job_report(jobs):
+    """Print the outcome of every job."""
+    print("\nStory jobs:")
+    for job in jobs:
+        detail = f"error: {job.error}" if job.error else job.json_file
+        print(f"  {job.name:<40} {job.status:<8} {job.loops_done:>4}/{job.loops:<4} loops "
+              f"{job.elapsed_seconds:8.1f}s  {detail}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Write many stories at once against one Ollama service.")
+    parser.add_argument("jobs_file", help='JSON list or JSONL file of {"prompt", "persona", "loops", "output", "resume"} specs')
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="Story loops in flight at once")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    jobs = build_jobs(load_job_specs(args.jobs_file), args.output_dir)
+    if not jobs:
+        parser.error(f"No jobs in {args.jobs_file}")
+
+    make_story.MODEL_NAME = args.model  # Summary and synopsis calls read the module setting
+    start_time = time.time()
+
+    kill_existing_ollama_service()
+    clear_gpu_memory()
+    install_and_setup_ollama(args.model)
+    start_ollama_service()
+    get_ollama_client().load_model(args.model)
+
+    print(f"Running {len(jobs)} story jobs with {min(args.workers, len(jobs))} workers")
+    run_story_jobs(jobs, args.model, args.workers)
+    print_job_report(jobs)
+    write_call_metrics_report("story_jobs")
+
+    stop_ollama_service()
+    clear_gpu_memory()
+
+    print(f"Total time taken: {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    atexit.register(stop_ollama_service)
+    atexit.register(clear_gpu_memory)
+    main()
@@ -0,0 +1,413 @@
+import os
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import Sequence
+
+FSYNC_POLICIES = ("always", "interval", "never")
+FSYNC_INTERVAL = 10  # Records between fsyncs with the "interval" policy
+CHAPTER_LENGTH = struct.Struct("<I")  # Length prefix of each chapter record in a chapter store's data file
+LEGACY_ENCODING = 'cp1252'  # Storylines written before UTF-8 was enforced used the Windows default encoding
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file and rename it over the target so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_json_file(path):
+    """Read a UTF-8 JSON file, falling back to LEGACY_ENCODING for files written by older versions."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except UnicodeDecodeError:
+        with open(path, 'r', encoding=LEGACY_ENCODING) as f:
+            return json.load(f)
+
+def write_story_json(path, data):
+    """Write a story JSON atomically like write_json_atomic, but stream its story_chapters one at a time.
+
+    The output is identical to json.dump(data, f, indent=2), while the chapters can be a
+    ChapterStore or a generator that is never turned into a list.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write("{")
+        for position, (key, value) in enumerate(data.items()):
+            f.write(f"{',' if position else ''}\n  {json.dumps(key, ensure_ascii=False)}: ")
+            if key == "story_chapters":
+                _write_json_list(f, value)
+            else:
+                f.write(json.dumps(value, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+        f.write("\n}" if data else "}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _write_json_list(f, items):
+    empty = True
+    for item in items:
+        f.write("[\n    " if empty else ",\n    ")
+        f.write(json.dumps(item, indent=2, ensure_ascii=False).replace("\n", "\n    "))
+        empty = False
+    f.write("[]" if empty else "\n  ]")
+
+def chapter_log_path(json_file):
+    """Return the append-only chapter log path that belongs to a story JSON file."""
+    return f"{os.path.splitext(json_file)[0]}.log.jsonl"
+
+def chapter_store_paths(json_file):
+    """Return the data, offset index and metadata paths of a story's chapter store."""
+    stem = os.path.splitext(json_file)[0]
+    return f"{stem}.chapters.dat", f"{stem}.chapters.idx", f"{stem}.chapters.meta.json"
+
+def has_chapter_store(json_file):
+    """Check whether a story has a chapter store."""
+    data_path, index_path, _ = chapter_store_paths(json_file)
+    return os.path.exists(data_path) and os.path.exists(index_path)
+
+class ChapterStore(Sequence):
+    """A story's chapters as length-prefixed UTF-8 records in a data file, with an offset index.
+
+    The data file is read through a memory map and the index is a flat array of record
+    offsets, so store[i] decodes one chapter whatever the story's length and the chapters
+    are never all parsed or held in memory. Opened writable, chapters can be appended and
+    a record torn by a crash is dropped (or re-indexed) first.
+    """
+
+    def __init__(self, json_file, writable=False):
+        self.data_path, self.index_path, _ = chapter_store_paths(json_file)
+        self.writable = writable
+        self._offsets = array('Q')
+        self._map = None
+        if writable:
+            for path in (self.data_path, self.index_path):
+                open(path, 'ab').close()
+        with open(self.index_path, 'rb') as f:
+            index_bytes = f.read()
+        self._offsets.frombytes(index_bytes[:len(index_bytes) - len(index_bytes) % self._offsets.itemsize])
+        self._data_end = self._valid_data_end()
+        self._reader = open(self.data_path, 'rb')
+        self._writer = self._index_writer = None
+        if writable:
+            self._recover(len(index_bytes))
+            self._writer = open(self.data_path, 'ab')
+            self._index_writer = open(self.index_path, 'ab')
+
+    def _valid_data_end(self):
+        """Drop index entries whose record is missing from the data file and return where the last one ends."""
+        data_size = os.path.getsize(self.data_path)
+        with open(self.data_path, 'rb') as f:
+            while self._offsets:
+                offset = self._offsets[-1]
+                f.seek(offset)
+                prefix = f.read(CHAPTER_LENGTH.size)
+                if len(prefix) == CHAPTER_LENGTH.size:
+                    end = offset + CHAPTER_LENGTH.size + CHAPTER_LENGTH.unpack(prefix)[0]
+                    if end <= data_size:
+                        return end
+                self._offsets.pop()
+        return 0
+
+    def _recover(self, index_size):
+        """Index complete records written after the last index entry and cut off a torn one."""
+        data_size = os.path.getsize(self.data_path)
+        with open(self.data_path, 'rb') as f:
+            f.seek(self._data_end)
+            while True:
+                prefix = f.read(CHAPTER_LENGTH.size)
+                if len(prefix) < CHAPTER_LENGTH.size:
+                    break
+                end = self._data_end + CHAPTER_LENGTH.size + CHAPTER_LENGTH.unpack(prefix)[0]
+                if end > data_size:
+                    break
+                self._offsets.append(self._data_end)
+                self._data_end = end
+                f.seek(end)
+        if data_size != self._data_end:
+            os.truncate(self.data_path, self._data_end)
+        if index_size != len(self._offsets) * self._offsets.itemsize:
+            with open(self.index_path, 'wb') as f:
+                self._offsets.tofile(f)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chapter index out of range")
+        offset = self._offsets[index]
+        if self._map is None or len(self._map) < self._data_end:
+            self._remap()
+        length = CHAPTER_LENGTH.unpack_from(self._map, offset)[0]
+        start = offset + CHAPTER_LENGTH.size
+        return self._map[start:start + length].decode('utf-8')
+
+    def _remap(self):
+        if self._writer is not None:
+            self._writer.flush()
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def append(self, chapter):
+        """Append a chapter: its record goes to the data file first, then its offset to the index."""
+        if not self.writable:
+            raise ValueError(f"{self.data_path} is open read-only")
+        encoded = chapter.encode('utf-8')
+        self._writer.write(CHAPTER_LENGTH.pack(len(encoded)) + encoded)
+        self._writer.flush()
+        self._index_writer.write(array('Q', [self._data_end]).tobytes())
+        self._index_writer.flush()
+        self._offsets.append(self._data_end)
+        self._data_end += CHAPTER_LENGTH.size + len(encoded)
+
+    def fsync(self):
+        """Force appended chapters to disk."""
+        for f in (self._writer, self._index_writer):
+            if f is not None:
+                os.fsync(f.fileno())
+
+    def close(self):
+        """Unmap and close the files; the length stays available."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        for f in (self._reader, self._writer, self._index_writer):
+            if f is not None:
+                f.close()
+        self._writer = self._index_writer = None
+        self.writable = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_chapter_store_meta(json_file, data):
+    """Record a finished story's other fields, tied to the story JSON's size and mtime, next to its chapter store."""
+    stat = os.stat(json_file)
+    write_json_atomic(chapter_store_paths(json_file)[2], {
+        "fields": {key: value for key, value in data.items() if key != "story_chapters"},
+        "chapters": len(data["story_chapters"]),
+        "story_json": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    })
+
+def load_story(json_file):
+    """Load a story JSON, with story_chapters read from its chapter store when that store is up to date.
+
+    The store is only used if it was finalized together with this exact JSON file, so an
+    edited or replaced story is read from the JSON as before.
+    """
+    meta_path = chapter_store_paths(json_file)[2]
+    if os.path.exists(meta_path) and has_chapter_store(json_file):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stat = os.stat(json_file)
+        if meta["story_json"] == {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+            chapters = ChapterStore(json_file)
+            if len(chapters) == meta["chapters"]:
+                return {"story_chapters": chapters, **meta["fields"]}
+            chapters.close()
+    return read_json_file(json_file)
+
+class JsonStoryStorage:
+    """Rewrite the whole story JSON after every accepted chapter."""
+
+    def __init__(self, json_file):
+        self.json_file = json_file
+
+    def start(self, chapters, summary, next_loop=0, summary_state=None):
+        """Write the initial (or resumed) story and return the chapter list to keep appending to."""
+        self.record(chapters, summary, next_loop, summary_state)
+        return chapters
+
+    def record(self, chapters, summary, next_loop, summary_state=None):
+        """Persist the current chapters, summary, summary state and the index of the next loop to run."""
+        data = {"story_chapters": chapters, "story_summary": summary, "next_loop": next_loop}
+        if summary_state is not None:
+            data["summary_state"] = summary_state
+        write_json_atomic(self.json_file, data)
+
+    def finalize(self, data):
+        """Write the consolidated story JSON."""
+        write_json_atomic(self.json_file, data)
+
+class JsonlStoryStorage:
+    """Append each accepted chapter and summary revision to a JSONL log; build the story JSON once at the end."""
+
+    def __init__(self, json_file, fsync_policy="always"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}', expected one of {FSYNC_POLICIES}")
+        self.json_file = json_file
+        self.log_file = chapter_log_path(json_file)
+        self.fsync_policy = fsync_policy
+        self._log = None
+        self._logged_chapters = 0
+        self._logged_summary = None
+        self._logged_next_loop = None
+        self._logged_summary_state = None
+        self._unsynced_records = 0
+
+    def start(self, chapters, summary, next_loop=0, summary_state=None):
+        """Open the log, continuing an existing one, write whatever it does not hold yet and return the chapters."""
+        if os.path.exists(self.log_file):
+            state = read_chapter_log(self.log_file)
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(state["valid_bytes"])  # Drop a record torn by a crash before appending
+            self._logged_chapters = len(state["chapters"])
+            self._logged_summary = state["summary"]
+            self._logged_next_loop = state["next_loop"]
+            self._logged_summary_state = state["summary_state"]
+        self._log = open(self.log_file, 'a', encoding='utf-8')
+        self.record(chapters, summary, next_loop, summary_state)
+        return chapters
+
+    def record(self, chapters, summary, next_loop, summary_state=None):
+        """Append any chapters, summary revision, summary state and loop checkpoint not yet in the log."""
+        for chapter in chapters[self._logged_chapters:]:
+            self._append({"type": "chapter", "text": chapter})
+        self._logged_chapters = len(chapters)
+        self._record_progress(summary, next_loop, summary_state)
+
+    def _record_progress(self, summary, next_loop, summary_state):
+        if summary != self._logged_summary:
+            self._append({"type": "summary", "text": summary})
+            self._logged_summary = summary
+        if summary_state is not None and summary_state != self._logged_summary_state:
+            self._append({"type": "summary_state", "state": summary_state})
+            self._logged_summary_state = summary_state
+        if next_loop != self._logged_next_loop:
+            self._append({"type": "checkpoint", "next_loop": next_loop})
+            self._logged_next_loop = next_loop
+        self._sync()
+
+    def _append(self, record):
+        self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._unsynced_records += 1
+
+    def _sync(self):
+        self._log.flush()
+        if self.fsync_policy == "always" or (
+                self.fsync_policy == "interval" and self._unsynced_records >= FSYNC_INTERVAL):
+            self._fsync()
+            self._unsynced_records = 0
+
+    def _fsync(self):
+        os.fsync(self._log.fileno())
+
+    def finalize(self, data):
+        """Write the consolidated story JSON atomically and remove the log."""
+        write_json_atomic(self.json_file, data)
+        self._log.close()
+        os.remove(self.log_file)
+
+class IndexedStoryStorage(JsonlStoryStorage):
+    """Append chapters to a memory-mapped ChapterStore; the log only holds summary revisions and checkpoints.
+
+    The story is kept as the store itself instead of a list, and the finished JSON is
+    streamed from it, so a story with tens of thousands of chapters is never held in memory.
+    The store stays next to the JSON for the post-processing scripts (see load_story).
+    """
+
+    def __init__(self, json_file, fsync_policy="always"):
+        super().__init__(json_file, fsync_policy)
+        self.chapters = None
+
+    def start(self, chapters, summary, next_loop=0, summary_state=None):
+        """Open the chapter store and log, append whatever they do not hold yet and return the store."""
+        resumed = isinstance(chapters, ChapterStore)
+        if resumed:
+            chapters.close()  # Reopened for appending below
+        self.chapters = ChapterStore(self.json_file, writable=True)
+        super().start(self.chapters if resumed else chapters, summary, next_loop, summary_state)
+        return self.chapters
+
+    def record(self, chapters, summary, next_loop, summary_state=None):
+        """Append any new chapters to the store, then log the summary revision, summary state and loop checkpoint."""
+        for chapter in chapters[len(self.chapters):]:
+            self.chapters.append(chapter)
+            self._unsynced_records += 1
+        self._record_progress(summary, next_loop, summary_state)
+
+    def _fsync(self):
+        self.chapters.fsync()
+        super()._fsync()
+
+    def finalize(self, data):
+        """Stream the story JSON from the store, record its other fields next to the store and remove the log."""
+        write_story_json(self.json_file, data)
+        write_chapter_store_meta(self.json_file, data)
+        self.chapters.close()
+        self._log.close()
+        os.remove(self.log_file)
+
+def read_chapter_log(log_file):
+    """Replay a chapter log into its chapters, latest summary, summary state and next loop, ignoring a torn final line."""
+    state = {"chapters": [], "summary": "", "summary_state": None, "next_loop": None, "valid_bytes": 0}
+    with open(log_file, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                break  # A crash mid-write can only tear the last record
+            if not line.endswith(b"\n"):
+                break
+            if record["type"] == "chapter":
+                state["chapters"].append(record["text"])
+            elif record["type"] == "summary":
+                state["summary"] = record["text"]
+            elif record["type"] == "summary_state":
+                state["summary_state"] = record["state"]
+            elif record["type"] == "checkpoint":
+                state["next_loop"] = record["next_loop"]
+            state["valid_bytes"] += len(line)
+    return state
+
+def story_json_path(path):
+    """Map a chapter log path back to its story JSON path; other paths are returned unchanged."""
+    if path.endswith(".log.jsonl"):
+        return path[:-len(".log.jsonl")] + ".json"
+    return path
+
+def load_story_checkpoint(json_file):
+    """Load the chapters, summary, summary state and next loop index of an interrupted (or finished) story."""
+    log_file = chapter_log_path(json_file)
+    if os.path.exists(log_file):
+        state = read_chapter_log(log_file)
+        chapters, summary, next_loop = state["chapters"], state["summary"], state["next_loop"]
+        summary_state = state["summary_state"]
+        if not chapters and has_chapter_store(json_file):
+            chapters = ChapterStore(json_file)  # Written in "indexed" mode
+        finished = False
+    else:
+        data = load_story(json_file)
+        chapters, summary, next_loop = data["story_chapters"], data.get("story_summary", ""), data.get("next_loop")
+        summary_state = data.get("summary_state")
+        finished = "complete_synopsis" in data
+    if not chapters:
+        raise ValueError(f"No chapters to resume from in {json_file}")
+    if next_loop is None:
+        next_loop = len(chapters) - 1  # The first chapter is the initial prompt
+    return {"chapters": chapters, "summary": summary, "summary_state": summary_state, "next_loop": next_loop,
+            "finished": finished}
+
+def open_story_storage(json_file, mode="jsonl", fsync_policy="always"):
+    """Create the storage backend for a story: "jsonl" (append-only log), "json" (rewrite per chapter)
+    or "indexed" (memory-mapped chapter store)."""
+    if mode == "jsonl":
+        return JsonlStoryStorage(json_file, fsync_policy)
+    if mode == "json":
+        return JsonStoryStorage(json_file)
+    if mode == "indexed":
+        return IndexedStoryStorage(json_file, fsync_policy)
+    raise ValueError(f"Unknown storage mode '{mode}', expected 'jsonl', 'json' or 'indexed'")
@@ -0,0 +1,103 @@
+import atexit
+import argparse
+
+# Only argparse is imported up front: each subcommand imports its script (and with it
+# scikit-learn, numpy, psutil or httpx) when it runs, so `--help` returns at once.
+
+MODEL_NAME = 'llama3'
+
+def register_service_cleanup():
+    """Stop the Ollama service and free GPU memory on exit, as the individual scripts do."""
+    from ollama_utils import stop_ollama_service, clear_gpu_memory
+    atexit.register(stop_ollama_service)
+    atexit.register(clear_gpu_memory)
+
+def configure_batch(script, args):
+    """Copy the shared post-processing options onto a script's module settings."""
+    script.MODEL_NAME = args.model
+    script.BATCH_MODE = args.batch
+    if args.directory:
+        script.DIRECTORY_PATH = args.directory
+    if args.workers:
+        script.BATCH_WORKERS = args.workers
+
+def run_story(args):
+    """Generate a new story, or continue an interrupted one."""
+    import make_story
+    make_story.MODEL_NAME = args.model
+    make_story.INITIAL_PROMPT = args.prompt or make_story.INITIAL_PROMPT
+    make_story.LOOPS = args.loops or make_story.LOOPS
+    make_story.PERSONA_TO_USE = args.persona or make_story.PERSONA_TO_USE
+    make_story.OUTPUT_DIR = args.output_dir or make_story.OUTPUT_DIR
+    make_story.JSON_FILE = args.output
+    make_story.RESUME_FROM = args.resume
+    register_service_cleanup()
+    make_story.main()
+
+def run_summarize(args):
+    """Write the 10-word chapter summaries."""
+    import summarize_chapters
+    configure_batch(summarize_chapters, args)
+    register_service_cleanup()
+    summarize_chapters.main(args.story_file)
+
+def run_prompts(args):
+    """Write the chapter summaries with positive and negative AI prompts."""
+    import summarize_chapters_add_ai_prompts
+    configure_batch(summarize_chapters_add_ai_prompts, args)
+    register_service_cleanup()
+    summarize_chapters_add_ai_prompts.main(args.story_file)
+
+def run_trim(args):
+    """Write the shortened scene descriptions."""
+    import trim_json
+    configure_batch(trim_json, args)
+    if args.pose_file:
+        trim_json.POSE_JSON_FILE = args.pose_file
+    register_service_cleanup()
+    trim_json.main(args.story_file)
+
+def add_post_processing_options(parser):
+    """Options shared by the summarize, prompts and trim subcommands."""
+    parser.add_argument("--story-file", default=None, help="Process this *_story.json instead of the latest one")
+    parser.add_argument("--batch", action="store_true",
+                        help="Process every storyline in --directory that has no up-to-date output")
+    parser.add_argument("--directory", default=None, help="Directory scanned for storylines (default: storylines)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes in batch mode")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Create, summarize and trim storylines with Ollama.")
+    parser.add_argument("--model", default=MODEL_NAME)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    story = subcommands.add_parser("story", help="Generate a story (make_story.py)")
+    story.add_argument("--prompt", default=None, help="Opening line of the story")
+    story.add_argument("--loops", type=int, default=None, help="Chapters to generate")
+    story.add_argument("--persona", default=None, help="Author whose style the story imitates")
+    story.add_argument("--output", default=None, help="Story file to write (default: a new timestamped file)")
+    story.add_argument("--output-dir", default=None, help="Directory for new timestamped story files")
+    story.add_argument("--resume", default=None, metavar="STORY_FILE",
+                       help="Continue an interrupted *_story.json (or its .log.jsonl)")
+    story.set_defaults(run=run_story)
+
+    summarize = subcommands.add_parser("summarize", help="Summarize chapters (summarize_chapters.py)")
+    add_post_processing_options(summarize)
+    summarize.set_defaults(run=run_summarize)
+
+    prompts = subcommands.add_parser("prompts", help="Summarize chapters with AI prompts "
+                                                     "(summarize_chapters_add_ai_prompts.py)")
+    add_post_processing_options(prompts)
+    prompts.set_defaults(run=run_prompts)
+
+    trim = subcommands.add_parser("trim", help="Shorten scene descriptions (trim_json.py)")
+    add_post_processing_options(trim)
+    trim.add_argument("--pose-file", default=None, help="Output file for a single storyline (default: pose.json)")
+    trim.set_defaults(run=run_trim)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
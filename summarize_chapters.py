@@ -1,55 +1,67 @@
 import os
 import time
-import json
 import atexit
+from functools import partial
 from datetime import datetime
 from ollama_utils import (
     install_and_setup_ollama,
     kill_existing_ollama_service,
     clear_gpu_memory,
-    start_ollama_service_windows,
+    start_ollama_service,
     stop_ollama_service,
-    is_windows,
-    get_story_response_from_model
+    get_story_response_from_model,
+    print_response_cache_stats
 )
+from batch_utils import run_batch
+from story_storage import load_story, write_story_json
+from call_metrics import write_call_metrics_report
+from artifact_store import fill_chapter_artifacts, print_artifact_store_stats
 
 # GLOBAL VARIABLES #
 MODEL_NAME = 'llama3'
 DIRECTORY_PATH = 'storylines'  # Directory where the JSON file is created (default is current directory)
+BATCH_MODE = False  # Process every storyline in DIRECTORY_PATH without an up-to-date summary instead of only the latest
+BATCH_WORKERS = 4  # Worker processes in batch mode; they all share the one running Ollama service
 
 SUMMARY_REQUEST_TEMPLATE = "Please summarize the following line in 10 words or less: \"{line}\""
 
 def find_latest_non_summarized_json_file(directory_path):
     """Find the latest non-summarized JSON file in the specified directory."""
-    json_files = [f for f in os.listdir(directory_path) if f.endswith('.json') and "_10_word_chapter_summaries" not in f]
+    json_files = [f for f in os.listdir(directory_path) if f.endswith('_story.json')]
     if not json_files:
         raise FileNotFoundError("No non-summarized JSON files found in the specified directory.")
     latest_file = max(json_files, key=lambda f: os.path.getmtime(os.path.join(directory_path, f)))
     return os.path.join(directory_path, latest_file)
 
+def summary_output_path_for(json_file_path):
+    """Extract the base name of the JSON file and append _10_word_chapter_summaries.json."""
+    base_name = os.path.basename(json_file_path)
+    summary_file_name = f"{base_name.split('.')[0]}_10_word_chapter_summaries.json"
+    return os.path.join(os.path.dirname(json_file_path), summary_file_name)
+
 def summarize_line(model_name, line):
     """Summarize a single line using the model."""
     summary_prompt = SUMMARY_REQUEST_TEMPLATE.format(line=line)
-    summary = get_story_response_from_model(model_name, summary_prompt).strip()
-    return summary
+    summary = get_story_response_from_model(model_name, summary_prompt, use_cache=True, caller="chapter_summary")
+    return (summary or "").strip()  # An empty summary is not stored, so it is requested again next run
 
 def summarize_story_chapters(json_file_path, model_name):
     """Summarize each chapter in the story and save as summaries."""
-    with open(json_file_path, 'r') as f:
-        data = json.load(f)
-
+    data = load_story(json_file_path)  # Chapters come from the story's memory-mapped store when it has one
     story_chapters = data.get("story_chapters", [])
     main_character = data.get("main_character", "")
     story_summary = data.get("story_summary", "")
-    summarized_chapters = []
 
-    for index, chapter in enumerate(story_chapters):
+    def summarize_chapter(index, chapter):
         print(f"Summarizing chapter {index + 1}/{len(story_chapters)}")
-        chapter_summary = summarize_line(model_name, chapter)
-        summarized_chapters.append({
-            "chapter": chapter,
-            "chapter_summary": chapter_summary
-        })
+        return summarize_line(model_name, chapter)
+
+    # Summaries already produced by any script for the same chapter text are reused
+    chapter_summaries = fill_chapter_artifacts(story_chapters, "summary", model_name, summarize_chapter)
+    summarized_chapters = (  # Streamed into the output file below
+        {"chapter": chapter, "chapter_summary": chapter_summary}
+        for chapter, chapter_summary in zip(story_chapters, chapter_summaries)
+    )
 
     # Create the new JSON structure
     summarized_data = {
@@ -58,18 +70,14 @@ def summarize_story_chapters(json_file_path, model_name):
         "main_character": main_character
     }
 
-    # Extract the base name of the JSON file and append _10_word_chapter_summaries.json
-    base_name = os.path.basename(json_file_path)
-    summary_file_name = f"{base_name.split('.')[0]}_10_word_chapter_summaries.json"
-    summary_output_path = os.path.join(os.path.dirname(json_file_path), summary_file_name)
-
-    with open(summary_output_path, 'w') as f:
-        json.dump(summarized_data, f, indent=2, ensure_ascii=False)
+    summary_output_path = summary_output_path_for(json_file_path)
+    write_story_json(summary_output_path, summarized_data)
 
     print(f"Summaries saved to {summary_output_path}")
+    return summary_output_path
 
-def main():
-    global MODEL_NAME, DIRECTORY_PATH
+def main(story_file=None):
+    """Summarize the given storyline, or the latest one (every pending one in BATCH_MODE)."""
 
     start_time = time.time()
 
@@ -78,16 +86,24 @@ def main():
 
     install_and_setup_ollama(MODEL_NAME)
 
-    if is_windows():
-        start_ollama_service_windows()
-        time.sleep(10)
-
-    # Find the latest non-summarized JSON file in the specified directory
-    latest_json_file = find_latest_non_summarized_json_file(DIRECTORY_PATH)
-    print(f"Processing latest non-summarized JSON file: {latest_json_file}")
-
-    # Summarize the story chapters in the latest JSON file
-    summarize_story_chapters(latest_json_file, MODEL_NAME)
+    start_ollama_service()
+
+    if BATCH_MODE:
+        # Summarize every storyline that has no up-to-date summary file
+        run_batch("summarize_chapters", partial(summarize_story_chapters, model_name=MODEL_NAME),
+                  DIRECTORY_PATH, summary_output_path_for, BATCH_WORKERS)
+    elif story_file:
+        summarize_story_chapters(story_file, MODEL_NAME)
+    else:
+        # Find the latest non-summarized JSON file in the specified directory
+        latest_json_file = find_latest_non_summarized_json_file(DIRECTORY_PATH)
+        print(f"Processing latest non-summarized JSON file: {latest_json_file}")
+
+        # Summarize the story chapters in the latest JSON file
+        summarize_story_chapters(latest_json_file, MODEL_NAME)
+    print_response_cache_stats()
+    print_artifact_store_stats()
+    write_call_metrics_report("summarize_chapters")
 
     stop_ollama_service()
     clear_gpu_memory()
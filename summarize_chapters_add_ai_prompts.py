@@ -2,20 +2,34 @@ import os
 import time
 import json
 import atexit
+from functools import partial
+import asyncio
 from datetime import datetime
 from ollama_utils import (
     install_and_setup_ollama,
     kill_existing_ollama_service,
     clear_gpu_memory,
-    start_ollama_service_windows,
+    start_ollama_service,
     stop_ollama_service,
-    is_windows,
-    get_story_response_from_model
+    get_story_response_from_model,
+    get_story_response_from_model_async,
+    make_ollama_client,
+    print_response_cache_stats
 )
+from batch_utils import run_batch
+from story_storage import load_story, write_story_json
+from call_metrics import write_call_metrics_report
+from artifact_store import load_chapter_artifacts, save_chapter_artifact, print_artifact_store_stats
 
 # GLOBAL VARIABLES #
 MODEL_NAME = 'llama3'
 DIRECTORY_PATH = 'storylines'  # Directory where the JSON file is created (default is current directory)
+BATCH_MODE = False  # Process every storyline in DIRECTORY_PATH without an up-to-date summary instead of only the latest
+BATCH_WORKERS = 4  # Worker processes in batch mode; they all share the one running Ollama service
+ASYNC_MODE = True  # Dispatch all chapter requests concurrently instead of one after another
+CONCURRENCY_LIMIT = 4  # Max in-flight requests in async mode; match OLLAMA_NUM_PARALLEL on the server
+CALL_MODE = 'combined'  # 'combined' asks for all three fields in one JSON response per chapter; 'separate' makes three calls
+PROMPT_MODE = 'stable_prefix'  # 'stable_prefix' sends the few-shot examples as a byte-stable system message so the server's prompt cache is reused; 'single' sends one combined user message
 
 SUMMARY_REQUEST_TEMPLATE = "Please summarize the following line in 10 words or less: \"{line}\""
 
@@ -53,59 +67,333 @@ NEGATIVE_AI_PROMPT_TEMPLATE = (
     "Only reply back with the prompt itself and nothing more."
 )
 
+# Stable-prefix variants: the examples and instructions never change, only the storyline message does
+POSITIVE_AI_PROMPT_SYSTEM = (
+    POSITIVE_EXAMPLES +
+    "Based on the storyline you are given, create a positive AI prompt in 300 characters or less in the same style.\n"
+    "Only reply back with the prompt itself and nothing more."
+)
+
+NEGATIVE_AI_PROMPT_SYSTEM = (
+    NEGATIVE_EXAMPLES +
+    "Based on the storyline you are given, create a negative AI prompt in 300 characters or less in the same style specifying what should be avoided.\n"
+    "Only reply back with the prompt itself and nothing more."
+)
+
+AI_PROMPT_STORYLINE_TEMPLATE = "Storyline:\n\"{line}\""
+
+AI_PROMPT_REQUESTS = {
+    "positive": (POSITIVE_AI_PROMPT_TEMPLATE, POSITIVE_AI_PROMPT_SYSTEM),
+    "negative": (NEGATIVE_AI_PROMPT_TEMPLATE, NEGATIVE_AI_PROMPT_SYSTEM)
+}
+
+# Combined mode: one structured call returns every missing field, validated against a schema and the limits below
+CHAPTER_FIELDS = ("chapter_summary", "positive_ai_prompt", "negative_ai_prompt")
+
+CHAPTER_FIELD_ARTIFACTS = {  # field -> artifact type in the shared chapter artifact store
+    "chapter_summary": "summary",
+    "positive_ai_prompt": "positive_prompt",
+    "negative_ai_prompt": "negative_prompt"
+}
+
+CHAPTER_FIELD_LIMITS = {  # field -> (max words, max characters)
+    "chapter_summary": (10, None),
+    "positive_ai_prompt": (None, 300),
+    "negative_ai_prompt": (None, 300)
+}
+
+CHAPTER_FIELD_EXAMPLES = {
+    "positive_ai_prompt": POSITIVE_EXAMPLES,
+    "negative_ai_prompt": NEGATIVE_EXAMPLES
+}
+
+CHAPTER_FIELD_INSTRUCTIONS = {
+    "chapter_summary": "\"chapter_summary\": the storyline summarized in 10 words or less",
+    "positive_ai_prompt": "\"positive_ai_prompt\": a positive AI prompt in 300 characters or less in the same style as "
+                          "the positive examples",
+    "negative_ai_prompt": "\"negative_ai_prompt\": a negative AI prompt in 300 characters or less in the same style as "
+                          "the negative examples specifying what should be avoided"
+}
+
+STRUCTURED_OUTPUT = 'schema'  # 'schema' sends the field schema as Ollama's format (0.5+); 'json' for older servers
+
 def find_latest_non_summarized_json_file(directory_path):
     """Find the latest non-summarized JSON file in the specified directory."""
-    json_files = [f for f in os.listdir(directory_path) if f.endswith('.json') and "_10_word_chapter_summaries" not in f]
+    json_files = [f for f in os.listdir(directory_path) if f.endswith('_story.json')]
     if not json_files:
         raise FileNotFoundError("No non-summarized JSON files found in the specified directory.")
     latest_file = max(json_files, key=lambda f: os.path.getmtime(os.path.join(directory_path, f)))
     return os.path.join(directory_path, latest_file)
 
+def summary_output_path_for(json_file_path):
+    """Extract the base name of the JSON file and append _10_word_chapter_summaries.json."""
+    base_name = os.path.basename(json_file_path)
+    summary_file_name = f"{base_name.split('.')[0]}_10_word_chapter_summaries.json"
+    return os.path.join(os.path.dirname(json_file_path), summary_file_name)
+
 def summarize_line(model_name, line):
     """Summarize a single line using the model."""
     summary_prompt = SUMMARY_REQUEST_TEMPLATE.format(line=line)
-    summary = get_story_response_from_model(model_name, summary_prompt).strip()
-    return summary
+    summary = get_story_response_from_model(model_name, summary_prompt, use_cache=True, caller="chapter_summary")
+    return (summary or "").strip()  # An empty summary is not stored, so it is requested again next run
 
-def generate_positive_ai_prompt(model_name, line):
-    """Generate a positive AI prompt for a single line using the model."""
-    positive_ai_prompt = POSITIVE_AI_PROMPT_TEMPLATE.format(line=line)
-    prompt_response = get_story_response_from_model(model_name, positive_ai_prompt).strip()
-    # Ensure the generated prompt is within 300 characters
+def limit_ai_prompt(prompt_response):
+    """Ensure the generated prompt is within 300 characters."""
+    prompt_response = (prompt_response or "").strip()
     if len(prompt_response) > 300:
         prompt_response = prompt_response[:297] + "..."
     return prompt_response
 
-def generate_negative_ai_prompt(model_name, line):
+def build_ai_prompt_messages(kind, line):
+    """Return the (system_message, user_message) pair for a "positive" or "negative" AI prompt request."""
+    template, system_message = AI_PROMPT_REQUESTS[kind]
+    if PROMPT_MODE == 'stable_prefix':
+        return system_message, AI_PROMPT_STORYLINE_TEMPLATE.format(line=line)
+    return None, template.format(line=line)
+
+def generate_ai_prompt(model_name, kind, line, stats=None):
+    """Generate a positive or negative AI prompt for a single line using the model."""
+    system_message, user_message = build_ai_prompt_messages(kind, line)
+    return limit_ai_prompt(get_story_response_from_model(model_name, user_message, use_cache=True, max_chars=300,
+                                                         stats=stats, system_message=system_message,
+                                                         caller="ai_prompt"))
+
+def generate_positive_ai_prompt(model_name, line, stats=None):
+    """Generate a positive AI prompt for a single line using the model."""
+    return generate_ai_prompt(model_name, "positive", line, stats)
+
+def generate_negative_ai_prompt(model_name, line, stats=None):
     """Generate a negative AI prompt for a single line using the model."""
-    negative_ai_prompt = NEGATIVE_AI_PROMPT_TEMPLATE.format(line=line)
-    prompt_response = get_story_response_from_model(model_name, negative_ai_prompt).strip()
-    # Ensure the generated prompt is within 300 characters
-    if len(prompt_response) > 300:
-        prompt_response = prompt_response[:297] + "..."
-    return prompt_response
+    return generate_ai_prompt(model_name, "negative", line, stats)
+
+def format_prompt_eval_counts(**stats_by_call):
+    """Describe how many prompt tokens the server evaluated for each named call."""
+    def describe(stats):
+        if stats.get("cached"):
+            return "cached"
+        return stats.get("prompt_eval_count") if stats.get("prompt_eval_count") is not None else "n/a"
+    return "prompt tokens evaluated: " + ", ".join(f"{name} {describe(stats)}" for name, stats in stats_by_call.items())
 
-def summarize_story_chapters(json_file_path, model_name):
+def chapter_fields_schema(fields):
+    """JSON schema of an object holding the given chapter fields as strings."""
+    return {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields)
+    }
+
+def structured_format(fields):
+    """The format sent with a combined request for the given fields."""
+    return chapter_fields_schema(fields) if STRUCTURED_OUTPUT == 'schema' else "json"
+
+def combined_request_system(fields):
+    """Instructions for a combined request; byte-stable for a given set of fields."""
+    return (
+        "".join(CHAPTER_FIELD_EXAMPLES.get(field, "") for field in fields) +
+        "For the storyline you are given, reply with a JSON object with exactly these keys:\n" +
+        ",\n".join(CHAPTER_FIELD_INSTRUCTIONS[field] for field in fields) + ".\n"
+        "Only reply back with the JSON object and nothing more."
+    )
+
+def build_combined_messages(line, fields=CHAPTER_FIELDS):
+    """Return the (system_message, user_message) pair for the combined structured request."""
+    system_message = combined_request_system(fields)
+    if PROMPT_MODE == 'stable_prefix':
+        return system_message, AI_PROMPT_STORYLINE_TEMPLATE.format(line=line)
+    return None, system_message + "\n\n" + AI_PROMPT_STORYLINE_TEMPLATE.format(line=line)
+
+def validate_chapter_fields(response, fields=CHAPTER_FIELDS):
+    """Parse a combined response and return only the requested fields that match the schema and their limits."""
+    try:
+        data = json.loads(response)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    valid = {}
+    for field in fields:
+        max_words, max_chars = CHAPTER_FIELD_LIMITS[field]
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            continue
+        value = value.strip()
+        if (max_words is not None and len(value.split()) > max_words) or \
+                (max_chars is not None and len(value) > max_chars):
+            continue
+        valid[field] = value
+    return valid
+
+def build_field_request(field, line):
+    """Return (system_message, user_message, max_chars) for the individual call that produces one field."""
+    if field == "chapter_summary":
+        return None, SUMMARY_REQUEST_TEMPLATE.format(line=line), None
+    kind = "positive" if field == "positive_ai_prompt" else "negative"
+    system_message, user_message = build_ai_prompt_messages(kind, line)
+    return system_message, user_message, 300
+
+def field_caller(field):
+    """Metrics tag of the individual call that produces a field."""
+    return "chapter_summary" if field == "chapter_summary" else "ai_prompt"
+
+def finish_field(field, response):
+    """Clean up an individual call's response the same way the separate mode does."""
+    if field == "chapter_summary":
+        return (response or "").strip()
+    return limit_ai_prompt(response)
+
+def request_fields_individually(model_name, chapter, fields):
+    """Produce each field with its own call, returning the fields and the per-call stats."""
+    values, stats_by_field = {}, {}
+    for field in fields:
+        system_message, user_message, max_chars = build_field_request(field, chapter)
+        stats_by_field[field] = {}
+        values[field] = finish_field(field, get_story_response_from_model(
+            model_name, user_message, use_cache=True, max_chars=max_chars, stats=stats_by_field[field],
+            system_message=system_message, caller=field_caller(field)
+        ))
+    return values, stats_by_field
+
+def summarize_chapter_combined(model_name, chapter, fields=CHAPTER_FIELDS):
+    """Produce the given fields for a chapter with one structured call, falling back per field on invalid output."""
+    stats = {}
+    system_message, user_message = build_combined_messages(chapter, fields)
+    response = get_story_response_from_model(model_name, user_message, use_cache=True, stats=stats,
+                                             system_message=system_message, response_format=structured_format(fields),
+                                             caller="chapter_fields")
+    values = validate_chapter_fields(response, fields)
+    missing = [field for field in fields if field not in values]
+    if missing:
+        print(f"Combined response failed validation for {', '.join(missing)}; falling back to individual calls")
+    fallback_values, fallback_stats = request_fields_individually(model_name, chapter, missing)
+    values.update(fallback_values)
+    print(format_prompt_eval_counts(combined=stats, **fallback_stats))
+    return {field: values[field] for field in fields}
+
+def compute_chapter_fields(model_name, chapter, fields):
+    """Produce the given fields for a chapter in the configured CALL_MODE."""
+    if CALL_MODE == 'combined' and len(fields) > 1:
+        return summarize_chapter_combined(model_name, chapter, fields)
+    values, stats_by_field = request_fields_individually(model_name, chapter, fields)
+    print(format_prompt_eval_counts(**stats_by_field))
+    return values
+
+def load_chapter_fields(story_chapters, model_name):
+    """Look up every chapter's already computed fields in the shared artifact store."""
+    known = [{} for _ in story_chapters]
+    for field, artifact_type in CHAPTER_FIELD_ARTIFACTS.items():
+        for chapter_fields, value in zip(known, load_chapter_artifacts(story_chapters, artifact_type, model_name)):
+            if value is not None:
+                chapter_fields[field] = value
+    return known
+
+def save_chapter_fields(chapter, model_name, values):
+    """Save freshly computed fields to the shared artifact store."""
+    for field, value in values.items():
+        save_chapter_artifact(chapter, CHAPTER_FIELD_ARTIFACTS[field], model_name, value)
+
+async def _run_chapter_request(client, semaphore, model_name, user_message, max_chars=None, system_message=None,
+                               stats=None, response_format=None, caller=None):
+    """Send one chapter request once a concurrency slot is free."""
+    async with semaphore:
+        return await get_story_response_from_model_async(client, model_name, user_message, use_cache=True,
+                                                         max_chars=max_chars, stats=stats,
+                                                         system_message=system_message,
+                                                         response_format=response_format, caller=caller)
+
+async def _request_fields_individually_async(client, semaphore, model_name, chapter, fields):
+    """Async counterpart of request_fields_individually; the calls run concurrently."""
+    field_requests = [build_field_request(field, chapter) for field in fields]
+    stats_by_field = {field: {} for field in fields}
+    responses = await asyncio.gather(*(
+        _run_chapter_request(client, semaphore, model_name, user_message, max_chars=max_chars,
+                             system_message=system_message, stats=stats_by_field[field], caller=field_caller(field))
+        for field, (system_message, user_message, max_chars) in zip(fields, field_requests)
+    ))
+    return {field: finish_field(field, response) for field, response in zip(fields, responses)}, stats_by_field
+
+async def summarize_chapter_combined_async(client, semaphore, model_name, chapter, fields=CHAPTER_FIELDS):
+    """Async counterpart of summarize_chapter_combined; returns the fields and the per-call stats."""
+    stats = {}
+    system_message, user_message = build_combined_messages(chapter, fields)
+    response = await _run_chapter_request(client, semaphore, model_name, user_message, system_message=system_message,
+                                          stats=stats, response_format=structured_format(fields),
+                                          caller="chapter_fields")
+    values = validate_chapter_fields(response, fields)
+    missing = [field for field in fields if field not in values]
+    if missing:
+        print(f"Combined response failed validation for {', '.join(missing)}; falling back to individual calls")
+    fallback_values, fallback_stats = await _request_fields_individually_async(client, semaphore, model_name,
+                                                                               chapter, missing)
+    values.update(fallback_values)
+    return {field: values[field] for field in fields}, {"combined": stats, **fallback_stats}
+
+async def summarize_chapters_async(story_chapters, known_fields, model_name, concurrency_limit):
+    """Compute the missing fields of every chapter concurrently, saving each chapter's fields as they arrive."""
+    semaphore = asyncio.Semaphore(concurrency_limit)
+    client = make_ollama_client(asynchronous=True, pool_size=concurrency_limit)
+    pending = {}
+    for index, chapter in enumerate(story_chapters):
+        missing = [field for field in CHAPTER_FIELDS if field not in known_fields[index]]
+        if missing and chapter not in pending:
+            pending[chapter] = (index, missing)
+    completed = 0
+
+    async def run_chapter(index, chapter, fields):
+        nonlocal completed
+        if CALL_MODE == 'combined' and len(fields) > 1:
+            values, stats_by_call = await summarize_chapter_combined_async(client, semaphore, model_name, chapter,
+                                                                           fields)
+        else:
+            values, stats_by_call = await _request_fields_individually_async(client, semaphore, model_name,
+                                                                             chapter, fields)
+        # The artifact store is SQLite; saving in a thread keeps the other requests streaming
+        await asyncio.to_thread(save_chapter_fields, chapter, model_name, values)
+        completed += 1
+        print(f"Summarized chapter {index + 1} ({completed}/{len(pending)} done, "
+              f"{format_prompt_eval_counts(**stats_by_call)})")
+        return chapter, values
+
+    try:
+        results = dict(await asyncio.gather(*(run_chapter(index, chapter, fields)
+                                              for chapter, (index, fields) in pending.items())))
+    finally:
+        await client.close()
+    for chapter, chapter_fields in zip(story_chapters, known_fields):
+        chapter_fields.update(results.get(chapter, {}))
+
+def summarize_story_chapters(json_file_path, model_name, async_mode=None, concurrency_limit=None):
     """Summarize each chapter in the story and save as summaries."""
-    with open(json_file_path, 'r') as f:
-        data = json.load(f)
+    async_mode = ASYNC_MODE if async_mode is None else async_mode
+    concurrency_limit = concurrency_limit or CONCURRENCY_LIMIT
 
+    data = load_story(json_file_path)  # Chapters come from the story's memory-mapped store when it has one
     story_chapters = data.get("story_chapters", [])
     main_character = data.get("main_character", "")
     story_summary = data.get("story_summary", "")
-    summarized_chapters = []
+    # Fields already produced by any script for the same chapter text are reused, only the rest are requested
+    known_fields = load_chapter_fields(story_chapters, model_name)
+    missing_count = sum(1 for chapter_fields in known_fields if len(chapter_fields) < len(CHAPTER_FIELDS))
+    print(f"{len(story_chapters) - missing_count} of {len(story_chapters)} chapters already have every field stored")
 
-    for index, chapter in enumerate(story_chapters):
-        print(f"Summarizing chapter {index + 1}/{len(story_chapters)}")
-        chapter_summary = summarize_line(model_name, chapter)
-        positive_ai_prompt = generate_positive_ai_prompt(model_name, chapter)
-        negative_ai_prompt = generate_negative_ai_prompt(model_name, chapter)
-        summarized_chapters.append({
-            "chapter": chapter,
-            "chapter_summary": chapter_summary,
-            "positive_ai_prompt": positive_ai_prompt,
-            "negative_ai_prompt": negative_ai_prompt
-        })
+    if async_mode:
+        print(f"Summarizing {missing_count} chapters with up to {concurrency_limit} concurrent requests")
+        asyncio.run(summarize_chapters_async(story_chapters, known_fields, model_name, concurrency_limit))
+    else:
+        computed = {}
+        for index, chapter in enumerate(story_chapters):
+            missing = [field for field in CHAPTER_FIELDS if field not in known_fields[index]]
+            if not missing:
+                continue
+            if chapter not in computed:
+                print(f"Summarizing chapter {index + 1}/{len(story_chapters)}")
+                computed[chapter] = compute_chapter_fields(model_name, chapter, missing)
+                save_chapter_fields(chapter, model_name, computed[chapter])
+            known_fields[index].update(computed[chapter])
+
+    summarized_chapters = (  # Streamed into the output file below
+        {"chapter": chapter, **{field: chapter_fields[field] for field in CHAPTER_FIELDS}}
+        for chapter, chapter_fields in zip(story_chapters, known_fields)
+    )
 
     # Create the new JSON structure
     summarized_data = {
@@ -114,18 +402,14 @@ def summarize_story_chapters(json_file_path, model_name):
         "main_character": main_character
     }
 
-    # Extract the base name of the JSON file and append _10_word_chapter_summaries.json
-    base_name = os.path.basename(json_file_path)
-    summary_file_name = f"{base_name.split('.')[0]}_10_word_chapter_summaries.json"
-    summary_output_path = os.path.join(os.path.dirname(json_file_path), summary_file_name)
-
-    with open(summary_output_path, 'w') as f:
-        json.dump(summarized_data, f, indent=2, ensure_ascii=False)
+    summary_output_path = summary_output_path_for(json_file_path)
+    write_story_json(summary_output_path, summarized_data)
 
     print(f"Summaries saved to {summary_output_path}")
+    return summary_output_path
 
-def main():
-    global MODEL_NAME, DIRECTORY_PATH
+def main(story_file=None):
+    """Summarize the given storyline, or the latest one (every pending one in BATCH_MODE)."""
 
     start_time = time.time()
 
@@ -134,16 +418,24 @@ def main():
 
     install_and_setup_ollama(MODEL_NAME)
 
-    if is_windows():
-        start_ollama_service_windows()
-        time.sleep(10)
+    start_ollama_service()
 
-    # Find the latest non-summarized JSON file in the specified directory
-    latest_json_file = find_latest_non_summarized_json_file(DIRECTORY_PATH)
-    print(f"Processing latest non-summarized JSON file: {latest_json_file}")
+    if BATCH_MODE:
+        # Summarize every storyline that has no up-to-date summary file
+        run_batch("summarize_chapters_add_ai_prompts", partial(summarize_story_chapters, model_name=MODEL_NAME),
+                  DIRECTORY_PATH, summary_output_path_for, BATCH_WORKERS)
+    elif story_file:
+        summarize_story_chapters(story_file, MODEL_NAME)
+    else:
+        # Find the latest non-summarized JSON file in the specified directory
+        latest_json_file = find_latest_non_summarized_json_file(DIRECTORY_PATH)
+        print(f"Processing latest non-summarized JSON file: {latest_json_file}")
 
-    # Summarize the story chapters in the latest JSON file
-    summarize_story_chapters(latest_json_file, MODEL_NAME)
+        # Summarize the story chapters in the latest JSON file
+        summarize_story_chapters(latest_json_file, MODEL_NAME)
+    print_response_cache_stats()
+    print_artifact_store_stats()
+    write_call_metrics_report("summarize_chapters_add_ai_prompts")
 
     stop_ollama_service()
     clear_gpu_memory()
@@ -0,0 +1,146 @@
+import types
+import threading
+import pytest
+import call_policy
+from call_policy import CircuitBreaker, call_with_policy
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(call_policy, "time", types.SimpleNamespace(time=fake.time, sleep=fake.sleep))
+    return fake
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=5, max_cooldown=12)
+    monkeypatch.setattr(call_policy, "CIRCUIT_BREAKER", breaker)
+    monkeypatch.setitem(call_policy.CALL_POLICIES, "test", {"retries": 2, "backoff_base": 0, "hedge": False})
+    return breaker
+
+def open_circuit(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(object())
+
+def test_circuit_opens_after_consecutive_failures(breaker):
+    for _ in range(breaker.failure_threshold - 1):
+        breaker.record_failure(object())
+    assert breaker.wait_time(object()) == 0
+    breaker.record_failure(object())
+    assert breaker.wait_time(object()) == pytest.approx(5)
+    assert breaker.times_opened == 1
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure(object())
+    breaker.record_failure(object())
+    breaker.record_success(object())
+    breaker.record_failure(object())
+    assert breaker.wait_time(object()) == 0
+
+def test_only_one_trial_call_after_the_cooldown(breaker, clock):
+    open_circuit(breaker)
+    clock.now += 5
+    trial, other = object(), object()
+    assert breaker.wait_time(trial) == 0
+    assert breaker.wait_time(other) > 0
+    assert breaker.trial is trial
+
+def test_failed_trial_reopens_with_doubled_capped_cooldown(breaker, clock):
+    open_circuit(breaker)
+    for expected_cooldown in (10, 12, 12):
+        clock.now += breaker.cooldown
+        trial = object()
+        assert breaker.wait_time(trial) == 0
+        breaker.record_failure(trial)
+        assert breaker.cooldown == expected_cooldown
+        assert breaker.wait_time(object()) == pytest.approx(expected_cooldown)
+
+def test_successful_trial_closes_the_circuit(breaker, clock):
+    open_circuit(breaker)
+    clock.now += 5
+    trial = object()
+    breaker.wait_time(trial)
+    breaker.record_failure(trial)
+    clock.now += 10
+    trial = object()
+    breaker.wait_time(trial)
+    breaker.record_success(trial)
+    assert breaker.wait_time(object()) == 0
+    assert breaker.cooldown == 5
+    assert breaker.trial is None
+
+def test_late_failure_does_not_extend_an_open_circuit(breaker, clock):
+    open_circuit(breaker)
+    opened_until = breaker.open_until
+    clock.now += 5
+    trial = object()
+    breaker.wait_time(trial)
+    breaker.record_failure(object())  # A call that started before the circuit opened
+    assert breaker.open_until == opened_until
+    assert breaker.trial is trial
+
+def test_only_the_trial_holder_can_release_it(breaker, clock):
+    open_circuit(breaker)
+    clock.now += 5
+    trial = object()
+    breaker.wait_time(trial)
+    breaker.release_trial(object())
+    assert breaker.trial is trial
+    breaker.release_trial(trial)
+    assert breaker.wait_time(object()) == 0
+
+def test_cancelled_call_releases_the_trial(breaker, clock):
+    open_circuit(breaker)
+    clock.now += 5
+    cancel_event = threading.Event()
+    cancel_event.set()
+    stats = {}
+    result = call_with_policy("test", lambda attempt_stats, cancel: pytest.fail("should not run"), stats,
+                              lambda error: True, cancel_event)
+    assert result is None and stats["cancelled"]
+    assert breaker.trial is None
+    assert breaker.wait_time(object()) == 0
+
+def test_cancelled_attempt_releases_the_trial_without_closing(breaker, clock):
+    open_circuit(breaker)
+    clock.now += 5
+
+    def run_attempt(attempt_stats, cancel):
+        attempt_stats.update(cancelled=True, total_time=None)
+        return None
+
+    call_with_policy("test", run_attempt, {}, lambda error: True)
+    assert breaker.trial is None
+    assert breaker.open_until is not None
+
+def test_retryable_errors_are_retried_and_open_the_circuit(breaker):
+    attempts = []
+
+    def run_attempt(attempt_stats, cancel):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("down")
+        attempt_stats["total_time"] = 0.1
+        return "answer"
+
+    stats = {}
+    assert call_with_policy("test", run_attempt, stats, lambda error: isinstance(error, ConnectionError)) == "answer"
+    assert stats["retries"] == 2
+    assert breaker.wait_time(object()) == 0  # Two failures stay below the threshold; the success resets them
+
+def test_non_retryable_error_is_raised_at_once(breaker):
+    def run_attempt(attempt_stats, cancel):
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call_with_policy("test", run_attempt, {}, lambda error: isinstance(error, ConnectionError))
+    assert breaker.failures == 0
@@ -0,0 +1,145 @@
+import time
+import asyncio
+import httpx
+import pytest
+from mock_ollama_server import MockOllamaServer
+from ollama_utils import OllamaEndpointPool, AsyncOllamaEndpointPool, OllamaUnavailableError
+
+MESSAGES = [{"role": "user", "content": "Continue the story."}]
+
+@pytest.fixture
+def servers():
+    servers = [MockOllamaServer(latency=0.0, token_rate=10000, response_words=5, seed=index) for index in range(2)]
+    for server in servers:
+        server.start()
+    yield servers
+    for server in servers:
+        server.stop()
+
+@pytest.fixture
+def pool(servers):
+    pool = OllamaEndpointPool([server.url for server in servers], probe_interval=60)
+    yield pool
+    pool.close()
+
+def test_calls_are_spread_over_the_endpoints(servers, pool):
+    for _ in range(4):
+        assert pool.chat("llama3", MESSAGES)
+    assert [server.requests for server in servers] == [2, 2]
+
+def test_failing_endpoint_is_taken_out_of_rotation(servers, pool):
+    servers[0].error_rate = 1.0
+    for _ in range(3):
+        assert pool.chat("llama3", MESSAGES)
+    assert servers[0].requests == 1
+    assert servers[1].requests == 3
+    assert [endpoint.healthy for endpoint in pool.endpoints] == [False, True]
+
+def test_unreachable_endpoint_fails_over(servers, pool):
+    servers[0].stop()
+    assert pool.chat("llama3", MESSAGES)
+    assert pool.chat("llama3", MESSAGES)
+    assert servers[1].requests == 2
+    assert not pool.endpoints[0].healthy
+
+def test_recovered_endpoint_returns_after_its_probe(servers):
+    pool = OllamaEndpointPool([server.url for server in servers], probe_interval=0.1)
+    try:
+        servers[0].error_rate = 1.0
+        pool.chat("llama3", MESSAGES)
+        assert not pool.endpoints[0].healthy
+        servers[0].error_rate = 0.0
+        time.sleep(0.15)
+        for _ in range(2):
+            pool.chat("llama3", MESSAGES)
+        assert pool.endpoints[0].healthy
+        assert servers[0].requests == 2
+    finally:
+        pool.close()
+
+def test_error_is_raised_when_every_endpoint_fails(servers, pool):
+    for server in servers:
+        server.error_rate = 1.0
+    with pytest.raises(httpx.HTTPStatusError):
+        pool.chat("llama3", MESSAGES)
+    assert [server.requests for server in servers] == [1, 1]
+
+def test_unavailable_when_no_endpoint_answers(servers, pool):
+    for server in servers:
+        server.stop()
+    with pytest.raises(httpx.TransportError):
+        pool.chat("llama3", MESSAGES)
+    with pytest.raises(OllamaUnavailableError):
+        pool.chat("llama3", MESSAGES)
+
+def test_async_pool_fails_over(servers):
+    servers[0].error_rate = 1.0
+
+    async def run():
+        pool = AsyncOllamaEndpointPool([server.url for server in servers], probe_interval=60)
+        try:
+            return [await pool.chat("llama3", MESSAGES) for _ in range(3)]
+        finally:
+            await pool.close()
+
+    assert all(asyncio.run(run()))
+    assert servers[1].requests == 3
+
+def test_async_response_records_first_token_and_is_cached(servers, tmp_path, monkeypatch):
+    import ollama_utils
+    from response_cache import ResponseCache
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(ollama_utils, "RESPONSE_CACHE", cache)
+    monkeypatch.setattr(ollama_utils, "RESPONSE_CACHE_ENABLED", True)
+
+    async def run(stats):
+        client = ollama_utils.AsyncOllamaClient(servers[0].url)
+        try:
+            return await ollama_utils.get_story_response_from_model_async(client, "llama3", "Continue the story.",
+                                                                          use_cache=True, stats=stats)
+        finally:
+            await client.close()
+
+    first_stats, second_stats = {}, {}
+    response = asyncio.run(run(first_stats))
+    assert response
+    assert 0 < first_stats["time_to_first_token"] <= first_stats["total_time"]
+    assert asyncio.run(run(second_stats)) == response
+    assert second_stats["cached"]
+    assert servers[0].requests == 1
+    cache.close()
+
+def test_load_model_uses_the_profiles_context_size(servers, monkeypatch):
+    import ollama_utils
+    client = ollama_utils.OllamaClient(servers[0].url)
+    sent = []
+    post = client._http.post
+    monkeypatch.setattr(client._http, "post", lambda path, json: sent.append(json) or post(path, json=json))
+    try:
+        client.load_model("llama3")
+        client.unload_model("llama3")
+    finally:
+        client.close()
+    assert [payload["options"]["num_ctx"] for payload in sent] == [ollama_utils.OLLAMA_NUM_CTX] * 2
+    assert sent[1]["keep_alive"] == 0
+
+def test_shared_client_is_created_once_across_threads(monkeypatch):
+    import ollama_utils
+    from concurrent.futures import ThreadPoolExecutor
+    created = []
+
+    class SlowClient:
+        def __init__(self):
+            time.sleep(0.05)
+            created.append(self)
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(ollama_utils, "OLLAMA_CLIENT", None)
+    monkeypatch.setattr(ollama_utils, "make_ollama_client", SlowClient)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        clients = list(pool.map(lambda _: ollama_utils.get_ollama_client(), range(4)))
+    ollama_utils.close_ollama_client()
+    assert len(created) == 1
+    assert all(client is created[0] for client in clients)
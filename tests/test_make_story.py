@@ -0,0 +1,68 @@
+import pytest
+import make_story
+
+@pytest.mark.parametrize("score, kept", [(0.59, "rewrite"), (0.6, "rewrite"), (0.61, "previous")])
+def test_choose_summary_keeps_the_previous_summary_above_the_threshold(monkeypatch, score, kept):
+    monkeypatch.setattr(make_story, "calculate_cosine_similarity", lambda text1, text2: score)
+    summaries = {"previous": "The old summary.", "rewrite": "The new summary."}
+    assert make_story.choose_summary(summaries["previous"], summaries["rewrite"]) == summaries[kept]
+
+def test_choose_summary_keeps_the_previous_summary_when_the_update_failed():
+    assert make_story.choose_summary("The old summary.", None) == "The old summary."
+
+@pytest.fixture
+def summary_calls(monkeypatch):
+    calls = []
+
+    def fake_response(model_name, user_message, caller=None, profile=None, **kwargs):
+        calls.append(profile or caller)
+        return f"Summary number {len(calls)}."
+
+    monkeypatch.setattr(make_story, "get_story_response_from_model", fake_response)
+    monkeypatch.setattr(make_story, "calculate_cosine_similarity", lambda text1, text2: 0.0)
+    return calls
+
+@pytest.mark.parametrize("strategy, calls_per_loop", [("every", 1), ("batched", 1 / 4), ("hierarchical", 1 / 3)])
+def test_summary_calls_per_loop(summary_calls, strategy, calls_per_loop):
+    maintainer = make_story.SummaryMaintainer("The story so far.", strategy=strategy, interval=4, merge_interval=3)
+    loops = 24
+    for loop_index in range(loops):
+        maintainer.add_line(f"Chapter {loop_index}.")
+    assert len(summary_calls) == loops * calls_per_loop
+
+def test_hierarchical_merges_only_every_merge_interval_chunks(summary_calls):
+    maintainer = make_story.SummaryMaintainer("The story so far.", strategy="hierarchical", interval=2, merge_interval=3)
+    for loop_index in range(10):
+        maintainer.add_line(f"Chapter {loop_index}.")
+    assert summary_calls == ["chunk_summary"] * 3 + ["summary_update"] + ["chunk_summary"] * 2
+    assert maintainer.state() == {"pending_lines": 0, "chunk_summaries": ["Summary number 5.", "Summary number 6."]}
+    assert maintainer.flush() == "Summary number 7."
+    assert summary_calls[-1] == "summary_update"
+    assert maintainer.state() == {"pending_lines": 0, "chunk_summaries": []}
+
+def test_speculative_round_of_duplicates_is_retried_then_stops(tmp_path, monkeypatch):
+    from ollama_utils import _reset_stats
+    from story_storage import load_story_checkpoint
+    calls = []
+
+    def fake_response(model_name, user_message, caller=None, stats=None, **kwargs):
+        calls.append(caller)
+        if stats is not None:
+            _reset_stats(stats)
+        return "The door creaked open and the girl stepped into the dark hallway alone."
+
+    monkeypatch.setattr(make_story, "get_story_response_from_model", fake_response)
+    monkeypatch.setattr(make_story, "SPECULATIVE_CANDIDATES", 2)
+    monkeypatch.setattr(make_story, "MAX_RETRIES", 2)
+    monkeypatch.setattr(make_story, "CORPUS_DUPLICATE_CHECK", False)
+    monkeypatch.setattr(make_story, "STORAGE_MODE", "json")
+    json_file = str(tmp_path / "test_story.json")
+
+    chapters = make_story.write_story_segment("llama3", "a beautiful girl...", 5, json_file)
+
+    assert len(chapters) == 2
+    # One round for the accepted chapter, then the first round of the next loop and MAX_RETRIES more
+    assert calls.count("continuation") == 2 + 2 * 3
+    checkpoint = load_story_checkpoint(json_file)
+    assert checkpoint["next_loop"] == 1
+    assert not checkpoint["finished"]
@@ -0,0 +1,27 @@
+import pytest
+from similarity_index import SimilarityIndex, text_similarity
+
+CHAPTERS = [f"The keeper climbed lighthouse tower {number} while storm {number % 7} broke over ship {number % 5}."
+            for number in range(40)]
+
+@pytest.mark.parametrize("window", [None, 1, 3, 10])
+def test_scores_match_pairwise_similarity_inside_the_window(window):
+    index = SimilarityIndex(CHAPTERS[:2], window=window)
+    for position, chapter in enumerate(CHAPTERS[2:], 2):
+        scores = index.scores(chapter)
+        first = 0 if window is None else max(0, position - window)
+        assert [chapter_index for chapter_index, _ in scores] == list(range(first, position))
+        for chapter_index, score in scores:
+            assert score == pytest.approx(text_similarity(CHAPTERS[chapter_index], chapter))
+        index.add(chapter)
+    assert len(index) == len(CHAPTERS)
+
+def test_resumed_index_only_holds_the_window():
+    index = SimilarityIndex(CHAPTERS, window=4)
+    assert len(index) == len(CHAPTERS)
+    assert index.most_similar(CHAPTERS[-1]) == (len(CHAPTERS) - 1, pytest.approx(1.0))
+    assert [chapter_index for chapter_index, _ in index.scores("storm")] == list(range(36, 40))
+
+def test_empty_index_has_no_scores():
+    assert SimilarityIndex().scores("storm") == []
+    assert SimilarityIndex().most_similar("storm") is None
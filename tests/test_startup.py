@@ -0,0 +1,16 @@
+import os
+import sys
+import subprocess
+import pytest
+from benchmark import STARTUP_COMMANDS, HEAVY_MODULES, parse_importtime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize("name", sorted(STARTUP_COMMANDS))
+def test_startup_does_not_import_heavy_modules(name):
+    result = subprocess.run([sys.executable, "-X", "importtime", *STARTUP_COMMANDS[name]], capture_output=True,
+                            text=True, cwd=REPO_DIR)
+    assert result.returncode == 0, result.stderr
+    _, modules = parse_importtime(result.stderr)
+    assert modules, "python -X importtime reported no imports"
+    assert [module for module in modules if module.split(".")[0] in HEAVY_MODULES] == []
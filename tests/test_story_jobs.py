@@ -0,0 +1,6 @@
+import make_story
+from story_jobs import StoryJob
+
+def test_loop_count_defaults_only_when_missing():
+    assert StoryJob("a beautiful girl...").loops == make_story.LOOPS
+    assert StoryJob("a beautiful girl...", loops=0).loops == 0
@@ -0,0 +1,98 @@
+import os
+import json
+from story_storage import (
+    CHAPTER_LENGTH,
+    ChapterStore,
+    JsonlStoryStorage,
+    chapter_log_path,
+    chapter_store_paths,
+    read_chapter_log,
+    load_story_checkpoint
+)
+
+def write_log(path, records, tail=b""):
+    with open(path, 'wb') as f:
+        for record in records:
+            f.write((json.dumps(record) + "\n").encode('utf-8'))
+        f.write(tail)
+
+def test_read_chapter_log_ignores_torn_last_line(tmp_path):
+    log_file = tmp_path / "story.log.jsonl"
+    records = [{"type": "chapter", "text": "One."}, {"type": "summary", "text": "A summary."},
+               {"type": "checkpoint", "next_loop": 1}]
+    write_log(log_file, records, tail=b'{"type": "chapter", "te')
+    state = read_chapter_log(log_file)
+    assert state["chapters"] == ["One."]
+    assert state["summary"] == "A summary."
+    assert state["next_loop"] == 1
+    assert state["valid_bytes"] == sum(len(json.dumps(record)) + 1 for record in records)
+
+def test_read_chapter_log_ignores_last_record_without_newline(tmp_path):
+    log_file = tmp_path / "story.log.jsonl"
+    write_log(log_file, [{"type": "chapter", "text": "One."}],
+              tail=json.dumps({"type": "chapter", "text": "Two."}).encode('utf-8'))
+    assert read_chapter_log(log_file)["chapters"] == ["One."]
+
+def test_jsonl_storage_resume_drops_torn_record(tmp_path):
+    json_file = str(tmp_path / "story.json")
+    storage = JsonlStoryStorage(json_file)
+    chapters = storage.start(["Prompt."], "Summary.")
+    chapters.append("One.")
+    storage.record(chapters, "Summary.", 1)
+    storage._log.close()
+    with open(chapter_log_path(json_file), 'ab') as f:
+        f.write(b'{"type": "chapter", "text": "Tor')  # Crash in the middle of the next record
+
+    checkpoint = load_story_checkpoint(json_file)
+    assert checkpoint["chapters"] == ["Prompt.", "One."]
+    assert checkpoint["next_loop"] == 1
+    storage = JsonlStoryStorage(json_file)
+    chapters = storage.start(checkpoint["chapters"], checkpoint["summary"], checkpoint["next_loop"])
+    chapters.append("Two.")
+    storage.record(chapters, "Summary.", 2)
+    storage._log.close()
+    assert read_chapter_log(chapter_log_path(json_file))["chapters"] == ["Prompt.", "One.", "Two."]
+
+def append_chapters(json_file, chapters):
+    with ChapterStore(json_file, writable=True) as store:
+        for chapter in chapters:
+            store.append(chapter)
+
+def test_chapter_store_reindexes_records_missing_from_index(tmp_path):
+    json_file = str(tmp_path / "story.json")
+    append_chapters(json_file, ["One.", "Twö.", "Three."])
+    data_path, index_path, _ = chapter_store_paths(json_file)
+    with open(index_path, 'r+b') as f:
+        f.truncate(8 + 3)  # Crash after the data was written but before the index: one entry and a torn one
+    with ChapterStore(json_file) as store:
+        assert list(store) == ["One."]
+    with ChapterStore(json_file, writable=True) as store:
+        assert list(store) == ["One.", "Twö.", "Three."]
+    assert os.path.getsize(index_path) == 3 * 8
+
+def test_chapter_store_truncates_torn_record(tmp_path):
+    json_file = str(tmp_path / "story.json")
+    append_chapters(json_file, ["One.", "Two."])
+    data_path, _, _ = chapter_store_paths(json_file)
+    complete_size = os.path.getsize(data_path)
+    with open(data_path, 'ab') as f:
+        f.write(CHAPTER_LENGTH.pack(100) + b"Only part of the")
+    with ChapterStore(json_file, writable=True) as store:
+        assert list(store) == ["One.", "Two."]
+        assert os.path.getsize(data_path) == complete_size
+        store.append("Three.")
+        assert store[-1] == "Three."
+    with ChapterStore(json_file) as store:
+        assert list(store) == ["One.", "Two.", "Three."]
+
+def test_chapter_store_drops_index_entry_whose_record_is_torn(tmp_path):
+    json_file = str(tmp_path / "story.json")
+    append_chapters(json_file, ["One.", "Two."])
+    data_path, _, _ = chapter_store_paths(json_file)
+    os.truncate(data_path, os.path.getsize(data_path) - 2)
+    with ChapterStore(json_file) as store:
+        assert list(store) == ["One."]
+    with ChapterStore(json_file, writable=True) as store:
+        store.append("Two again.")
+    with ChapterStore(json_file) as store:
+        assert list(store) == ["One.", "Two again."]
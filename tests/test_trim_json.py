@@ -0,0 +1,58 @@
+from collections import Counter
+import trim_json
+from trim_json import local_trim, shorten_description, MAX_DESCRIPTION_CHARS, LENGTH_RETRIES
+
+def test_line_within_the_limit_only_has_its_whitespace_collapsed():
+    assert local_trim("  Short   line. ", 60) == "Short line."
+
+def test_line_too_long_to_trim_locally_is_left_to_the_model():
+    assert local_trim("word " * 80) is None
+
+def test_parentheticals_are_dropped_first():
+    line = "The old lighthouse (abandoned since the storm of 1902) stood against the grey sky."
+    assert local_trim(line, 60) == "The old lighthouse stood against the grey sky."
+
+def test_descriptive_clauses_are_dropped():
+    line = "Emily climbed the stairs, which creaked under every step, and opened the door. The letter lay on the desk."
+    assert local_trim(line, 80) == "Emily climbed the stairs, and opened the door. The letter lay on the desk."
+
+def test_whole_sentences_are_dropped_from_the_end():
+    line = ("Emily climbed the narrow stairs to the attic. The letter lay on the dusty desk. "
+            "Rain hammered the roof. A candle flickered.")
+    assert local_trim(line, 80) == "Emily climbed the narrow stairs to the attic. The letter lay on the dusty desk."
+
+def test_trim_that_keeps_too_little_is_rejected():
+    line = "Emily climbed the narrow winding stairs all the way to the very top of the old house. Then she rested."
+    assert local_trim(line, 40) is None
+
+def fake_model(monkeypatch, responses):
+    calls = []
+
+    def send_line_to_ollama(model_name, line, prompt=trim_json.INITIAL_PROMPT):
+        calls.append(line)
+        return responses[min(len(calls), len(responses)) - 1]
+
+    monkeypatch.setattr(trim_json, "send_line_to_ollama", send_line_to_ollama)
+    return calls
+
+def test_shorten_description_skips_the_model_when_a_local_trim_works(monkeypatch):
+    calls = fake_model(monkeypatch, ["unused"])
+    counts = Counter()
+    line = ("The old lighthouse (abandoned since the great storm of 1902, when the keeper vanished) stood against "
+            "the grey sky. Emily climbed the stairs, which creaked under every step, and opened the door to the attic "
+            "room.")
+    assert len(shorten_description("llama3", line, counts)) <= MAX_DESCRIPTION_CHARS
+    assert calls == [] and counts == Counter(local=1)
+
+def test_shorten_description_retries_and_finally_truncates_overlong_responses(monkeypatch):
+    calls = fake_model(monkeypatch, ["overlong " * 50])
+    counts = Counter()
+    description = shorten_description("llama3", "long " * 100, counts)
+    assert len(calls) == LENGTH_RETRIES + 1
+    assert len(description) <= MAX_DESCRIPTION_CHARS and description.endswith("...")
+    assert counts == Counter(model=1, retries=LENGTH_RETRIES, truncated=1)
+
+def test_shorten_description_keeps_a_short_model_response(monkeypatch):
+    calls = fake_model(monkeypatch, ["A lighthouse in the storm."])
+    assert shorten_description("llama3", "long " * 100) == "A lighthouse in the storm."
+    assert len(calls) == 1
@@ -1,40 +1,39 @@
 import os
-import json
+import re
 import time
 import random
 import atexit
 from glob import glob
 from datetime import datetime
+from collections import Counter
 from ollama_utils import (
     install_and_setup_ollama,
     kill_existing_ollama_service,
     clear_gpu_memory,
-    start_ollama_service_windows,
+    start_ollama_service,
     stop_ollama_service,
-    is_windows,
-    get_story_response_from_model
+    get_story_response_from_model,
+    print_response_cache_stats
 )
+from batch_utils import run_batch
+from story_storage import write_json_atomic, load_story
+from call_metrics import write_call_metrics_report
+from artifact_store import fill_chapter_artifacts, print_artifact_store_stats
 
 MODEL_NAME = 'llama3'
 MAX_TOKENS = 70
 INITIAL_PROMPT = ("Shorten the following scene description to 200 characters or less retaining as much content as you can. "
                   "ONLY respond with the shortened version and nothing else.")
+RETRY_PROMPT = ("This scene description is {length} characters long. Shorten it to 200 characters or less retaining as "
+                "much content as you can. ONLY respond with the shortened version and nothing else.")
+MAX_DESCRIPTION_CHARS = 200  # Limit every shortened description must meet
+LOCAL_TRIM_MAX_CHARS = 320  # Lines up to this long are first compressed locally; longer ones go straight to the model
+LOCAL_TRIM_MIN_KEPT = 0.5  # A local trim must keep at least this fraction of the text, otherwise the model is used
+LENGTH_RETRIES = 2  # Extra model calls when a response is still over MAX_DESCRIPTION_CHARS
 POSE_JSON_FILE = "pose.json"
-
-def ensure_initial_json_structure(file_path):
-    initial_structure = {"activity": []}
-    if not os.path.exists(file_path):
-        with open(file_path, 'w') as f:
-            json.dump(initial_structure, f, indent=2)
-    else:
-        with open(file_path, 'r') as f:
-            try:
-                data = json.load(f)
-                if "activity" not in data:
-                    raise ValueError("Invalid JSON structure")
-            except (json.JSONDecodeError, ValueError):
-                with open(file_path, 'w') as f:
-                    json.dump(initial_structure, f, indent=2)
+DIRECTORY_PATH = 'storylines'  # Directory scanned for storylines in batch mode
+BATCH_MODE = False  # Trim every storyline in DIRECTORY_PATH into its own <story>_pose.json instead of only the latest
+BATCH_WORKERS = 4  # Worker processes in batch mode; they all share the one running Ollama service
 
 def get_latest_story_json_file(directory):
     """Get the latest _story.json file in the specified directory."""
@@ -42,63 +41,145 @@ def get_latest_story_json_file(directory):
     latest_file = max(json_files, key=os.path.getmtime)
     return latest_file
 
-def send_line_to_ollama(model_name, line):
-    retry_count = 0
-    while retry_count < 5:
-        try:
-            response = get_story_response_from_model(model_name,
-                f"{INITIAL_PROMPT} Scene: {line}")
-            if response:
-                # Return the response text trimmed of any surrounding whitespace.
-                return response.strip()
-            else:
-                retry_count += 1
-                print(f"Retrying... ({retry_count})")
-                time.sleep(1)
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            retry_count += 1
-            time.sleep(1)
+def pose_output_path_for(json_file_path):
+    """Return the per-storyline pose file used in batch mode."""
+    return f"{os.path.splitext(json_file_path)[0]}_pose.json"
+
+PARENTHETICAL_PATTERN = re.compile(r"\s*(\([^)]*\)|\[[^\]]*\]|\s[-\u2013\u2014]{1,2}\s[^-\u2013\u2014]*\s[-\u2013\u2014]{1,2}(?=\s))")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+CLAUSE_PATTERN = re.compile(r"(?<=[,;])\s+")
+# Clauses after a comma that start with one of these words add detail rather than the main action
+DROPPABLE_CLAUSE_PATTERN = re.compile(
+    r"^(which|who|whose|whom|while|as|although|though|because|since|where|whereas|with|without|each|both|even|"
+    r"almost|just|perhaps|maybe|and yet)\b", re.IGNORECASE
+)
+
+def drop_clauses(sentence):
+    """Remove descriptive clauses from a sentence, keeping its first clause and final punctuation."""
+    clauses = CLAUSE_PATTERN.split(sentence)
+    kept = [clauses[0]] + [clause for clause in clauses[1:] if not DROPPABLE_CLAUSE_PATTERN.match(clause)]
+    if len(kept) == len(clauses):
+        return sentence
+    trimmed = " ".join(kept).rstrip(",; ")
+    ending = sentence[-1] if sentence[-1] in ".!?" else ""
+    return trimmed.rstrip(".!?") + ending
+
+def local_trim(line, max_chars=MAX_DESCRIPTION_CHARS):
+    """Shorten a line without the model, or return None when it cannot be done without losing too much.
+
+    Lines within the limit pass through unchanged. Moderately long lines lose
+    parentheticals and descriptive clauses, then whole sentences from the end.
+    """
+    text = " ".join(line.split())
+    if len(text) <= max_chars:
+        return text
+    if len(text) > LOCAL_TRIM_MAX_CHARS:
+        return None
+    text = PARENTHETICAL_PATTERN.sub("", text)
+    if len(text) <= max_chars:
+        return text
+    sentences = [drop_clauses(sentence) for sentence in SENTENCE_PATTERN.split(text)]
+    compressed = " ".join(sentences)
+    if len(compressed) <= max_chars:
+        return compressed
+    # Keep whole sentences in story order while they fit
+    selected = []
+    for sentence in sentences:
+        if len(" ".join(selected + [sentence])) <= max_chars:
+            selected.append(sentence)
+    selected_text = " ".join(selected)
+    if selected and len(selected_text) >= LOCAL_TRIM_MIN_KEPT * len(text):
+        return selected_text
     return None
 
-def main():
+def truncate_at_word(text, max_chars=MAX_DESCRIPTION_CHARS):
+    """Cut text to max_chars at a word boundary as a last resort."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 3].rsplit(" ", 1)[0].rstrip(",;: ")
+    return cut + "..."
+
+def send_line_to_ollama(model_name, line, prompt=INITIAL_PROMPT):
+    """Ask the model to shorten a line; retries and timeouts come from the "trim" call policy."""
+    response = get_story_response_from_model(model_name, f"{prompt} Scene: {line}", use_cache=True, caller="trim")
+    # Return the response text trimmed of any surrounding whitespace, or None if the call failed
+    return response.strip() if response else None
+
+def shorten_description(model_name, line, counts=None):
+    """Shorten a line to MAX_DESCRIPTION_CHARS, calling the model only when local trimming fails.
+
+    Model responses are checked against the limit; an overlong one is compressed
+    locally if possible and otherwise sent back to be shortened again, up to
+    LENGTH_RETRIES times, before being cut at a word boundary.
+    """
+    counts = counts if counts is not None else Counter()
+    text = " ".join(line.split())
+    description = local_trim(text)
+    if description is not None:
+        counts["unchanged" if description == text else "local"] += 1
+        return description
+    counts["model"] += 1
+    description = send_line_to_ollama(model_name, line)
+    for attempt in range(LENGTH_RETRIES + 1):
+        if description is None or len(description) <= MAX_DESCRIPTION_CHARS:
+            return description
+        compressed = local_trim(description)
+        if compressed is not None:
+            return compressed
+        if attempt == LENGTH_RETRIES:
+            break
+        counts["retries"] += 1
+        print(f"Response is {len(description)} characters, over the {MAX_DESCRIPTION_CHARS} character limit; "
+              f"retrying ({attempt + 1}/{LENGTH_RETRIES})")
+        description = send_line_to_ollama(model_name, description,
+                                          RETRY_PROMPT.format(length=len(description))) or description
+    counts["truncated"] += 1
+    return truncate_at_word(description)
+
+def trim_story_file(json_file_path, pose_file=None):
+    """Shorten every chapter of a storyline into a pose file and return the pose file path."""
+    pose_file = pose_file or pose_output_path_for(json_file_path)
+
+    # Read initial story
+    story_chapters = load_story(json_file_path).get("story_chapters", [])  # Memory-mapped when the story has a chapter store
+
+    # Each trim is saved to the shared artifact store as soon as it is made, so reruns only trim new chapters
+    counts = Counter()
+    shortened_descriptions = fill_chapter_artifacts(story_chapters, "trim", MODEL_NAME,
+                                                    lambda index, line: shorten_description(MODEL_NAME, line, counts))
+    print(f"Trimmed {sum(counts[key] for key in ('unchanged', 'local', 'model'))} chapters: "
+          f"{counts['unchanged']} already short, {counts['local']} trimmed locally, {counts['model']} sent to the model "
+          f"({counts['retries']} length retries, {counts['truncated']} truncated)")
+    write_json_atomic(pose_file, {"activity": [description for description in shortened_descriptions if description]})
+    print(f"Shortened descriptions saved to {pose_file}")
+    return pose_file
+
+def main(story_file=None):
+    """Trim the given storyline, or the latest one (every pending one in BATCH_MODE)."""
     start_time = time.time()
 
     kill_existing_ollama_service()
     clear_gpu_memory()
     install_and_setup_ollama(MODEL_NAME)
 
-    if is_windows():
-        start_ollama_service_windows()
-        time.sleep(10)
+    start_ollama_service()
 
-    # Delete any existing pose.json file
-    if os.path.exists(POSE_JSON_FILE):
-        os.remove(POSE_JSON_FILE)
-        print(f"Deleted existing {POSE_JSON_FILE}")
-
-    # Ensure initial JSON structure
-    ensure_initial_json_structure(POSE_JSON_FILE)
-
-    # Discover the latest JSON file
-    directory = os.getcwd()
-    latest_json_file = get_latest_story_json_file(directory)
-    print(f"Latest JSON file found: {latest_json_file}")
+    if BATCH_MODE:
+        # Trim every storyline that has no up-to-date pose file
+        run_batch("trim_json", trim_story_file, DIRECTORY_PATH, pose_output_path_for, BATCH_WORKERS)
+    elif story_file:
+        trim_story_file(story_file, POSE_JSON_FILE)
+    else:
+        # Discover the latest JSON file
+        directory = os.getcwd()
+        latest_json_file = get_latest_story_json_file(directory)
+        print(f"Latest JSON file found: {latest_json_file}")
 
-    # Read initial story
-    with open(latest_json_file, 'r') as f:
-        data = json.load(f)
-        story_chapters = data.get("story_chapters", [])
-
-    for line in story_chapters:
-        shortened_description = send_line_to_ollama(MODEL_NAME, line)
-        if shortened_description:
-            with open(POSE_JSON_FILE, 'r') as f:
-                existing_data = json.load(f)
-            existing_data["activity"].append(shortened_description)
-            with open(POSE_JSON_FILE, 'w') as f:
-                json.dump(existing_data, f, indent=2, ensure_ascii=False)
+        trim_story_file(latest_json_file, POSE_JSON_FILE)
 
+    print_response_cache_stats()
+    print_artifact_store_stats()
+    write_call_metrics_report("trim_json")
     stop_ollama_service()
     clear_gpu_memory()
 